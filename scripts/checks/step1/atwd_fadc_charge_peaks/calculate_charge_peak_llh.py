@@ -22,13 +22,22 @@ well the data matches the templates.
 # Switched to argparse because it is the modern standard.
 # Optparse is deprecated
 import argparse
+import concurrent.futures
+import csv
 import json
+import os
+import sys
+from functools import partial
 
 import numpy as np
 from scipy import stats
 from scipy.stats import poisson
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.charge_histograms import load_charge_means
+from utils.qa_results_store import QAResultsStore
+
 def check_input_file(file: Path):
     """
     Check that the input file is a .npz file containing the required
@@ -52,11 +61,10 @@ def check_input_file(file: Path):
             )
 
         try:
-            with np.load(file) as data:
-                if "atwd_mean" not in data or "fadc_mean" not in data:
-                    raise ValueError(
-                        f'The file {file} does not contain the required arrays "atwd_mean" and "fadc_mean". Please check the file and try again.'
-                    )
+            if load_charge_means(file) is None:
+                raise ValueError(
+                    f'The file {file} does not contain the required arrays "atwd_mean" and "fadc_mean". Please check the file and try again.'
+                )
         except Exception as e:
             raise ValueError(f"Error occurred while loading the file {file}: {e}")
 
@@ -72,12 +80,14 @@ def load_mean_data(data_file: Path):
     - data_file: location of the run data file to use, should be a .npz file containing 'atwd_mean' and 'fadc_mean' arrays for the data, which will be histogrammed in the same way as the templates. The output will be two flattened arrays of the ATWD and FADC means for each DOM in the data file.
     """
     try:
-        data = np.load(data_file)
+        means = load_charge_means(data_file)
     except Exception as e:
         raise ValueError(f"Error occurred while loading the file {data_file}: {e}")
+    if means is None:
+        raise ValueError(f'The file {data_file} does not contain the required arrays "atwd_mean" and "fadc_mean".')
 
-    flat_atwd_mean_data = data["atwd_mean"].flatten()
-    flat_fadc_mean_data = data["fadc_mean"].flatten()
+    flat_atwd_mean_data = means[0].flatten()
+    flat_fadc_mean_data = means[1].flatten()
 
     return flat_atwd_mean_data, flat_fadc_mean_data
 
@@ -100,7 +110,20 @@ def create_mean_charge_hist(
 
     atwd, fadc = load_mean_data(data_file)
 
-    counts_template, xedges, yedges = np.histogram2d(
+    return histogram_means(atwd, fadc, nbins, lower_bound, upper_bound, density)
+
+def histogram_means(
+    atwd: np.ndarray,
+    fadc: np.ndarray,
+    nbins: int = 40,
+    lower_bound: float = 0.8,
+    upper_bound: float = 1.2,
+    density=False,
+):
+    """
+    Histogram flattened ATWD and FADC means the same way as the templates.
+    """
+    counts, xedges, yedges = np.histogram2d(
         atwd,
         fadc,
         bins=nbins,
@@ -108,7 +131,40 @@ def create_mean_charge_hist(
         density=density,
     )
 
-    return counts_template
+    return counts
+
+def mean_spread_stats(
+    flat_atwd_mean_data: np.ndarray,
+    flat_fadc_mean_data: np.ndarray,
+    lower_bound: float = 0.8,
+    upper_bound: float = 1.2,
+):
+    """
+    Pearson correlation coefficient and standard deviations of the ATWD and FADC means, using only DOMs inside [lower_bound, upper_bound].
+
+    Returns: (pearson_r, std_atwd, std_fadc)
+    """
+    # take the STD and correlation coefficient only for stuf in the same range as the LLH was calculated in ([lower_bound,upper_bound])
+    condition1 = (
+        flat_atwd_mean_data > lower_bound
+    )
+    condition2 = flat_atwd_mean_data < upper_bound
+    condition3 = flat_fadc_mean_data > lower_bound
+    condition4 = flat_fadc_mean_data < upper_bound
+
+    mask = condition1 & condition2 & condition3 & condition4
+
+    flat_atwd_mean_data_masked = flat_atwd_mean_data[mask]
+    flat_fadc_mean_data_masked = flat_fadc_mean_data[mask]
+
+    pearson_r = stats.pearsonr(
+        flat_atwd_mean_data_masked, flat_fadc_mean_data_masked
+    )[0]
+
+    std_atwd = np.std(flat_atwd_mean_data_masked)
+    std_fadc = np.std(flat_fadc_mean_data_masked)
+
+    return pearson_r, std_atwd, std_fadc
 
 def calc_llh(
     data_file: Path,
@@ -142,8 +198,9 @@ def calc_llh(
     flat_atwd_mean_data_test, flat_fadc_mean_data_test = load_mean_data(data_file)
 
     # histogram the data file with same binning as templates
-    counts_test_data = create_mean_charge_hist(
-        data_file,
+    counts_test_data = histogram_means(
+        flat_atwd_mean_data_test,
+        flat_fadc_mean_data_test,
         nbins=nbins,
         lower_bound=lower_bound,
         upper_bound=upper_bound,
@@ -188,25 +245,12 @@ def calc_llh(
     print(f"logL_unorrected: {logL_uncorr:.3f}")
     print(f"Delta_LLH: {(logL_corr - logL_uncorr):.3f}")
 
-    # take the STD and correlation coefficient only for stuf in the same range as the LLH was calculated in ([lower_bound,upper_bound])
-    condition1 = (
-        flat_atwd_mean_data_test > lower_bound
-    )  
-    condition2 = flat_atwd_mean_data_test < upper_bound
-    condition3 = flat_fadc_mean_data_test > lower_bound
-    condition4 = flat_fadc_mean_data_test < upper_bound
-
-    mask = condition1 & condition2 & condition3 & condition4
-
-    flat_atwd_mean_data_test_masked = flat_atwd_mean_data_test[mask]
-    flat_fadc_mean_data_test_masked = flat_fadc_mean_data_test[mask]
-
-    pearson_r = stats.pearsonr(
-        flat_atwd_mean_data_test_masked, flat_fadc_mean_data_test_masked
-    )[0]
-
-    std_atwd = np.std(flat_atwd_mean_data_test_masked)
-    std_fadc = np.std(flat_fadc_mean_data_test_masked)
+    pearson_r, std_atwd, std_fadc = mean_spread_stats(
+        flat_atwd_mean_data_test,
+        flat_fadc_mean_data_test,
+        lower_bound=lower_bound,
+        upper_bound=upper_bound,
+    )
 
     print(f"Pearson correlation coefficient: {pearson_r:.3f}")
     print(f"ATWD Standard Deviation: {std_atwd:.3f}")
@@ -222,106 +266,267 @@ def calc_llh(
     }
 
 
-parser = argparse.ArgumentParser(description="Calculate charge peak LLH")
-
-parser.add_argument(
-    "-i",
-    "--inloc",
-    type=Path,
-    help="if a file, .npz file containing the ATWD and FADC mean information for a DOM. If a folder, a folder containing .npz files at some level.",
-    required=True,
-)
-parser.add_argument(
-    "-n",
-    "--nbins",
-    type=int,
-    help="number of bins to use for the histogramming of the data file (should be the same as the templates). Default is 40.",
-    default=40,
-)
-parser.add_argument(
-    "--lower_bound",
-    type=float,
-    help="lower bound for the histogramming of the data file (should be the same as the templates). Default is 0.8.",
-    default=0.8,
-)
-parser.add_argument(
-    "--upper_bound",
-    type=float,
-    help="upper bound for the histogramming of the data file (should be the same as the templates). Default is 1.2.",
-    default=1.2,
-)
-parser.add_argument(
-    "--template_corrected",
-    type=Path,
-    help="location of the corrected template .npz file.",
-    required=True,
-)
-parser.add_argument(
-    "--template_uncorrected",
-    type=Path,
-    help="location of the uncorrected template .npz file.",
-    required=True,
-)
-
-args = parser.parse_args()
-
-# TODO: needs to be corrected for using pathlib
-inloc = args.inloc
-
-# setup the templates for corrected and uncorrected
-counts_corr = create_mean_charge_hist(
-    args.template_corrected,
-    nbins=args.nbins,
-    lower_bound=args.lower_bound,
-    upper_bound=args.upper_bound,
-    density=False,
-)
-counts_uncorr = create_mean_charge_hist(
-    args.template_uncorrected,
-    nbins=args.nbins,
-    lower_bound=args.lower_bound,
-    upper_bound=args.upper_bound,
-    density=False,
-)
-
-if args.inloc.is_file():
-    # if you input a single file, it should just do that file
-    if check_input_file(args.inloc):
-        print("Single File")
-        use_files = [args.inloc]
-elif args.inloc.is_dir():
-    # if you input a folder, it should be a year, and do the LLH calculation for each .npz file inside that folder (looking recursively at deeper folders...).
-    print("Folder")
-    # get all .npz files in the folder and subfolders, and check that they are valid before trying to use them
-    use_files = [file for file in args.inloc.rglob("*.npz") if check_input_file(file)]
-else:
-    print(
-        "Something went wrong with the file type to use!! Check that you are using a single .npz file or a folder containing runs with .npz files."
-    )
-    use_files = []
+BATCH_COLUMNS = [
+    "year",
+    "run",
+    "data_counts",
+    "logL_corr",
+    "logL_uncorr",
+    "delta_logL",
+    "pearson_r",
+    "std_atwd",
+    "std_fadc",
+    "data_file",
+]
+
+def load_batch_entry(
+    data_file: Path,
+    nbins: int = 40,
+    lower_bound: float = 0.8,
+    upper_bound: float = 1.2,
+):
+    """
+    Load one run data file for the batch LLH, reading it only once.
+
+    Returns a dict with the flattened 2D histogram of the means and the spread statistics, or None if the file does not contain 'atwd_mean' and 'fadc_mean'.
+    """
+    try:
+        means = load_charge_means(data_file)
+    except Exception as e:
+        print(f"Input file error: Error occurred while loading the file {data_file}: {e}")
+        return None
+    if means is None:
+        return None
+    atwd, fadc = means[0].flatten(), means[1].flatten()
 
-for data_file in use_files:
+    counts = histogram_means(atwd, fadc, nbins, lower_bound, upper_bound)
     try:
-        llhs = calc_llh(
-            data_file,
+        pearson_r, std_atwd, std_fadc = mean_spread_stats(atwd, fadc, lower_bound, upper_bound)
+    except ValueError:
+        # Not enough DOMs inside the bounds for a correlation
+        pearson_r, std_atwd, std_fadc = np.nan, np.nan, np.nan
+
+    return {
+        "year": data_file.parts[-3],
+        "run": data_file.parts[-2],
+        "data_file": str(data_file),
+        "counts": counts.flatten(),
+        "pearson_r": pearson_r,
+        "std_atwd": std_atwd,
+        "std_fadc": std_fadc,
+    }
+
+def calc_llh_batch(
+    data_files: list,
+    corr_template: np.ndarray,
+    uncorr_template: np.ndarray,
+    nbins: int = 40,
+    lower_bound: float = 0.8,
+    upper_bound: float = 1.2,
+    num_workers: int = 1,
+):
+    """
+    Calculate the log likelihoods of many run data files at once.
+
+    The files are loaded in parallel, their 2D histograms are stacked into one (runs x bins) array and the Poisson log likelihoods against both templates are evaluated in one vectorized call, summing over all bins where the template expectation is nonzero (as calc_llh does).
+
+    Returns: a dict of equally long columns, see BATCH_COLUMNS.
+    """
+    load = partial(load_batch_entry, nbins=nbins, lower_bound=lower_bound, upper_bound=upper_bound)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        entries = [entry for entry in executor.map(load, data_files, chunksize=16) if entry is not None]
+
+    table = {column: [] for column in BATCH_COLUMNS}
+    if not entries:
+        return table
+
+    counts = np.stack([entry["counts"] for entry in entries])
+
+    logls = {}
+    for name, template in (("corr", corr_template), ("uncorr", uncorr_template)):
+        flat_template = template.flatten()
+        mask = flat_template > 0
+        logls[name] = poisson.logpmf(counts[:, mask], flat_template[mask]).sum(axis=1)
+
+    for column in ("year", "run", "data_file", "pearson_r", "std_atwd", "std_fadc"):
+        table[column] = [entry[column] for entry in entries]
+    table["data_counts"] = counts.sum(axis=1).astype(int).tolist()
+    table["logL_corr"] = logls["corr"].tolist()
+    table["logL_uncorr"] = logls["uncorr"].tolist()
+    table["delta_logL"] = (logls["corr"] - logls["uncorr"]).tolist()
+    return table
+
+def write_batch_table(table: dict, outfile: Path):
+    """
+    Write the batch results as a CSV table, one row per run.
+    """
+    with open(outfile, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(BATCH_COLUMNS)
+        writer.writerows(zip(*(table[column] for column in BATCH_COLUMNS)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate charge peak LLH")
+
+    parser.add_argument(
+        "-i",
+        "--inloc",
+        type=Path,
+        help="if a file, .npz file containing the ATWD and FADC mean information for a DOM. If a folder, a folder containing .npz files at some level.",
+        required=True,
+    )
+    parser.add_argument(
+        "-n",
+        "--nbins",
+        type=int,
+        help="number of bins to use for the histogramming of the data file (should be the same as the templates). Default is 40.",
+        default=40,
+    )
+    parser.add_argument(
+        "--lower_bound",
+        type=float,
+        help="lower bound for the histogramming of the data file (should be the same as the templates). Default is 0.8.",
+        default=0.8,
+    )
+    parser.add_argument(
+        "--upper_bound",
+        type=float,
+        help="upper bound for the histogramming of the data file (should be the same as the templates). Default is 1.2.",
+        default=1.2,
+    )
+    parser.add_argument(
+        "--template_corrected",
+        type=Path,
+        help="location of the corrected template .npz file.",
+        required=True,
+    )
+    parser.add_argument(
+        "--template_uncorrected",
+        type=Path,
+        help="location of the uncorrected template .npz file.",
+        required=True,
+    )
+    parser.add_argument(
+        "--batch-output",
+        type=Path,
+        help="if given, run the vectorized batch LLH over all .npz files below --inloc and write one CSV table to this file instead of one JSON file per run.",
+        default=None,
+    )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        help="QA results store (SQLite) to also insert the LLH results into.",
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--num-workers",
+        type=int,
+        help="number of processes used to load the run files in batch mode. Default is the number of CPUs.",
+        default=os.cpu_count() or 1,
+    )
+
+    args = parser.parse_args()
+
+    # TODO: needs to be corrected for using pathlib
+    inloc = args.inloc
+
+    # setup the templates for corrected and uncorrected
+    counts_corr = create_mean_charge_hist(
+        args.template_corrected,
+        nbins=args.nbins,
+        lower_bound=args.lower_bound,
+        upper_bound=args.upper_bound,
+        density=False,
+    )
+    counts_uncorr = create_mean_charge_hist(
+        args.template_uncorrected,
+        nbins=args.nbins,
+        lower_bound=args.lower_bound,
+        upper_bound=args.upper_bound,
+        density=False,
+    )
+
+    if args.batch_output is not None:
+        batch_files = [args.inloc] if args.inloc.is_file() else sorted(args.inloc.rglob("*.npz"))
+        print(f"Batch mode, {len(batch_files)} files")
+        table = calc_llh_batch(
+            batch_files,
             counts_corr,
             counts_uncorr,
             args.nbins,
             lower_bound=args.lower_bound,
             upper_bound=args.upper_bound,
+            num_workers=args.num_workers,
         )
-    except Exception as e:
-        print(f"File error with file: {data_file}")
-        print(f"Error: {e}")
+        write_batch_table(table, args.batch_output)
+        if args.store is not None:
+            rows = [dict(zip(BATCH_COLUMNS, values)) for values in zip(*(table[column] for column in BATCH_COLUMNS))]
+            for row in rows:
+                row["corrected_template_file"] = str(args.template_corrected)
+                row["uncorrected_template_file"] = str(args.template_uncorrected)
+                row["source"] = str(args.batch_output)
+            with QAResultsStore(args.store) as store:
+                store.insert_llh_results(rows)
+        print(f"Wrote LLHs of {len(table['run'])} runs to {args.batch_output}")
+
+        low = [f"{year}/{run}" for year, run, delta in zip(table["year"], table["run"], table["delta_logL"]) if delta < 100]
+        if low:
+            raise ValueError(
+                f"LLH difference is less than 100 for runs {low}, which is unexpected. Please check the files and the templates to make sure they are correct."
+            )
+        return
+
+    if args.inloc.is_file():
+        # if you input a single file, it should just do that file
+        if check_input_file(args.inloc):
+            print("Single File")
+            use_files = [args.inloc]
+    elif args.inloc.is_dir():
+        # if you input a folder, it should be a year, and do the LLH calculation for each .npz file inside that folder (looking recursively at deeper folders...).
+        print("Folder")
+        # get all .npz files in the folder and subfolders, and check that they are valid before trying to use them
+        use_files = [file for file in args.inloc.rglob("*.npz") if check_input_file(file)]
+    else:
+        print(
+            "Something went wrong with the file type to use!! Check that you are using a single .npz file or a folder containing runs with .npz files."
+        )
+        use_files = []
+
+    for data_file in use_files:
+        try:
+            llhs = calc_llh(
+                data_file,
+                counts_corr,
+                counts_uncorr,
+                args.nbins,
+                lower_bound=args.lower_bound,
+                upper_bound=args.upper_bound,
+            )
+        except Exception as e:
+            print(f"File error with file: {data_file}")
+            print(f"Error: {e}")
+
+        llhs["data_file"] = str(data_file)
+        llhs["corrected_template_file"] = str(args.template_corrected)
+        llhs["uncorrected_template_file"] = str(args.template_uncorrected)
+
+        with open(data_file.parent / (f"{data_file.stem}_comparison_results.json"), "w") as f:
+            json.dump(llhs, f, indent=4)
 
-    llhs["data_file"] = str(data_file)
-    llhs["corrected_template_file"] = str(args.template_corrected)
-    llhs["uncorrected_template_file"] = str(args.template_uncorrected)
+        if args.store is not None:
+            with QAResultsStore(args.store) as store:
+                store.insert_llh_results([dict(llhs,
+                                               run=data_file.parts[-2],
+                                               year=data_file.parts[-3],
+                                               source=str(data_file))])
+
+        if llhs["delta_logL"] < 100:
+            raise ValueError(
+                f"LLH difference is less than 100 for file {data_file}, which is unexpected. Please check the file and the templates to make sure they are correct."
+            )
 
-    with open(data_file.parent / (f"{data_file.stem}_comparison_results.json"), "w") as f:
-        json.dump(llhs, f, indent=4)
 
-    if llhs["delta_logL"] < 100:
-        raise ValueError(
-            f"LLH difference is less than 100 for file {data_file}, which is unexpected. Please check the file and the templates to make sure they are correct."
-        )
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
 """
 This script takes the charge peak LLH delta files and checks if delta LLH is less than a certain value. If it is, it flags it as a problem. The results are saved to a summary file in JSON format, which includes lists of runs with no problems and runs with problems.
+
+With --store, the LLH results are read from the QA results store (utils/qa_results_store.py) instead of the per-run JSON files.
 """
 
 import json
 import argparse
 import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from utils.qa_results_store import QAResultsStore
 
 
 def main():
     parser = argparse.ArgumentParser(description="Check charge peak LLH delta")
-    parser.add_argument("--files", nargs='+', type=pathlib.Path, help="Path to the data file (JSON)")
+    parser.add_argument("--files", nargs='+', type=pathlib.Path, default=[], help="Path to the data file (JSON)")
+    parser.add_argument("--store", type=pathlib.Path, default=None, help="QA results store to read the LLH results from instead of --files")
     parser.add_argument("--summary-file", type=pathlib.Path, default="charge_peak_delta_summary.txt", help="Path to the summary output file")
     parser.add_argument("--llh-limit", type=float, default=100., help="Limit ")
     args = parser.parse_args()
@@ -17,6 +24,16 @@ def main():
     no_problems = []
     problems = []
 
+    if args.store is not None:
+        with QAResultsStore(args.store) as store:
+            flagged = store.llh_results(below=args.llh_limit)
+            passed = store.llh_results(above=args.llh_limit)
+        for year, run, delta_logL in flagged:
+            print(f"Charge peak LLH delta is outside the acceptable range: {delta_logL} for run: {year}/{run}")
+            problems.append((str(run), delta_logL))
+        no_problems.extend((str(run), delta_logL) for _, run, delta_logL in passed)
+        print(f"Checked {len(flagged) + len(passed)} runs from {args.store}")
+
     for fn in args.files:
         print(f"Checking file: {fn}")
         # Example file path
@@ -32,12 +49,12 @@ def main():
                 print(f"Charge peak LLH delta is within the acceptable range: {data['delta_logL']} from file: {fn}")
                 no_problems.append((run_number, data['delta_logL']))
 
-        with open(args.summary_file, 'w') as f:
-            out = {
-                "no_problems": no_problems,
-                "problems": problems
-            }
-            json.dump(out, f, indent=4)
+    with open(args.summary_file, 'w') as f:
+        out = {
+            "no_problems": no_problems,
+            "problems": problems
+        }
+        json.dump(out, f, indent=4)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,362 @@
+"""
+Incrementally update the run-level charge monitoring as Step1 outputs land.
+
+Runs are spread across bundles and processing waves, so the per-file
+`*.fadc_atwd_charge.npz` sidecars of a run show up over several days.
+Instead of regenerating every run from scratch with the Condor DAG
+(make_dag_online.py), this script keeps a per-run state file with the
+summed ATWD/FADC histograms and a ledger of the sidecars (by sha512) that
+were already folded in. Each invocation only reads sidecars that are new,
+and only refits the peaks and recomputes the charge peak LLH for runs whose
+state changed.
+
+The run-level outputs use the same layout and names as the DAG:
+{outdir}/{year}/{run}/Run{run}.fadc_atwd_charge.npz and
+{outdir}/{year}/{run}/Run{run}.fadc_atwd_charge_comparison_results.json,
+so check_charge_peak_delta.py keeps working on them.
+
+Updates of a run are serialized with an flock on a per-run lock file, and
+all outputs are written to a temporary file and renamed into place, so
+several nodes can run this script over overlapping inputs at the same time.
+"""
+
+import argparse
+import concurrent.futures
+import fcntl
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from glob import glob
+from os.path import join
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from calculate_charge_peak_llh import calc_llh, create_mean_charge_hist
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.charge_histograms import load_charge_histograms, load_start_time
+
+
+MONITORING_EXTRACTORS_DIR = Path(__file__).resolve().parents[3] / "icetray" / "step1" / "monitoring_extractors"
+CHARGE_PEAK_FIT_PATH = MONITORING_EXTRACTORS_DIR / "charge_peak_fit.py"
+CHARGE_PEAK_FIT_SPEC = importlib.util.spec_from_file_location("step1_charge_peak_fit", CHARGE_PEAK_FIT_PATH)
+if CHARGE_PEAK_FIT_SPEC is None or CHARGE_PEAK_FIT_SPEC.loader is None:
+    raise ImportError(f"Could not load charge peak fitting from {CHARGE_PEAK_FIT_PATH}")
+
+charge_peak_fit = importlib.util.module_from_spec(CHARGE_PEAK_FIT_SPEC)
+CHARGE_PEAK_FIT_SPEC.loader.exec_module(charge_peak_fit)
+
+SIDECAR_SUFFIX = ".fadc_atwd_charge.npz"
+RUN_NUMBER_PATTERN = re.compile(r"Run0*(\d+)")
+
+
+def get_sha512sum(filename: Path) -> str:
+    """Compute the SHA512 hash of the data in the specified file."""
+    h = hashlib.sha512()
+    b = bytearray(8192 * 1024)
+    mv = memoryview(b)
+    with open(str(filename), 'rb', buffering=0) as f:
+        for n in iter(lambda: f.readinto(mv), 0):
+            h.update(mv[:n])
+    return h.hexdigest()
+
+
+def get_run_number(sidecar: Path) -> Optional[int]:
+    match = RUN_NUMBER_PATTERN.search(sidecar.name)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def find_sidecars(indirs: list[str]) -> dict[tuple[str, int], list[Path]]:
+    """Group the per-file sidecars below {indir}/MMDD/ by (year, run).
+
+    Step1 output directories are laid out as {outdir}/YYYY/MMDD, so the
+    year is taken from the grandparent directory of each sidecar."""
+    sidecars_by_run: dict[tuple[str, int], list[Path]] = defaultdict(list)
+    for indir in indirs:
+        for sidecar in sorted(glob(join(indir, f"*/*{SIDECAR_SUFFIX}"))):
+            sidecar = Path(sidecar)
+            run = get_run_number(sidecar)
+            if run is None:
+                print(f"Warning: could not get run number from {sidecar}, skipping")
+                continue
+            year = sidecar.parent.parent.name
+            sidecars_by_run[(year, run)].append(sidecar)
+    return sidecars_by_run
+
+
+def atomic_savez(path: Path, **arrays) -> None:
+    """np.savez to a temporary file in the same directory, then rename."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp.npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_json(path: Path, payload: dict) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f, indent=4)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def run_lock(lock_path: Path):
+    """Exclusive lock for one run, shared between all nodes updating it."""
+    with open(lock_path, "a") as lock_fh:
+        fcntl.flock(lock_fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fh, fcntl.LOCK_UN)
+
+
+class RunState:
+    """Summed histograms of one run and the ledger of folded sidecars.
+
+    The ledger maps the sha512 of each folded sidecar to its file name. A
+    stat cache (name -> size, mtime, sha512) avoids rehashing sidecars that
+    were already seen."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.bins = None
+        self.atwd = None
+        self.fadc = None
+        self.start = None
+        self.ledger: dict[str, str] = {}
+        self.stat_cache: dict[str, list] = {}
+        if path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        with np.load(self.path) as data:
+            self.bins = data["bins"]
+            self.atwd = data["atwd"]
+            self.fadc = data["fadc"]
+            start = data["start"][()]
+            self.start = None if np.isnat(start) else start
+            book = json.loads(str(data["ledger"]))
+        self.ledger = book["ledger"]
+        self.stat_cache = book["stat_cache"]
+
+    def save(self) -> None:
+        book = {"ledger": self.ledger, "stat_cache": self.stat_cache}
+        atomic_savez(self.path,
+                     bins=self.bins,
+                     atwd=self.atwd,
+                     fadc=self.fadc,
+                     start=np.datetime64("NaT") if self.start is None else self.start,
+                     ledger=np.array(json.dumps(book, sort_keys=True)))
+
+    def cached_checksum(self, sidecar: Path) -> Optional[str]:
+        """sha512 of the sidecar if it was seen before and did not change."""
+        cached = self.stat_cache.get(sidecar.name)
+        if cached is None:
+            return None
+        stat = sidecar.stat()
+        size, mtime, checksum = cached
+        if size == stat.st_size and mtime == stat.st_mtime:
+            return checksum
+        return None
+
+    def fold(self, sidecar: Path, checksum: str) -> bool:
+        """Add a sidecar to the run. Returns False if it was already folded in."""
+        stat = sidecar.stat()
+        if checksum in self.ledger:
+            self.stat_cache[sidecar.name] = [stat.st_size, stat.st_mtime, checksum]
+            return False
+        if sidecar.name in self.stat_cache and self.stat_cache[sidecar.name][2] != checksum:
+            print(f"Warning: {sidecar} changed after it was folded into {self.path}. "
+                  "Remove the state file to rebuild the run.")
+            return False
+
+        data = load_charge_histograms(sidecar)
+        bins, start = data["bins"], load_start_time(data)
+        atwd = data["atwd"].astype(np.float64)
+        fadc = data["fadc"].astype(np.float64)
+        if self.bins is None:
+            self.bins = bins
+            self.atwd = np.zeros_like(atwd)
+            self.fadc = np.zeros_like(fadc)
+        elif not np.array_equal(self.bins, bins):
+            print(f"Warning: charge binning of {sidecar} does not match {self.path}, skipping")
+            return False
+
+        self.atwd += atwd
+        self.fadc += fadc
+        if start is not None and (self.start is None or start < self.start):
+            self.start = start
+        self.ledger[checksum] = sidecar.name
+        self.stat_cache[sidecar.name] = [stat.st_size, stat.st_mtime, checksum]
+        return True
+
+
+def write_run_histograms(state: RunState, outfile: Path, peak_fit_bounds: list[float]) -> None:
+    """Fit the summed histograms and write them like PulseChargeFilterHarvester."""
+    bin_mask = charge_peak_fit.peak_fit_bin_mask(state.bins, peak_fit_bounds)
+    atwd_mean, atwd_sigma = charge_peak_fit.estimate_peak(state.atwd, state.bins, bin_mask)
+    fadc_mean, fadc_sigma = charge_peak_fit.estimate_peak(state.fadc, state.bins, bin_mask)
+    atomic_savez(outfile,
+                 bounds=peak_fit_bounds,
+                 start=np.datetime64("NaT") if state.start is None else state.start,
+                 atwd=state.atwd.astype(np.float32),
+                 atwd_mean=atwd_mean,
+                 atwd_sigma=atwd_sigma,
+                 fadc=state.fadc.astype(np.float32),
+                 fadc_mean=fadc_mean,
+                 fadc_sigma=fadc_sigma,
+                 bins=state.bins)
+
+
+def update_run(year: str,
+               run: int,
+               sidecars: list[Path],
+               outdir: Path,
+               peak_fit_bounds: list[float],
+               templates: Optional[dict]) -> dict:
+    """Fold new sidecars into one run and refresh its fits and LLH if needed."""
+    run_outdir = outdir / year / str(run)
+    run_outdir.mkdir(parents=True, exist_ok=True)
+    state_path = run_outdir / f"Run{run}.monitoring_state.npz"
+    histogram_path = run_outdir / f"Run{run}{SIDECAR_SUFFIX}"
+
+    # Hash outside of the lock so that nodes working on the same run do
+    # not serialize on I/O. Unchanged, already folded sidecars are skipped
+    # using the stat cache of the last saved state.
+    state = RunState(state_path)
+    checksums = {}
+    for sidecar in sidecars:
+        checksum = state.cached_checksum(sidecar)
+        if checksum is None or checksum not in state.ledger:
+            checksums[sidecar] = get_sha512sum(sidecar)
+    if not checksums:
+        return {"run": run, "status": "UNCHANGED", "new_files": 0}
+
+    with run_lock(run_outdir / f"Run{run}.monitoring_state.lock"):
+        # Reload, another node may have updated the run in the meantime
+        state = RunState(state_path)
+        new_files = sum(state.fold(sidecar, checksum) for sidecar, checksum in checksums.items())
+        if new_files == 0:
+            return {"run": run, "status": "UNCHANGED", "new_files": 0}
+        state.save()
+
+        print(f"Run {run}: folded in {new_files} new files, refitting")
+        write_run_histograms(state, histogram_path, peak_fit_bounds)
+
+        result = {"run": run, "status": "UPDATED", "new_files": new_files}
+        if templates is not None:
+            llhs = calc_llh(histogram_path,
+                            templates["corrected"],
+                            templates["uncorrected"],
+                            templates["nbins"],
+                            lower_bound=templates["lower_bound"],
+                            upper_bound=templates["upper_bound"])
+            llhs["data_file"] = str(histogram_path)
+            llhs["corrected_template_file"] = str(templates["corrected_file"])
+            llhs["uncorrected_template_file"] = str(templates["uncorrected_file"])
+            atomic_write_json(run_outdir / f"{histogram_path.stem}_comparison_results.json", llhs)
+            result["delta_logL"] = llhs["delta_logL"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally update run-level charge monitoring from Step1 sidecars")
+    parser.add_argument("-i", "--indirs",
+                        type=str, nargs="+", required=True,
+                        help="Pass3 step1 folders containing all days (YYYY/ with MMDD/ below).")
+    parser.add_argument("-o", "--outdir",
+                        type=Path, required=True,
+                        help="Top-level directory for run-level outputs, {outdir}/{year}/{run}/.")
+    parser.add_argument("--runs",
+                        type=int, nargs="+", default=None,
+                        help="Only update these runs.")
+    parser.add_argument("--peak-fit-bounds",
+                        type=float, nargs=2, default=[0.6, 1.4],
+                        help="Charge range used for the peak fits. Default is 0.6 1.4.")
+    parser.add_argument("--template_corrected",
+                        type=Path, default=None,
+                        help="Corrected template .npz file. Together with --template_uncorrected enables the LLH.")
+    parser.add_argument("--template_uncorrected",
+                        type=Path, default=None,
+                        help="Uncorrected template .npz file.")
+    parser.add_argument("-n", "--nbins",
+                        type=int, default=40,
+                        help="Number of bins of the LLH histograms. Default is 40.")
+    parser.add_argument("--lower_bound",
+                        type=float, default=0.8,
+                        help="Lower bound of the LLH histograms. Default is 0.8.")
+    parser.add_argument("--upper_bound",
+                        type=float, default=1.2,
+                        help="Upper bound of the LLH histograms. Default is 1.2.")
+    parser.add_argument("--llh-limit",
+                        type=float, default=100.,
+                        help="Warn for runs with a delta LLH below this value. Default is 100.")
+    parser.add_argument("-j", "--num-workers",
+                        type=int, default=os.cpu_count() or 1,
+                        help="Number of runs to update in parallel.")
+    args = parser.parse_args()
+
+    templates = None
+    if args.template_corrected is not None and args.template_uncorrected is not None:
+        templates = {
+            "corrected_file": args.template_corrected,
+            "uncorrected_file": args.template_uncorrected,
+            "nbins": args.nbins,
+            "lower_bound": args.lower_bound,
+            "upper_bound": args.upper_bound,
+        }
+        for key, template in (("corrected", args.template_corrected), ("uncorrected", args.template_uncorrected)):
+            templates[key] = create_mean_charge_hist(template,
+                                                     nbins=args.nbins,
+                                                     lower_bound=args.lower_bound,
+                                                     upper_bound=args.upper_bound,
+                                                     density=False)
+
+    sidecars_by_run = find_sidecars(args.indirs)
+    if args.runs is not None:
+        runs = set(args.runs)
+        sidecars_by_run = {key: value for key, value in sidecars_by_run.items() if key[1] in runs}
+    print(f"Found sidecars for {len(sidecars_by_run)} runs")
+
+    updated = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = {
+            executor.submit(update_run, year, run, sidecars, args.outdir, args.peak_fit_bounds, templates): run
+            for (year, run), sidecars in sorted(sidecars_by_run.items())
+        }
+        for future in concurrent.futures.as_completed(futures):
+            run = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Run {run} failed to update: {e}")
+                continue
+            if result["status"] != "UPDATED":
+                continue
+            updated.append(run)
+            if "delta_logL" in result and result["delta_logL"] < args.llh_limit:
+                print(f"WARNING: Run {run} has delta LLH {result['delta_logL']:.3f} < {args.llh_limit}")
+
+    print(f"Updated {len(updated)} of {len(sidecars_by_run)} runs: {sorted(updated)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ import re
 import sys
 from collections import defaultdict
 
+from utils.campaign_catalog import CampaignCatalog
+
 
 def load_run_info(file3_path):
     """Loads run information (like start date) from File 3.
@@ -27,8 +29,8 @@ def load_run_info(file3_path):
     return run_info_map
 
 
-def find_missing_items(file1_path, file2_path):
-    # 1. Parse File 2 (JSON) and load into a set of (run_id, sub_run) tuples
+def load_existing_runs(file2_path):
+    """Loads the existing (run_id, sub_run) pairs from File 2."""
     try:
         with open(file2_path, "r") as f:
             file2_data = json.load(f)
@@ -36,11 +38,25 @@ def find_missing_items(file1_path, file2_path):
         print(f"Error reading or parsing JSON file '{file2_path}': {e}", file=sys.stderr)
         sys.exit(1)
 
-    existing_runs = {
+    return {
         (int(item["run_id"]), int(item["sub_run"])) for item in file2_data
     }
 
-    # 2. Parse File 1 (Text File)
+
+def load_catalog(catalog_path):
+    """Loads the existing (run, file number) outputs and the run information from a campaign catalog."""
+    with CampaignCatalog(catalog_path) as catalog:
+        existing_runs = {
+            (run, file_number)
+            for run, file_numbers in catalog.file_numbers("output_files").items()
+            for file_number in file_numbers
+        }
+        run_info_map = catalog.run_info()
+    return existing_runs, run_info_map
+
+
+def find_missing_items(file1_path, existing_runs):
+    # Parse File 1 (Text File) and check against the existing (run_id, sub_run) tuples
     line_pattern = re.compile(
         r"Run\s+(\d+)\s+is missing files!\s+Missing file numbers:\s+\[(.*?)\]"
     )
@@ -95,28 +111,38 @@ def main():
     )
     parser.add_argument(
         "-f2", "--file2",
-        required=True,
         help="Path to the JSON file containing existing runs (File 2)"
     )
     parser.add_argument(
         "-f3", "--file3",
-        required=True,
         help="Path to the JSON file containing run details and start dates (File 3)"
     )
+    parser.add_argument(
+        "--catalog",
+        help="Campaign catalog (see utils/campaign_catalog.py) to use instead of File 2 and File 3"
+    )
 
     args = parser.parse_args()
 
-    # Validate that all three files exist
-    for filepath in (args.file1, args.file2, args.file3):
+    if args.catalog is None and (args.file2 is None or args.file3 is None):
+        parser.error("--file2 and --file3 are required without --catalog")
+
+    # Validate that all files exist
+    inputs = (args.file1, args.catalog) if args.catalog is not None else (args.file1, args.file2, args.file3)
+    for filepath in inputs:
         if not os.path.isfile(filepath):
             print(f"Error: The file '{filepath}' does not exist.", file=sys.stderr)
             sys.exit(1)
 
-    # 1. Load run details (dates) from File 3
-    run_info = load_run_info(args.file3)
+    # 1. Load the existing files and the run details (dates)
+    if args.catalog is not None:
+        existing_runs, run_info = load_catalog(args.catalog)
+    else:
+        existing_runs = load_existing_runs(args.file2)
+        run_info = load_run_info(args.file3)
 
     # Run the comparison logic (returns a dict: {run_id: [sub_runs]})
-    results = find_missing_items(args.file1, args.file2)
+    results = find_missing_items(args.file1, existing_runs)
 
     # Output the results grouped by run_id
     if results:
@@ -4,6 +4,7 @@ Compare input and output accounting files to verify 1:1 file mapping.
 
 Usage:
     python3 compare_accounting.py <output_json> <input_ndjson>
+    python3 compare_accounting.py --directory <dir> [<dir> ...] [--recursive] [-j N] [--summary-output FILE]
 
 The output_json is formatted as:
     {
@@ -25,9 +26,17 @@ The input_ndjson is newline-delimited JSON, each line a file record:
 
 Extracts run number and file number from filenames (pattern: Run00XXXXXX_Subrun00000000_YYYYYYY)
 and verifies 1:1 mapping between input and output files.
+
+In directory mode every <bundle>.json is paired with the <uuid>*.ndjson manifest
+of the same bundle UUID in the same directory (the UUID from the first manifest
+record, as for the summary file name), all pairs are compared in a process pool
+and one aggregated summary with per-bundle details is written.
 """
 
+import argparse
+import concurrent.futures
 import json
+import os
 import sys
 import re
 from pathlib import Path
@@ -49,9 +58,17 @@ def extract_run_and_file_number(filename: str) -> Optional[Tuple[int, int]]:
     return None
 
 
-def load_output_accounting(output_json_path: Path) -> Dict[Tuple[int, int], Dict]:
+def _warn(message: str, warnings: Optional[List[str]]):
+    if warnings is None:
+        print(message, file=sys.stderr)
+    else:
+        warnings.append(message)
+
+
+def load_output_accounting(output_json_path: Path, warnings: Optional[List[str]] = None) -> Dict[Tuple[int, int], Dict]:
     """
     Load output accounting JSON and build map of (run, file_num) -> file_record.
+    Warnings are printed, or collected in warnings if given.
     """
     with open(output_json_path) as f:
         output_data = json.load(f)
@@ -67,15 +84,16 @@ def load_output_accounting(output_json_path: Path) -> Dict[Tuple[int, int], Dict
                 run_num, file_num = result
                 key = (run_num, file_num)
                 if key in output_map:
-                    print(f"WARNING: Duplicate (run, file_num) in output: {key}", file=sys.stderr)
+                    _warn(f"WARNING: Duplicate (run, file_num) in output: {key}", warnings)
                 output_map[key] = file_record
     
     return output_map
 
 
-def load_input_accounting(input_ndjson_path: Path) -> Dict[Tuple[int, int], Dict]:
+def load_input_accounting(input_ndjson_path: Path, warnings: Optional[List[str]] = None) -> Dict[Tuple[int, int], Dict]:
     """
     Load input accounting NDJSON and build map of (run, file_num) -> file_record.
+    Warnings are printed, or collected in warnings if given.
     """
     input_map = {}
     with open(input_ndjson_path) as f:
@@ -86,7 +104,7 @@ def load_input_accounting(input_ndjson_path: Path) -> Dict[Tuple[int, int], Dict
             try:
                 record = json.loads(line)
             except json.JSONDecodeError as e:
-                print(f"ERROR: Failed to parse JSON at line {line_num}: {e}", file=sys.stderr)
+                _warn(f"ERROR: Failed to parse JSON at line {line_num}: {e}", warnings)
                 continue
             
             logical_name = record.get("logical_name", "")
@@ -97,7 +115,7 @@ def load_input_accounting(input_ndjson_path: Path) -> Dict[Tuple[int, int], Dict
                 run_num, file_num = result
                 key = (run_num, file_num)
                 if key in input_map:
-                    print(f"WARNING: Duplicate (run, file_num) in input: {key}", file=sys.stderr)
+                    _warn(f"WARNING: Duplicate (run, file_num) in input: {key}", warnings)
                 input_map[key] = record
     
     return input_map
@@ -124,9 +142,10 @@ def extract_input_bundle_uuid(input_ndjson_path: Path) -> Optional[str]:
     return None
 
 
-def compare_accounting(output_map: Dict, input_map: Dict) -> Tuple[bool, Dict]:
+def compare_accounting(output_map: Dict, input_map: Dict, warnings: Optional[List[str]] = None) -> Tuple[bool, Dict]:
     """
     Compare input and output accounting maps.
+    Errors are printed, or collected in warnings if given.
     
     Returns:
         (is_valid, summary_dict)
@@ -152,19 +171,19 @@ def compare_accounting(output_map: Dict, input_map: Dict) -> Tuple[bool, Dict]:
     # Check for files only in input
     only_in_input = input_keys - output_keys
     if only_in_input:
-        print("ERROR: Files only in input (not in output):", file=sys.stderr)
+        _warn("ERROR: Files only in input (not in output):", warnings)
         for run_num, file_num in sorted(only_in_input):
             logical_name = input_map[(run_num, file_num)].get("logical_name", "")
-            print(f"  Run {run_num:06d}, File {file_num:07d}: {logical_name}", file=sys.stderr)
+            _warn(f"  Run {run_num:06d}, File {file_num:07d}: {logical_name}", warnings)
         summary["files_only_in_input"] = sorted(only_in_input)
     
     # Check for files only in output
     only_in_output = output_keys - input_keys
     if only_in_output:
-        print("ERROR: Files only in output (not in input):", file=sys.stderr)
+        _warn("ERROR: Files only in output (not in input):", warnings)
         for run_num, file_num in sorted(only_in_output):
             logical_name = output_map[(run_num, file_num)].get("logical_name", "")
-            print(f"  Run {run_num:06d}, File {file_num:07d}: {logical_name}", file=sys.stderr)
+            _warn(f"  Run {run_num:06d}, File {file_num:07d}: {logical_name}", warnings)
         summary["files_only_in_output"] = sorted(only_in_output)
 
     # Collect checksums for common files
@@ -192,21 +211,194 @@ def compare_accounting(output_map: Dict, input_map: Dict) -> Tuple[bool, Dict]:
     return is_valid, summary
 
 
-def main():
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <output_json> <input_ndjson>", file=sys.stderr)
-        sys.exit(1)
-    
-    output_json_path = Path(sys.argv[1])
-    input_ndjson_path = Path(sys.argv[2])
-    
+# Accounting-like JSON files that are not <bundle>.json output accounting
+NOT_ACCOUNTING = ("summary", "comparison", "contents", "duplicate_skip", "metadata", "check_mapping", "validation", "index")
+# run_step1.py moves a previous <uuid>.json aside as <uuid>_<time>.json after merging it
+BACKUP_PATTERN = re.compile(r"_\d+\.json$")
+
+
+def find_bundle_pairs(directories: List[Path], recursive: bool = False) -> Tuple[List[Tuple[str, Path, Path]], List[str], List[str]]:
+    """
+    Pair every <bundle>.json with the NDJSON manifest of the same bundle UUID in
+    the same directory.
+
+    Returns:
+        ([(bundle_uuid, output_json, input_ndjson), ...], unpaired_outputs, unpaired_manifests)
+    """
+    pairs = []
+    unpaired_outputs = []
+    unpaired_manifests = []
+
+    search_dirs = []
+    for directory in directories:
+        if recursive:
+            search_dirs.extend(Path(root) for root, _, _ in os.walk(directory))
+        else:
+            search_dirs.append(directory)
+
+    for search_dir in sorted(set(search_dirs)):
+        outputs: Dict[str, Path] = {}
+        manifests: Dict[str, Path] = {}
+        with os.scandir(search_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file())
+        for name in names:
+            path = search_dir / name
+            if name.endswith(".ndjson"):
+                # The UUID of the first record names the bundle, as for the summary file
+                uuid = extract_input_bundle_uuid(path) or name.split(".")[0]
+                if uuid in manifests:
+                    unpaired_manifests.append(str(path))
+                else:
+                    manifests[uuid] = path
+            elif name.endswith(".json") and not any(x in name for x in NOT_ACCOUNTING) \
+                    and not BACKUP_PATTERN.search(name):
+                outputs[name.split(".")[0]] = path
+
+        for uuid in sorted(outputs.keys() | manifests.keys()):
+            if uuid not in manifests:
+                unpaired_outputs.append(str(outputs[uuid]))
+            elif uuid not in outputs:
+                unpaired_manifests.append(str(manifests[uuid]))
+            else:
+                pairs.append((uuid, outputs[uuid], manifests[uuid]))
+
+    return pairs, unpaired_outputs, unpaired_manifests
+
+
+def compare_bundle(output_json_path: Path, input_ndjson_path: Path) -> Tuple[bool, Dict]:
+    """
+    Compare one pair of accounting files, collecting the warnings instead of printing them.
+    """
+    warnings: List[str] = []
+    try:
+        output_map = load_output_accounting(output_json_path, warnings)
+        input_map = load_input_accounting(input_ndjson_path, warnings)
+    except (OSError, ValueError, AttributeError) as e:
+        return False, {"error": f"{type(e).__name__}: {e}", "warnings": warnings}
+    is_valid, summary = compare_accounting(output_map, input_map, warnings)
+    summary["warnings"] = warnings
+    return is_valid, summary
+
+
+def compare_directories(directories: List[Path], recursive: bool = False, num_workers: int = 1) -> Tuple[bool, Dict]:
+    """
+    Compare all bundle pairs of the directories in a process pool.
+
+    Returns:
+        (is_valid, aggregated summary with per-bundle details)
+    """
+    pairs, unpaired_outputs, unpaired_manifests = find_bundle_pairs(directories, recursive)
+    print(f"Found {len(pairs)} bundle pairs, {len(unpaired_outputs)} output JSONs and "
+          f"{len(unpaired_manifests)} manifests without a pair", file=sys.stderr)
+
+    summary = {
+        "directories": [str(directory) for directory in directories],
+        "total_bundles": len(pairs),
+        "valid_bundles": 0,
+        "invalid_bundles": [],
+        "unpaired_outputs": unpaired_outputs,
+        "unpaired_manifests": unpaired_manifests,
+        "total_input_files": 0,
+        "total_output_files": 0,
+        "run_numbers": set(),
+        "max_file_number_per_run": {},
+        "files_only_in_input": [],
+        "files_only_in_output": [],
+        "checksum_pairs": [],
+        "bundles": {},
+    }
+
+    uuids = [uuid for uuid, _, _ in pairs]
+    output_jsons = [output_json for _, output_json, _ in pairs]
+    input_ndjsons = [input_ndjson for _, _, input_ndjson in pairs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for uuid, output_json, input_ndjson, (bundle_valid, bundle_summary) in zip(
+                uuids, output_jsons, input_ndjsons,
+                executor.map(compare_bundle, output_jsons, input_ndjsons, chunksize=8)):
+            details = {
+                "output_json": str(output_json),
+                "input_ndjson": str(input_ndjson),
+                "is_valid": bundle_valid,
+            }
+            if bundle_valid:
+                summary["valid_bundles"] += 1
+            else:
+                summary["invalid_bundles"].append(uuid)
+            if "error" in bundle_summary:
+                details.update(bundle_summary)
+                summary["bundles"][uuid] = details
+                continue
+
+            for key in ("total_input_files", "total_output_files", "run_numbers",
+                        "files_only_in_input", "files_only_in_output", "warnings"):
+                if key in bundle_summary:
+                    details[key] = bundle_summary[key]
+            summary["bundles"][uuid] = details
+
+            summary["total_input_files"] += bundle_summary["total_input_files"]
+            summary["total_output_files"] += bundle_summary["total_output_files"]
+            summary["run_numbers"].update(bundle_summary["run_numbers"])
+            for run_num, file_num in bundle_summary["max_file_number_per_run"].items():
+                summary["max_file_number_per_run"][run_num] = max(file_num, summary["max_file_number_per_run"].get(run_num, file_num))
+            for key in ("files_only_in_input", "files_only_in_output"):
+                summary[key].extend(
+                    {"bundle": uuid, "run_number": run_num, "file_number": file_num}
+                    for run_num, file_num in bundle_summary.get(key, [])
+                )
+            summary["checksum_pairs"].extend(dict(pair, bundle=uuid) for pair in bundle_summary["checksum_pairs"])
+
+    summary["run_numbers"] = sorted(summary["run_numbers"])
+    summary["max_file_number_per_run"] = dict(sorted(summary["max_file_number_per_run"].items()))
+    is_valid = not summary["invalid_bundles"] and not unpaired_outputs and not unpaired_manifests
+    return is_valid, summary
+
+
+def main_directories(directories: List[Path], recursive: bool, num_workers: int, summary_filename: Optional[Path]) -> int:
+    for directory in directories:
+        if not directory.is_dir():
+            print(f"ERROR: Directory not found: {directory}", file=sys.stderr)
+            return 1
+    if summary_filename is None:
+        summary_filename = directories[0] / "accounting.filecount.summary.json"
+
+    is_valid, summary = compare_directories(directories, recursive, num_workers)
+
+    print("\n" + "="*60, file=sys.stderr)
+    print("SUMMARY", file=sys.stderr)
+    print("="*60, file=sys.stderr)
+    print(f"Mapping is valid: {is_valid}", file=sys.stderr)
+    print(f"Bundles: {summary['total_bundles']} ({summary['valid_bundles']} valid)", file=sys.stderr)
+    for uuid in summary["invalid_bundles"]:
+        details = summary["bundles"][uuid]
+        reason = details.get("error") or (f"{len(details.get('files_only_in_input', []))} only in input, "
+                                          f"{len(details.get('files_only_in_output', []))} only in output")
+        print(f"  Invalid bundle {uuid}: {reason}", file=sys.stderr)
+    print(f"Output JSONs without manifest: {len(summary['unpaired_outputs'])}", file=sys.stderr)
+    print(f"Manifests without output JSON: {len(summary['unpaired_manifests'])}", file=sys.stderr)
+    print(f"Total input files: {summary['total_input_files']}", file=sys.stderr)
+    print(f"Total output files: {summary['total_output_files']}", file=sys.stderr)
+    print(f"Files only in input: {len(summary['files_only_in_input'])}", file=sys.stderr)
+    print(f"Files only in output: {len(summary['files_only_in_output'])}", file=sys.stderr)
+    print("="*60, file=sys.stderr)
+
+    try:
+        with open(summary_filename, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Wrote summary to {summary_filename}", file=sys.stderr)
+    except Exception as e:
+        print(f"ERROR: Failed to write summary file {summary_filename}: {e}", file=sys.stderr)
+
+    return 0 if is_valid else 1
+
+
+def main_files(output_json_path: Path, input_ndjson_path: Path) -> int:
     if not output_json_path.exists():
         print(f"ERROR: Output JSON file not found: {output_json_path}", file=sys.stderr)
-        sys.exit(1)
+        return 1
     
     if not input_ndjson_path.exists():
         print(f"ERROR: Input NDJSON file not found: {input_ndjson_path}", file=sys.stderr)
-        sys.exit(1)
+        return 1
     
     print(f"Loading output accounting from {output_json_path}...", file=sys.stderr)
     output_map = load_output_accounting(output_json_path)
@@ -257,7 +449,31 @@ def main():
     except Exception as e:
         print(f"ERROR: Failed to write summary file {summary_filename}: {e}", file=sys.stderr)
     
-    sys.exit(0 if is_valid else 1)
+    return 0 if is_valid else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare input and output accounting files to verify 1:1 file mapping")
+    parser.add_argument("files", type=Path, nargs="*", help="<output_json> <input_ndjson>")
+    parser.add_argument("--directory", type=Path, nargs="+", default=None,
+                        help="Compare all bundles in these directories instead")
+    parser.add_argument("--recursive", action="store_true", help="Also search the subdirectories")
+    parser.add_argument("-j", "--num-workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes comparing bundles (default: number of CPUs)")
+    parser.add_argument("--summary-output", type=Path, default=None,
+                        help="Aggregated summary JSON (default: <first directory>/accounting.filecount.summary.json)")
+    args = parser.parse_args()
+
+    if args.directory is not None:
+        if args.files:
+            parser.error("<output_json> <input_ndjson> and --directory are exclusive")
+        sys.exit(main_directories(args.directory, args.recursive, args.num_workers, args.summary_output))
+
+    if len(args.files) != 2:
+        print(f"Usage: {sys.argv[0]} <output_json> <input_ndjson>", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(main_files(*args.files))
 
 
 if __name__ == "__main__":
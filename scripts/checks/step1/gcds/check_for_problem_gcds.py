@@ -1,15 +1,22 @@
 """
 This script takes the summary gcd diff files and checks if there are any unexpected changes to the GCD. It looks at the "cal" section of the summary and checks the "changed" field. If there are more than a certain number of changes (default is 0), it flags it as a problem. The results are saved to a summary file in JSON format, which includes lists of runs with no problems and runs with problems.
+
+With --store, the GCD summaries are read from the QA results store (utils/qa_results_store.py) instead of the per-run JSON files.
 """
 
 import json
 import argparse
 import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+from utils.qa_results_store import QAResultsStore
 
 
 def main():
     parser = argparse.ArgumentParser(description="Check charge peak LLH delta")
-    parser.add_argument("--files", nargs='+', type=pathlib.Path, help="Path to the data file (JSON)")
+    parser.add_argument("--files", nargs='+', type=pathlib.Path, default=[], help="Path to the data file (JSON)")
+    parser.add_argument("--store", type=pathlib.Path, default=None, help="QA results store to read the GCD summaries from instead of --files")
     parser.add_argument("--summary-file", type=pathlib.Path, default="gcd_summary.txt", help="Path to the summary output file")
     parser.add_argument("--change-limit", type=int, default=0, help="Limit ")
     args = parser.parse_args()
@@ -17,6 +24,16 @@ def main():
     no_problems = []
     problems = []
 
+    if args.store is not None:
+        with QAResultsStore(args.store) as store:
+            flagged = store.gcd_summaries(changed_above=args.change_limit)
+            passed = store.gcd_summaries(changed_at_most=args.change_limit)
+        for year, run, changed in flagged:
+            print(f"Unexpected changed to GCD for run: {year}/{run}")
+            problems.append((str(run), changed))
+        no_problems.extend((str(run), changed) for _, run, changed in passed)
+        print(f"Checked {len(flagged) + len(passed)} runs from {args.store}")
+
     for fn in args.files:
         print(f"Checking file: {fn}")
         # Example file path
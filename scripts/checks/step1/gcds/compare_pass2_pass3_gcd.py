@@ -7,13 +7,37 @@ Changes we expect to see between Pass2 and Pass3 GCDs:
 - There should be no change to the relative DOM efficiency values, and they should not be NaN. The NaN piece came up in pre-Pass2 GCDs.
 - Assumed SPE shapes between Pass2a and Pass3 GCD should be different
 - Assumed SPE shapes between Pass2b and Pass3 GCD should be the same, so we can use the SPE shape information to determine which Pass2 GCD we are comparing to.
+
+The GCDs are read through the columnar GCD cache (utils/gcd_tables.py). Whether the C and D frames
+are equal is decided on digests of the whole frame objects, the per-DOM differences are then found
+one attribute array at a time. Per-DOM output is only printed with --verbose.
+
+With --manifest, all runs of a manifest (see load_manifest) are compared in a local process pool,
+writing the same per-run JSON files.
+
+Comparisons are keyed by the C and D frame fingerprints of both GCDs (see comparison_key) and their
+results are kept next to the GCD cache. Runs sharing calibrations with an earlier comparison reuse
+its diffs instead of being compared again, unless --no-reuse is given.
+
+With --store, the written summaries are also inserted into the QA results store
+(utils/qa_results_store.py).
 """
 import argparse
-import math
+import concurrent.futures
+import hashlib
+import os
 from pathlib import Path
+import sys
+import tempfile
 import warnings
 import json
 
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from utils.gcd_tables import DEFAULT_CACHE_DIR, get_gcd_tables, omkey_str
+from utils.qa_results_store import QAResultsStore, insert_result_files
+
 
 EXPECTED_CHANGED_ATTRIBUTES = [
     "mean_atwd_charge_correction",
@@ -34,6 +58,11 @@ SKIPPED_ATTRIBUTES = [
     "discriminator_pulse_template",
 ]
 
+# Bump when the comparison changes, so earlier results are not reused
+COMPARISON_VERSION = 2
+
+FRAME_NAMES = {"geo": "G", "cal": "C", "status": "D"}
+
 SUMMARY_EXPECTED_CHANGED_ATTRIBUTES = {
     "mean_atwd_charge_correction",
     "mean_fadc_charge_correction",
@@ -80,177 +109,156 @@ def make_summary_diffs() -> dict:
 
 
 
-def read_gcd_file(filepath: Path):
-    """Reads a GCD file and returns the calibration, geometry, and detector status information."""
-    from icecube import dataio
-    from icecube import icetray
+def dom_cal_attributes(cal) -> list:
+    """DOMCal attributes of a cached calibration table, in dir() order.
 
-    cal = None
-    geo = None
-    det_status = None
+    Flattened sub-attributes (e.g. combined_spe_charge_distribution.pdfs) are
+    not attributes of the DOMCal itself."""
+    return sorted(name for name in cal.columns if "." not in name)
 
-    with dataio.I3File(str(filepath), "r") as f:
-         while f.more():
-            frame = f.pop_frame()
-            if frame.Stop == icetray.I3Frame.Calibration:
-                cal = frame["I3Calibration"]
-            elif frame.Stop == icetray.I3Frame.Geometry:
-                geo = frame["I3Geometry"]
-            elif frame.Stop == icetray.I3Frame.DetectorStatus:
-                det_status = frame["I3DetectorStatus"]
 
-    if cal is None or geo is None or det_status is None:
-        raise ValueError(f"Missing calibration, geometry, or detector status frame in {filepath}")
+def columns_differ(values_base: np.ndarray, values_compare: np.ndarray) -> np.ndarray:
+    """Elementwise value != value, so NaN differs from everything, as in the DOMCal comparison."""
+    return values_base != values_compare
 
-    return cal, geo, det_status
 
-def get_dom_cal_attributes(dom_cal):
-    """need to use dir() to get the list of attributes for the DOMCal objects, since they are not dataclasses and do not have __dict__ attribute, so we cannot just compare the __dict__ of the two DOMCal objects to see which attributes differ, we need to get the list of attributes using dir() and then compare the values of those attributes between the two DOMCal objects."""
-    return [a for a in dir(dom_cal) if not a.startswith('_')]
+def both_nan(values_base: np.ndarray, values_compare: np.ndarray) -> np.ndarray:
+    if values_base.dtype.kind != "f" or values_compare.dtype.kind != "f":
+        return np.zeros(len(values_base), dtype=bool)
+    return np.isnan(values_base) & np.isnan(values_compare)
 
 
-def values_are_both_nan(value1, value2) -> bool:
-    try:
-        return math.isnan(value1) and math.isnan(value2)
-    except TypeError:
-        return False
-
-
-def handle_expected_calibration_difference(dom, dom_key: str, attribute: str,
-                                           value_base, value_compare,
-                                           cal_base_dom, cal_compare_dom,
-                                           diffs: dict) -> None:
-    print(
-        f"EXPECTED: Attribute {attribute} differs for DOM {dom} between baseline and comparison GCDs, "
-        f"but we expect it to differ. baseline value: {value_base}, comparison value: {value_compare}"
-    )
+def is_close(values_base: np.ndarray, values_compare: np.ndarray,
+             rel_tol: float = 1e-6, abs_tol: float = 1e-9) -> np.ndarray:
+    """math.isclose on arrays, NaN is never close."""
+    with np.errstate(invalid="ignore"):
+        tolerance = np.maximum(rel_tol * np.maximum(np.abs(values_base), np.abs(values_compare)), abs_tol)
+        return (values_base == values_compare) | (np.abs(values_base - values_compare) <= tolerance)
 
-    if attribute == "combined_spe_charge_distribution":
-        if value_base.pdfs == value_compare.pdfs:
-            print(
-                f"SPE charge distribution is the same for DOM {dom} between baseline and comparison GCDs, "
-                f"but we expected it to differ. baseline value: {cal_base_dom.combined_spe_charge_distribution}, "
-                f"comparison value: {cal_compare_dom.combined_spe_charge_distribution}"
-            )
-        else:
-            print(
-                f"SPE charge distribution differs for DOM {dom} between baseline and comparison GCDs. "
-                f"baseline value: {cal_base_dom.combined_spe_charge_distribution}, "
-                f"comparison value: {cal_compare_dom.combined_spe_charge_distribution}"
-            )
-            diffs["cal"]["charge_dist_different"][dom_key] = True
-        return
 
-    if attribute == "relative_dom_eff" and math.isclose(value_base, value_compare, rel_tol=1e-6, abs_tol=1e-9):
-        return
+def frames_equal(tables_base, tables_compare, table: str) -> bool:
+    """Same whole I3Calibration, I3DetectorStatus or I3Geometry object.
 
-    diffs["cal"]["expected"][dom_key].append((attribute, value_base, value_compare))
+    Compares the object digests, so fields outside the per-DOM columns (e.g.
+    the trigger status and the start and end times) count as well."""
+    return tables_base.object_digests[table] == tables_compare.object_digests[table]
 
 
-def handle_nan_calibration_difference(dom, dom_key: str, attribute: str,
-                                      value_base, value_compare, diffs: dict) -> bool:
-    if not values_are_both_nan(value_base, value_compare):
-        return False
+def attribute_differ(cal_base, cal_compare, attribute: str,
+                     rows_base: np.ndarray, rows_compare: np.ndarray) -> np.ndarray:
+    """Per-DOM mask of a differing DOMCal attribute.
 
-    print(
-        f"Attribute {attribute} is NaN for DOM {dom} in both baseline and comparison GCDs, "
-        f"but we expected it to be different between the two GCDs."
-    )
-    diffs["cal"]["NaNs"][dom_key].append((attribute, value_base, value_compare))
-    return True
-
-
-def handle_validity_flag_difference(dom, dom_key: str, attribute: str,
-                                    value_base, value_compare,
-                                    cal_base_dom, cal_compare_dom,
-                                    diffs: dict) -> bool:
-    if attribute == "is_mean_fadc_charge_correction_valid":
-        print(
-            f"FADC charge correction differs for DOM {dom} between baseline and comparison GCDs. "
-            f"baseline value: {cal_base_dom.mean_fadc_charge_correction}, "
-            f"comparison value: {cal_compare_dom.mean_fadc_charge_correction}"
-        )
-        diffs["cal"]["valid_fadc_different"][dom_key].append((attribute, value_base, value_compare))
-        return True
-
-    if attribute == "is_mean_atwd_charge_correction_valid":
-        print(
-            f"ATWD charge correction differs for DOM {dom} between baseline and comparison GCDs. "
-            f"baseline value: {cal_base_dom.mean_atwd_charge_correction}, "
-            f"comparison value: {cal_compare_dom.mean_atwd_charge_correction}"
-        )
-        diffs["cal"]["valid_atwd_different"][dom_key].append((attribute, value_base, value_compare))
-        return True
-
-    return False
-
-
-def handle_unexpected_calibration_difference(dom, dom_key: str, attribute: str,
-                                             value_base, value_compare,
-                                             diffs: dict) -> None:
-    diffs["cal"]["changed"][dom_key].append((attribute, value_base, value_compare))
-    warnings.warn(
-        f"{attribute} differs between baseline and comparison GCDs, but we do not expect it to differ. "
-        f"baseline value: {value_base}, comparison value: {value_compare}",
-        UserWarning,
-    )
+    Opaque attributes have no digest in the GCD cache, so they are compared on
+    their <attribute>.<sub> columns and fail if they have none."""
+    if "opaque" not in (cal_base.kind(attribute), cal_compare.kind(attribute)):
+        return columns_differ(cal_base[attribute][rows_base], cal_compare[attribute][rows_compare])
+    subs = [name for name in cal_base.columns
+            if name.startswith(f"{attribute}.") and cal_base.kind(name) != "opaque"]
+    if not subs:
+        raise TypeError(f"DOMCal attribute {attribute} cannot be compared from the GCD cache, "
+                        f"it has neither a digest nor comparable sub-attributes")
+    differ = np.zeros(len(rows_base), dtype=bool)
+    for name in subs:
+        if name not in cal_compare or cal_compare.kind(name) == "opaque":
+            raise AttributeError(f"Comparison GCD has no comparable DOMCal attribute {name}")
+        differ |= columns_differ(cal_base[name][rows_base], cal_compare[name][rows_compare])
+    return differ
 
-def compare_pass3_calibrations(cal_base, cal_compare, diffs: dict):
-    for k, c1 in cal_base.dom_cal.items():
-        if k.om > 60:
-            # Skip IceTop DOMs
-            continue
-        if k.string == 0:
-            # skip iceact
-            continue
-        dom_key = str(k)
+
+def json_value(table, attribute: str, row: int):
+    if table.kind(attribute) in ("object", "opaque"):
+        raise TypeError(f"Attribute {attribute} of DOM {omkey_str(table.omkey[row])} differs, "
+                        f"but its value is not JSON serializable")
+    return table[attribute][row].item()
+
+
+def compare_pass3_calibrations(cal_base, cal_compare, diffs: dict, verbose: bool = False):
+    """Compare the in-ice DOMCals of two cached GCDs, one attribute array at a time.
+
+    Fills diffs with the same content as comparing the DOMCal objects one by one."""
+    keep = (cal_base.om <= 60) & (cal_base.string != 0)  # Skip IceTop DOMs and iceact
+    rows_base = np.flatnonzero(keep)
+    omkeys = cal_base.omkey[rows_base]
+    rows_compare = cal_compare.lookup(omkeys)
+    if (rows_compare < 0).any():
+        raise KeyError(omkey_str(omkeys[np.argmax(rows_compare < 0)]))
+
+    dom_keys = [omkey_str(k) for k in omkeys]
+    for dom_key in dom_keys:
         if dom_key not in diffs["cal"]["expected"]:
             init_dom_cal_diff(diffs["cal"], dom_key)
-        c2 = cal_compare.dom_cal[k]
-        attributes_base = get_dom_cal_attributes(c1)
-        attributes_compare = get_dom_cal_attributes(c2)
-        if set(attributes_base) != set(attributes_compare):
-            print(f"Attributes differ for DOM {k} between baseline and comparison GCDs. Baseline attributes: {attributes_base}, Comparison attributes: {attributes_compare}")
-            diffs["cal"]["attributed_different"] = True
-        for a, v in [(a, getattr(c1, a)) for a in attributes_base]:
-            # print(f"Comparing attribute {a} for DOM {k}")
-            # These are evil properties!
-            if a in diffs["cal"]["skipped"]:
-                print(f"Skipping comparison of attribute {a} for DOM {k} since it is expected to differ between GCDs.")
-                # diffs["cal"]["skipped"][str(k)].append(a)
+
+    attributes_base = dom_cal_attributes(cal_base)
+    attributes_compare = dom_cal_attributes(cal_compare)
+    if len(omkeys) and set(attributes_base) != set(attributes_compare):
+        print(f"Attributes differ between baseline and comparison GCDs. Baseline attributes: {attributes_base}, Comparison attributes: {attributes_compare}")
+        diffs["cal"]["attributed_different"] = True
+
+    def record(bucket: str, attribute: str, mask: np.ndarray, message: str = None):
+        for i in np.flatnonzero(mask):
+            value_base = json_value(cal_base, attribute, rows_base[i])
+            value_compare = json_value(cal_compare, attribute, rows_compare[i])
+            diffs["cal"][bucket][dom_keys[i]].append((attribute, value_base, value_compare))
+            if verbose and message:
+                print(message.format(attribute=attribute, dom=dom_keys[i],
+                                     value_base=value_base, value_compare=value_compare))
+
+    for attribute in attributes_base:
+        # These are evil properties!
+        if attribute in diffs["cal"]["skipped"]:
+            print(f"Skipping comparison of attribute {attribute} since it is expected to differ between GCDs.")
+            continue
+        if attribute not in cal_compare:
+            raise AttributeError(f"Comparison GCD has no DOMCal attribute {attribute}")
+        values_base = cal_base[attribute][rows_base]
+        values_compare = cal_compare[attribute][rows_compare]
+        differ = attribute_differ(cal_base, cal_compare, attribute, rows_base, rows_compare)
+        if not differ.any():
+            continue
+
+        if attribute in EXPECTED_CHANGED_ATTRIBUTES:
+            if attribute == "combined_spe_charge_distribution":
+                pdfs = f"{attribute}.pdfs"
+                if pdfs in cal_base and pdfs in cal_compare:
+                    differ &= columns_differ(cal_base[pdfs][rows_base], cal_compare[pdfs][rows_compare])
+                for i in np.flatnonzero(differ):
+                    diffs["cal"]["charge_dist_different"][dom_keys[i]] = True
+                    if verbose:
+                        print(f"SPE charge distribution differs for DOM {dom_keys[i]} between baseline and comparison GCDs.")
                 continue
-            v2 = getattr(c2, a)
-            if v != v2:
-                if a in EXPECTED_CHANGED_ATTRIBUTES:
-                    handle_expected_calibration_difference(k, dom_key, a, v, v2, c1, c2, diffs)
-                    continue
-                if handle_nan_calibration_difference(k, dom_key, a, v, v2, diffs):
-                    continue
-                if handle_validity_flag_difference(k, dom_key, a, v, v2, c1, c2, diffs):
-                    continue
-                handle_unexpected_calibration_difference(k, dom_key, a, v, v2, diffs)
-
-def compare_calibrations_attributes(cal_base, cal_compare):
-    for key in cal_base.dom_cal.keys():
-        if key.string == 0:
+            if attribute == "relative_dom_eff":
+                differ &= ~is_close(values_base, values_compare)
+            record("expected", attribute, differ,
+                   "EXPECTED: Attribute {attribute} differs for DOM {dom} between baseline and comparison GCDs, "
+                   "but we expect it to differ. baseline value: {value_base}, comparison value: {value_compare}")
             continue
-        item2 = cal_compare.dom_cal[key]
-        item1 = cal_base.dom_cal[key]
-        attributes_base = get_dom_cal_attributes(item1)
-        attributes_compare = get_dom_cal_attributes(item2)
-        if set(attributes_base) != set(attributes_compare):
-            print(f"Attributes differ for DOM {key} between baseline and comparison GCDs. Baseline attributes: {attributes_base}, Comparison attributes: {attributes_compare}")
-        for a, v in [(a, getattr(item1, a)) for a in attributes_base]:
-            print(f"Comparing attribute {a} for DOM {key}")
-            v2 = getattr(item2, a)
-            # Looking at the SPE PDFs specifically to see if they differ between Pass2a and Pass2b GCDs, since Pass3 GCDs are based on Pass2b GCDs, so we expect them to be the same between Pass2b and Pass3 GCDs but different between Pass2a and Pass3 GCDs.
-            if a == "combined_spe_charge_distribution":
-                if v.pdfs == v2.pdfs:
-                    print(f"SPE charge distribution PDFs are the same for DOM {key} between baseline and comparison GCDs.")
-                else:
-                    print(f"SPE charge distribution PDFs differ for DOM {key} between baseline and comparison GCDs.")
-            if v != v2:
-                print(f"DOM {key}, variable {a} differs between baseline and comparison GCDs. Baseline value: {v}, Comparison value: {v2}")
+
+        nans = differ & both_nan(values_base, values_compare)
+        record("NaNs", attribute, nans,
+               "Attribute {attribute} is NaN for DOM {dom} in both baseline and comparison GCDs, "
+               "but we expected it to be different between the two GCDs.")
+        differ &= ~nans
+
+        if attribute == "is_mean_fadc_charge_correction_valid":
+            record("valid_fadc_different", attribute, differ,
+                   "FADC charge correction validity differs for DOM {dom} between baseline and comparison GCDs. "
+                   "baseline value: {value_base}, comparison value: {value_compare}")
+            continue
+        if attribute == "is_mean_atwd_charge_correction_valid":
+            record("valid_atwd_different", attribute, differ,
+                   "ATWD charge correction validity differs for DOM {dom} between baseline and comparison GCDs. "
+                   "baseline value: {value_base}, comparison value: {value_compare}")
+            continue
+
+        record("changed", attribute, differ,
+               "DOM {dom}, variable {attribute} differs between baseline and comparison GCDs. "
+               "Baseline value: {value_base}, Comparison value: {value_compare}")
+        if differ.any():
+            warnings.warn(
+                f"{attribute} differs between baseline and comparison GCDs for {int(differ.sum())} DOMs, "
+                f"but we do not expect it to differ.",
+                UserWarning,
+            )
 
 
 def summarize_distinct_attribute_sets(summary_bucket: dict,
@@ -294,61 +302,278 @@ def summary_diffs_cal(diffs: dict) -> dict:
     return summary
 
 
-def compare_gcds(gcd_base: Path, 
-                 gcd_compare: Path,
-                 comparison_json: Path,
-                 summary_json: Path) -> None:
-    """Compares the Pass2 and Pass3 GCD files for expected changes."""
+def comparison_key(tables_base, tables_compare) -> str:
+    """Key of a comparison from the C and D frame fingerprints of both GCDs.
 
-    print(f"Comparing GCD file {gcd_base} to GCD file {gcd_compare}")
+    Runs that share both calibrations and detector statuses give the same
+    diffs, so their comparison is only done once. The fingerprints leave out
+    the run's own start and end times of the frames, which check_frames
+    checks for every run. The geometry is not compared, so it is not part
+    of the key."""
+    fingerprints = [COMPARISON_VERSION]
+    for tables in (tables_base, tables_compare):
+        fingerprints += [tables.fingerprints["cal"], tables.fingerprints["status"]]
+    return hashlib.blake2b(json.dumps(fingerprints).encode(), digest_size=16).hexdigest()
 
-    cal_base, geo_base, det_status_base = read_gcd_file(gcd_base)
-    cal_comp, geo_comp, det_status_comp = read_gcd_file(gcd_compare)
 
-    diffs = make_diffs()
+def comparison_cache_path(cache_dir: Path, key: str) -> Path:
+    return Path(cache_dir) / "diffs" / key[:2] / f"{key}.json"
+
+
+def load_comparison(cache_dir: Path, key: str):
+    path = comparison_cache_path(cache_dir, key)
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
 
-    if cal_base == cal_comp:
+def store_comparison(cache_dir: Path, key: str, result: dict) -> None:
+    path = comparison_cache_path(cache_dir, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def write_comparison(result: dict, comparison_json: Path, summary_json: Path) -> None:
+    with open(comparison_json, "w") as f:
+        json.dump(result["diffs"], f, indent=4)
+    with open(summary_json, "w") as f:
+        json.dump(result["summary"], f, indent=4)
+
+
+def check_frames(tables_base, tables_compare, gcd_base: Path, gcd_compare: Path) -> None:
+    """Raise if the C frames are identical or the D frames differ."""
+    if frames_equal(tables_base, tables_compare, "cal"):
         raise Exception(f"Calibration information is identical between baseline {gcd_base} and comparison {gcd_compare} GCDs, but we expect it to differ due to the charge corrections and FADC gain correction.")
-    else:
-        compare_calibrations_attributes(cal_base, cal_comp)
-        compare_pass3_calibrations(cal_base, cal_comp, diffs)
 
-    if (det_status_base != det_status_comp):
+    if not frames_equal(tables_base, tables_compare, "status"):
         # Detector status information should not change between Pass2 and Pass3 GCDs, so if they differ, we raise an error.
         raise Exception(f"Detector status information differs between baseline {gcd_base} and comparison {gcd_compare} GCDs.")
-    
-    # if (geo_base != geo_comp):
+
+    # if not frames_equal(tables_base, tables_compare, "geo"):
     #     # Geometry information should not change between Pass2 and Pass3 GCDs, so if they differ, we raise an error.
     #     raise Exception(f"Geometry information differs between baseline {gcd_base} and comparison {gcd_compare} GCDs.")
 
-    with open(comparison_json, "w") as f:
-        json.dump(diffs, f, indent=4)
-    with open(summary_json, "w") as f:
-        json.dump(summary_diffs_cal(diffs), f, indent=4)
+
+def compare_gcds(gcd_base: Path,
+                 gcd_compare: Path,
+                 comparison_json: Path,
+                 summary_json: Path,
+                 cache_dir: Path = DEFAULT_CACHE_DIR,
+                 verbose: bool = False,
+                 reuse: bool = True) -> str:
+    """Compares the Pass2 and Pass3 GCD files for expected changes.
+
+    With reuse, the diffs of an earlier comparison with the same comparison_key
+    are written instead of comparing again. Returns the comparison key."""
+
+    print(f"Comparing GCD file {gcd_base} to GCD file {gcd_compare}")
+
+    tables_base = get_gcd_tables(gcd_base, cache_dir)
+    tables_comp = get_gcd_tables(gcd_compare, cache_dir)
+
+    # The comparison key leaves out the validity times, so the whole frames are checked for every run
+    check_frames(tables_base, tables_comp, gcd_base, gcd_compare)
+
+    key = comparison_key(tables_base, tables_comp)
+    result = load_comparison(cache_dir, key) if reuse else None
+    if result is not None:
+        print(f"Reusing comparison {key} of the same calibrations and detector statuses")
+        write_comparison(result, comparison_json, summary_json)
+        return key
+
+    diffs = make_diffs()
+    compare_pass3_calibrations(tables_base.cal, tables_comp.cal, diffs, verbose=verbose)
+
+    result = {"diffs": diffs, "summary": summary_diffs_cal(diffs)}
+    store_comparison(cache_dir, key, result)
+    write_comparison(result, comparison_json, summary_json)
+    return key
+
+
+def store_summaries(store_path: Path, summary_files: list) -> None:
+    """Insert the written summary JSON files into the QA results store."""
+    with QAResultsStore(store_path) as store:
+        counts = insert_result_files(store, summary_files)
+    print(f"Stored {counts['gcd']} GCD summaries in {store_path}")
+
+
+def load_manifest(manifest: Path) -> list:
+    """Runs of a batch comparison.
+
+    The manifest is a JSON list of {"run", "pass2_gcd", "pass3_gcd",
+    "output_diffs_json", "output_summary_json"}, as written by make_dag_gcd_compare.py."""
+    with open(manifest, "r") as f:
+        entries = json.load(f)
+    for entry in entries:
+        missing = {"run", "pass2_gcd", "pass3_gcd", "output_diffs_json", "output_summary_json"} - set(entry)
+        if missing:
+            raise ValueError(f"Manifest entry {entry} in {manifest} is missing {sorted(missing)}")
+    return entries
+
+
+def manifest_entry_fingerprints(entry: dict, cache_dir: Path = DEFAULT_CACHE_DIR):
+    """(run, comparison key, {"pass2": fingerprints, "pass3": fingerprints}, error message or None)"""
+    try:
+        tables_base = get_gcd_tables(Path(entry["pass2_gcd"]), cache_dir)
+        tables_comp = get_gcd_tables(Path(entry["pass3_gcd"]), cache_dir)
+        # Runs sharing a comparison only have their own frames checked here
+        check_frames(tables_base, tables_comp, Path(entry["pass2_gcd"]), Path(entry["pass3_gcd"]))
+    except Exception as exc:
+        return entry["run"], None, None, f"{type(exc).__name__}: {exc}"
+    fingerprints = {"pass2": tables_base.fingerprints, "pass3": tables_comp.fingerprints}
+    return entry["run"], comparison_key(tables_base, tables_comp), fingerprints, None
+
+
+def compare_manifest_entry(entry: dict, cache_dir: Path = DEFAULT_CACHE_DIR,
+                           verbose: bool = False, reuse: bool = True):
+    """Compare the GCDs of one manifest entry. Returns (run, error message or None)."""
+    try:
+        Path(entry["output_diffs_json"]).parent.mkdir(parents=True, exist_ok=True)
+        Path(entry["output_summary_json"]).parent.mkdir(parents=True, exist_ok=True)
+        compare_gcds(Path(entry["pass2_gcd"]),
+                     Path(entry["pass3_gcd"]),
+                     Path(entry["output_diffs_json"]),
+                     Path(entry["output_summary_json"]),
+                     cache_dir=cache_dir,
+                     verbose=verbose,
+                     reuse=reuse)
+    except Exception as exc:
+        return entry["run"], f"{type(exc).__name__}: {exc}"
+    return entry["run"], None
+
+
+def report_frame_changes(fingerprints: dict) -> None:
+    """Print the runs whose C, D or G frames differ from the run before, {run: fingerprints}."""
+    previous = None
+    for run in sorted(fingerprints):
+        current = fingerprints[run]
+        if previous is not None:
+            changed = [f"{pass_name} {FRAME_NAMES[table]}"
+                       for pass_name in ("pass2", "pass3")
+                       for table in FRAME_NAMES
+                       if current[pass_name][table] != previous[pass_name][table]]
+            if changed:
+                print(f"Run {run}: changed {', '.join(changed)} frame")
+        previous = current
+
+
+def compare_manifest(manifest: Path, num_workers: int = 1,
+                     cache_dir: Path = DEFAULT_CACHE_DIR, verbose: bool = False,
+                     reuse: bool = True) -> list:
+    """Compare all runs of a manifest in a process pool. Returns the (run, error) of failed runs.
+
+    The frame fingerprints of all runs are read first, then each distinct
+    comparison is done once and its diffs are written for all runs sharing it.
+    Without reuse, every run is compared on its own. A failing run does not
+    stop the others."""
+    entries = load_manifest(manifest)
+    print(f"Comparing {len(entries)} runs from {manifest} with {num_workers} workers")
+    failed = []
+    groups: dict = {}
+    fingerprints = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(manifest_entry_fingerprints, entry, cache_dir): entry for entry in entries}
+        for future in concurrent.futures.as_completed(futures):
+            run, key, run_fingerprints, error = future.result()
+            if error is not None:
+                print(f"Run {run}: failed, {error}")
+                failed.append((run, error))
+                continue
+            groups.setdefault(key if reuse else (key, run), []).append(futures[future])
+            fingerprints[run] = run_fingerprints
+
+        report_frame_changes(fingerprints)
+        print(f"{len(groups)} comparisons for {len(fingerprints)} runs")
+
+        futures = {executor.submit(compare_manifest_entry, group[0], cache_dir, verbose, reuse): group_key
+                   for group_key, group in groups.items()}
+        for future in concurrent.futures.as_completed(futures):
+            group_key = futures[future]
+            run, error = future.result()
+            group = groups[group_key]
+            if error is not None:
+                print(f"Run {run}: failed, {error}")
+                failed.extend((entry["run"], error) for entry in group)
+                continue
+            if len(group) > 1:
+                result = load_comparison(cache_dir, group_key)
+            for entry in group[1:]:
+                Path(entry["output_diffs_json"]).parent.mkdir(parents=True, exist_ok=True)
+                Path(entry["output_summary_json"]).parent.mkdir(parents=True, exist_ok=True)
+                write_comparison(result, entry["output_diffs_json"], entry["output_summary_json"])
+            print(f"Runs {', '.join(str(entry['run']) for entry in group)}: done")
+    print(f"Compared {len(entries) - len(failed)} runs, {len(failed)} failed")
+    return sorted(failed)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--pass2-gcd", 
                         help="Pass2 GCD file", 
-                        type=Path, 
-                        required=True)
+                        type=Path)
     parser.add_argument("--pass3-gcd", 
                         help="Pass3 GCD file", 
-                        type=Path, 
-                        required=True)
+                        type=Path)
     parser.add_argument("--output-diffs-json", 
                         help="Output JSON file to write the detailed differences between the GCDs",
-                        type=Path, 
-                        required=True)
+                        type=Path)
     parser.add_argument("--output-summary-json", 
                         help="Output JSON file to write the summary of differences between the GCDs", 
-                        type=Path, 
-                        required=True)
+                        type=Path)
+    parser.add_argument("--manifest",
+                        help="JSON manifest of runs to compare instead of a single pair of GCDs",
+                        type=Path)
+    parser.add_argument("-j", "--num-workers",
+                        help="Number of processes for --manifest",
+                        type=int,
+                        default=1)
+    parser.add_argument("--cache-dir",
+                        help="Columnar GCD cache directory (see icetray/step1/gcd_cache.py)",
+                        type=Path,
+                        default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--verbose",
+                        help="Print every per-DOM difference",
+                        action="store_true")
+    parser.add_argument("--store",
+                        help="QA results store (utils/qa_results_store.py) to insert the summaries into",
+                        type=Path,
+                        default=None)
+    parser.add_argument("--no-reuse",
+                        help="Compare again even if the same calibrations were compared before",
+                        dest="reuse",
+                        action="store_false")
     args = parser.parse_args()
 
-    print(f"Comparing  GCD file {args.pass2_gcd} as baseline to GCD file {args.pass3_gcd}")
-
-    compare_gcds(args.pass2_gcd, 
-                 args.pass3_gcd,
-                 args.output_diffs_json,
-                 args.output_summary_json)
\ No newline at end of file
+    if args.manifest is not None:
+        failed = compare_manifest(args.manifest, args.num_workers, args.cache_dir, args.verbose, args.reuse)
+        if args.store is not None:
+            failed_runs = {run for run, _ in failed}
+            store_summaries(args.store, [Path(entry["output_summary_json"]) for entry in load_manifest(args.manifest)
+                                         if entry["run"] not in failed_runs])
+        if failed:
+            sys.exit(1)
+    else:
+        single_run_args = (args.pass2_gcd, args.pass3_gcd, args.output_diffs_json, args.output_summary_json)
+        if any(arg is None for arg in single_run_args):
+            parser.error("--pass2-gcd, --pass3-gcd, --output-diffs-json and --output-summary-json "
+                         "are required without --manifest")
+
+        print(f"Comparing  GCD file {args.pass2_gcd} as baseline to GCD file {args.pass3_gcd}")
+
+        compare_gcds(args.pass2_gcd, 
+                     args.pass3_gcd,
+                     args.output_diffs_json,
+                     args.output_summary_json,
+                     cache_dir=args.cache_dir,
+                     verbose=args.verbose,
+                     reuse=args.reuse)
+        if args.store is not None:
+            store_summaries(args.store, [args.output_summary_json])
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
 import json
+import os
+import re
+import subprocess
+import tempfile
 from argparse import ArgumentParser
 from pathlib import Path
 from typing import Any
@@ -12,13 +16,16 @@ PASS2_2017_2023_SUBDIR = Path("filtered/level2")
 PASS3_GCD_SUBDIR = Path("filtered/debug.v2/GCD")
 PASS2_SUFFIXES = (".i3.zst", ".i3.gz")
 PASS3_SUFFIXES = (".i3.zst", ".i3.gz")
+INDEX_VERSION = 1
+RUN_TOKEN_PATTERN = re.compile(r"Run(\d{8})")
 
 
 def build_parser() -> ArgumentParser:
     parser = ArgumentParser(
         description=(
             "Generate an HTCondor DAG that compares Pass2 and Pass3 GCD files for "
-            "runs listed in a GRL file."
+            "runs listed in a GRL file. Runs are bundled into manifests of "
+            "--runs-per-job runs, each compared by one job with a local process pool."
         )
     )
     parser.add_argument(
@@ -78,6 +85,24 @@ def build_parser() -> ArgumentParser:
         default=Path("."),
         help="Directory for HTCondor stdout and stderr logs.",
     )
+    parser.add_argument(
+        "--index-cache",
+        type=Path,
+        default=None,
+        help=(
+            "JSON cache of the scanned GCD directories. Directories whose mtime did not "
+            "change are not listed again. Default: {outdir}/gcd_index.json"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help=(
+            "Columnar GCD cache shared by all jobs, which also keeps the comparison "
+            "results that are reused between runs. Default: {outdir}/gcd_cache"
+        ),
+    )
     parser.add_argument(
         "--include-bad-runs",
         action="store_true",
@@ -88,7 +113,22 @@ def build_parser() -> ArgumentParser:
         "--request-cpus",
         type=int,
         default=1,
-        help="CPU request for each HTCondor job.",
+        help="CPU request for each HTCondor job, also the number of comparison processes per job.",
+    )
+    parser.add_argument(
+        "--runs-per-job",
+        type=int,
+        default=250,
+        help="Number of runs compared by each HTCondor job.",
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        default=False,
+        help=(
+            "Compare all runs right here with --request-cpus processes "
+            "instead of writing a DAG."
+        ),
     )
     parser.add_argument(
         "--request-memory",
@@ -168,29 +208,133 @@ def get_run_month_day_dirs(run_record: dict[str, Any]) -> list[str]:
     return month_day_dirs
 
 
-def find_gcd_candidates(base_dir: Path, run_number: int, suffixes: tuple[str, ...]) -> list[Path]:
-    run_token = f"Run{run_number:08d}"
-    candidates: list[Path] = []
-
-    if not base_dir.exists():
-        return candidates
-
-    for suffix in suffixes:
-        candidates.extend(sorted(base_dir.glob(f"*{run_token}*GCD{suffix}")))
-
-    return sorted(set(candidates))
+class GCDFileIndex:
+    """Run -> GCD file map of the GCD directory trees.
+
+    Each tree is listed once with os.scandir instead of one glob per run,
+    directory and suffix. Directory listings are kept in a JSON cache with
+    the directory mtimes, so only directories that changed since the last
+    scan are listed again."""
+
+    def __init__(self, cache_file: Path | None = None):
+        self.cache_file = cache_file
+        self.dirs: dict[str, dict[str, Any]] = {}
+        self.trees: dict[tuple[Path, int], dict[int, list[Path]]] = {}
+        self.changed = False
+        self.listed = 0
+        self.reused = 0
+        if cache_file is not None and cache_file.exists():
+            with cache_file.open("r") as handle:
+                data = json.load(handle)
+            if data.get("version") == INDEX_VERSION:
+                self.dirs = data["dirs"]
+
+    def save(self) -> None:
+        if self.cache_file is None or not self.changed:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_file.parent, prefix=f".{self.cache_file.name}.")
+        try:
+            with os.fdopen(fd, "w") as handle:
+                json.dump({"version": INDEX_VERSION, "dirs": self.dirs}, handle)
+            os.replace(tmp_name, self.cache_file)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        self.changed = False
+
+    def listing(self, directory: Path) -> dict[str, Any] | None:
+        """Subdirectories and GCD file names of a directory, None if it does not exist."""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        cached = self.dirs.get(str(directory))
+        if cached is not None and cached["mtime"] == mtime:
+            self.reused += 1
+            return cached
+
+        dirs: list[str] = []
+        files: list[str] = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Like glob, skip hidden entries
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif "GCD" in entry.name:
+                    files.append(entry.name)
+        listing = {"mtime": mtime, "dirs": sorted(dirs), "files": sorted(files)}
+        self.dirs[str(directory)] = listing
+        self.changed = True
+        self.listed += 1
+        return listing
+
+    def tree(self, top: Path, depth: int) -> dict[int, list[Path]]:
+        """Run -> GCD files of the directories depth levels below top."""
+        key = (top, depth)
+        if key not in self.trees:
+            runs: dict[int, list[Path]] = {}
+            self._scan(top, depth, runs)
+            self.trees[key] = runs
+        return self.trees[key]
+
+    def _scan(self, directory: Path, depth: int, runs: dict[int, list[Path]]) -> None:
+        listing = self.listing(directory)
+        if listing is None:
+            return
+        if depth > 0:
+            for name in listing["dirs"]:
+                self._scan(directory / name, depth - 1, runs)
+            return
+        for name in listing["files"]:
+            for run_token in set(RUN_TOKEN_PATTERN.findall(name)):
+                runs.setdefault(int(run_token), []).append(directory / name)
+
+    def candidates(
+        self,
+        top: Path,
+        depth: int,
+        run_number: int,
+        suffixes: tuple[str, ...],
+        search_dirs: list[Path] | None = None,
+    ) -> list[Path]:
+        """Same files as globbing *Run{run:08d}*GCD{suffix} in the search dirs (default: all)."""
+        candidates = [
+            path
+            for path in self.tree(top, depth).get(run_number, [])
+            if any(path.name.endswith(f"GCD{suffix}") for suffix in suffixes)
+            and (search_dirs is None or path.parent in search_dirs)
+        ]
+        return sorted(set(candidates))
+
+    def duplicates(self, top: Path, depth: int, suffixes: tuple[str, ...]) -> dict[int, list[Path]]:
+        """Runs with more than one GCD file anywhere in a tree."""
+        duplicates = {}
+        for run_number in self.tree(top, depth):
+            candidates = self.candidates(top, depth, run_number, suffixes)
+            if len(candidates) > 1:
+                duplicates[run_number] = candidates
+        return duplicates
+
+
+def get_pass2_subdir(year: int) -> Path:
+    if 2011 <= year <= 2016:
+        return PASS2_2011_2016_SUBDIR
+    if 2017 <= year <= 2023:
+        return PASS2_2017_2023_SUBDIR
+    raise ValueError(f"Unsupported Pass2 year {year}")
 
 
 def build_pass2_search_dirs(root_dir: Path, run_record: dict[str, Any]) -> list[Path]:
     year = get_run_year(run_record)
     run_number = int(run_record["run"])
     run_dirname = f"Run{run_number:08d}"
-    if 2011 <= year <= 2016:
-        pass2_subdir = PASS2_2011_2016_SUBDIR
-    elif 2017 <= year <= 2023:
-        pass2_subdir = PASS2_2017_2023_SUBDIR
-    else:
-        raise ValueError(f"Run {run_record['run']} has unsupported Pass2 year {year}")
+    try:
+        pass2_subdir = get_pass2_subdir(year)
+    except ValueError:
+        raise ValueError(f"Run {run_record['run']} has unsupported Pass2 year {year}") from None
 
     return [
         root_dir / str(year) / pass2_subdir / month_day / run_dirname
@@ -202,17 +346,20 @@ def resolve_unique_pass2_gcd(
     root_dir: Path,
     run_record: dict[str, Any],
     suffixes: tuple[str, ...],
+    index: GCDFileIndex,
 ) -> Path:
     run_number = int(run_record["run"])
-    search_roots = build_pass2_search_dirs(root_dir, run_record)
-
-    candidates: list[Path] = []
-    searched_dirs: list[Path] = []
-    for search_dir in search_roots:
-        searched_dirs.append(search_dir)
-        candidates.extend(find_gcd_candidates(search_dir, run_number, suffixes))
+    searched_dirs = build_pass2_search_dirs(root_dir, run_record)
+    year = get_run_year(run_record)
 
-    unique_candidates = sorted(set(candidates))
+    # {root}/YYYY/{subdir}/MMDD/RunXXXXXXXX/
+    unique_candidates = index.candidates(
+        root_dir / str(year) / get_pass2_subdir(year),
+        2,
+        run_number,
+        suffixes,
+        searched_dirs,
+    )
     if not unique_candidates:
         searched_text = "\n  ".join(str(search_dir) for search_dir in searched_dirs)
         raise FileNotFoundError(
@@ -235,9 +382,10 @@ def resolve_unique_gcd(
     run_number: int,
     suffixes: tuple[str, ...],
     label: str,
+    index: GCDFileIndex,
 ) -> Path:
     search_dir = root_dir / str(year) / subdir
-    candidates = find_gcd_candidates(search_dir, run_number, suffixes)
+    candidates = index.candidates(search_dir, 0, run_number, suffixes)
 
     if not candidates:
         raise FileNotFoundError(
@@ -270,27 +418,49 @@ def build_submit_description(args) -> str:
     return "\n".join(lines)
 
 
-def build_job_block(
+def build_manifest_entry(
     run_number: int,
     run_outdir: Path,
     pass2_gcd: Path,
     pass3_gcd: Path,
+) -> dict[str, Any]:
+    # Absolute paths, the jobs run in their DIR
+    run_outdir = run_outdir.resolve()
+    return {
+        "run": run_number,
+        "pass2_gcd": str(pass2_gcd.resolve()),
+        "pass3_gcd": str(pass3_gcd.resolve()),
+        "output_diffs_json": str(run_outdir / f"Run{run_number:08d}.gcd_differences.json"),
+        "output_summary_json": str(run_outdir / f"Run{run_number:08d}.gcd_summary.json"),
+    }
+
+
+def write_manifest(manifest: Path, entries: list[dict[str, Any]]) -> None:
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    with manifest.open("w") as handle:
+        json.dump(entries, handle, indent=4)
+
+
+def build_job_block(
+    job_index: int,
+    manifest: Path,
+    entries: list[dict[str, Any]],
+    outdir: Path,
+    num_workers: int,
+    cache_dir: Path,
 ) -> str:
-    diff_json = run_outdir / f"Run{run_number:08d}.gcd_differences.json"
-    summary_json = run_outdir / f"Run{run_number:08d}.gcd_summary.json"
-    job_name = f"gcd_compare_{run_number}"
+    job_name = f"gcd_compare_{job_index:04d}"
+    runs = f"{entries[0]['run']}-{entries[-1]['run']}"
 
     args = (
-        
-        f"--pass2-gcd {pass2_gcd} "
-        f"--pass3-gcd {pass3_gcd} "
-        f"--output-diffs-json {diff_json} "
-        f"--output-summary-json {summary_json}"
+        f"--manifest {manifest} "
+        f"--num-workers {num_workers} "
+        f"--cache-dir {cache_dir}"
     )
 
     lines = [
-        f"JOB {job_name} gcd_compare DIR {run_outdir}",
-        f'VARS {job_name} run="{run_number}" args="{args}"',
+        f"JOB {job_name} gcd_compare DIR {outdir}",
+        f'VARS {job_name} run="{runs}" args="{args}"',
         "",
     ]
     return "\n".join(lines)
@@ -307,8 +477,13 @@ def main() -> None:
     if not runs:
         raise SystemExit("No runs found in the GRL after filtering.")
 
-    dag_chunks = [build_submit_description(args)]
-    scheduled_runs = 0
+    if args.runs_per_job < 1:
+        raise SystemExit("--runs-per-job must be at least 1.")
+
+    index = GCDFileIndex(args.index_cache or args.outdir / "gcd_index.json")
+    cache_dir = (args.cache_dir or args.outdir / "gcd_cache").resolve()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entries: list[dict[str, Any]] = []
     skipped_runs = 0
 
     for run_record in runs:
@@ -320,6 +495,7 @@ def main() -> None:
                 args.pass2_gcd_dirs,
                 run_record,
                 PASS2_SUFFIXES,
+                index,
             )
             pass3_gcd = resolve_unique_gcd(
                 args.pass3_gcd_dirs,
@@ -328,6 +504,7 @@ def main() -> None:
                 run_number,
                 PASS3_SUFFIXES,
                 "Pass3",
+                index,
             )
         except (FileNotFoundError, RuntimeError, ValueError) as exc:
             skipped_runs += 1
@@ -337,24 +514,59 @@ def main() -> None:
         run_outdir = args.outdir / str(year) / str(run_number)
         run_outdir.mkdir(parents=True, exist_ok=True)
 
-        dag_chunks.append(
-            build_job_block(
+        entries.append(
+            build_manifest_entry(
                 run_number=run_number,
                 run_outdir=run_outdir,
                 pass2_gcd=pass2_gcd,
                 pass3_gcd=pass3_gcd,
             )
         )
-        scheduled_runs += 1
 
-    if scheduled_runs == 0:
+    index.save()
+    print(f"Listed {index.listed} changed GCD directories, {index.reused} unchanged")
+    for (top, depth) in sorted(index.trees):
+        duplicates = index.duplicates(top, depth, PASS2_SUFFIXES if depth else PASS3_SUFFIXES)
+        if duplicates:
+            print(f"{len(duplicates)} runs with more than one GCD in {top}")
+
+    if not entries:
         raise SystemExit("No DAG jobs were created. Check the GRL and GCD directory roots.")
 
+    manifest_dir = args.outdir / "manifests"
+
+    if args.local:
+        manifest = manifest_dir / "gcd_compare_all.json"
+        write_manifest(manifest, entries)
+        print(f"Comparing {len(entries)} runs locally, skipped {skipped_runs} runs")
+        subprocess.run(
+            [str(args.compare_script), "--manifest", str(manifest), "--num-workers", str(args.request_cpus),
+             "--cache-dir", str(cache_dir)],
+            check=True,
+        )
+        return
+
+    dag_chunks = [build_submit_description(args)]
+    for job_index, start in enumerate(range(0, len(entries), args.runs_per_job)):
+        chunk = entries[start:start + args.runs_per_job]
+        manifest = manifest_dir / f"gcd_compare_{job_index:04d}.json"
+        write_manifest(manifest, chunk)
+        dag_chunks.append(
+            build_job_block(
+                job_index=job_index,
+                manifest=manifest.resolve(),
+                entries=chunk,
+                outdir=args.outdir,
+                num_workers=args.request_cpus,
+                cache_dir=cache_dir,
+            )
+        )
+
     args.dagman.parent.mkdir(parents=True, exist_ok=True)
     args.dagman.write_text("\n".join(dag_chunks))
 
     print(f"Wrote DAG to {args.dagman}")
-    print(f"Scheduled {scheduled_runs} runs")
+    print(f"Scheduled {len(entries)} runs in {len(dag_chunks) - 1} jobs")
     print(f"Skipped {skipped_runs} runs")
 
 
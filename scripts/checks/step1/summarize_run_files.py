@@ -11,15 +11,21 @@ Usage:
     python3 summarize_run_files.py <run_number> <search_directory> [--search-days DAYS]
 
 The script searches the given directory and +/- N days (default: 1) for UUID files.
+Every UUID file is parsed once, in parallel (-j), into a run -> records index.
+With --catalog the index is read from the campaign catalog (utils/campaign_catalog.py)
+instead, without searching any directory.
 """
 
+import concurrent.futures
 import json
+import os
 import sys
 import re
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Dict, List, Set, Optional, Tuple
 from collections import defaultdict
+from utils.campaign_catalog import CampaignCatalog
 from utils.estimate_run_location import RunLocationEstimator
 
 
@@ -72,10 +78,16 @@ def get_search_paths(base_dir: Path, search_days: int = 1, year: Optional[int] =
     if run_number is not None:
         estimator = RunLocationEstimator()
         run_date = estimator.get_run_date(run_number)
-        
-        if run_date:
+        if run_date is None:
+            # Not in allruns.csv, interpolate between the neighbouring runs
+            run_date = estimator.estimate_run_date(run_number)
+            if run_date:
+                print(f"Run {run_number} not in allruns.csv, estimated date: {run_date.strftime('%Y-%m-%d')}",
+                      file=sys.stderr)
+        else:
             print(f"Run {run_number} date found: {run_date.strftime('%Y-%m-%d')}", file=sys.stderr)
-            
+
+        if run_date:
             yyyy = f"{run_date.year:04d}"
             mmdd = f"{run_date.month:02d}{run_date.day:02d}"
             
@@ -236,118 +248,95 @@ def find_uuid_files(search_dirs: List[Path]) -> Tuple[List[Path], List[Path]]:
     return json_files, ndjson_files
 
 
-def extract_pfraw_files_for_run(ndjson_files: List[Path], run_number: int) -> List[Dict]:
-    """
-    Extract PFRaw file records for a given run from NDJSON manifest files.
-    
-    Returns list of file records matching the run.
+def parse_manifest_file(ndjson_file: Path) -> Tuple[List[Tuple[int, int, Dict]], List[str]]:
     """
-    pfraw_files = []
-    
-    for ndjson_file in ndjson_files:
-        try:
-            with open(ndjson_file) as f:
-                for line_num, line in enumerate(f, start=1):
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        record = json.loads(line)
-                        logical_name = record.get("logical_name", "")
-                        filename = Path(logical_name).name
-                        
-                        result = extract_run_and_file_number(filename)
-                        if result:
-                            file_run, file_num = result
-                            if file_run == run_number:
-                                # Add source information
-                                record["_source_manifest"] = str(ndjson_file)
-                                pfraw_files.append(record)
-                    except json.JSONDecodeError as e:
-                        print(f"Warning: Failed to parse JSON in {ndjson_file} at line {line_num}: {e}", 
-                              file=sys.stderr)
-                        continue
-        except Exception as e:
-            print(f"Warning: Failed to read {ndjson_file}: {e}", file=sys.stderr)
-            continue
-    
-    return pfraw_files
+    Parse one NDJSON manifest file.
 
-
-def extract_pass3_files_for_run(json_files: List[Path], run_number: int) -> List[Dict]:
-    """
-    Extract Pass3/Online_Pass3 output file records for a given run from UUID JSON accounting files.
-    
-    Returns list of file records matching the run.
+    Returns ([(run_number, file_number, record), ...], warnings) for all records
+    with a run and file number, in file order.
     """
-    pass3_files = []
-    
-    for json_file in json_files:
-        try:
-            with open(json_file) as f:
-                data = json.load(f)
-            
-            # The JSON format is: { "bundle_path": [ {file_record}, ... ], ... }
-            for bundle_path, files in data.items():
-                for file_record in files:
-                    logical_name = file_record.get("logical_name", "")
+    records = []
+    warnings = []
+    try:
+        with open(ndjson_file) as f:
+            for line_num, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                    logical_name = record.get("logical_name", "")
                     filename = Path(logical_name).name
-                    
+
                     result = extract_run_and_file_number(filename)
                     if result:
                         file_run, file_num = result
-                        if file_run == run_number:
-                            # Add source information
-                            file_record["_source_accounting"] = str(json_file)
-                            file_record["_bundle_path"] = bundle_path
-                            pass3_files.append(file_record)
-        except Exception as e:
-            print(f"Warning: Failed to read {json_file}: {e}", file=sys.stderr)
-            continue
-    
-    return pass3_files
+                        # Add source information
+                        record["_source_manifest"] = str(ndjson_file)
+                        records.append((file_run, file_num, record))
+                except json.JSONDecodeError as e:
+                    warnings.append(f"Warning: Failed to parse JSON in {ndjson_file} at line {line_num}: {e}")
+                    continue
+    except Exception as e:
+        warnings.append(f"Warning: Failed to read {ndjson_file}: {e}")
+
+    return records, warnings
 
 
-def extract_all_runs(ndjson_files: List[Path], json_files: List[Path]) -> Set[int]:
+def parse_accounting_file(json_file: Path) -> Tuple[List[Tuple[int, int, Dict]], List[str]]:
     """
-    Extract all unique run numbers from both NDJSON and JSON files.
+    Parse one UUID JSON accounting file.
+
+    Returns ([(run_number, file_number, record), ...], warnings) for all records
+    with a run and file number, in file order.
     """
-    runs = set()
-    
-    for ndjson_file in ndjson_files:
-        try:
-            with open(ndjson_file) as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        record = json.loads(line)
-                        logical_name = record.get("logical_name", "")
-                        filename = Path(logical_name).name
-                        result = extract_run_and_file_number(filename)
-                        if result:
-                            runs.add(result[0])
-                    except json.JSONDecodeError:
-                        continue
-        except Exception:
-            pass
-    
-    for json_file in json_files:
-        try:
-            with open(json_file) as f:
-                data = json.load(f)
-            for bundle_path, files in data.items():
-                for file_record in files:
-                    logical_name = file_record.get("logical_name", "")
-                    filename = Path(logical_name).name
-                    result = extract_run_and_file_number(filename)
-                    if result:
-                        runs.add(result[0])
-        except Exception:
-            pass
-    
-    return runs
+    records = []
+    warnings = []
+    try:
+        with open(json_file) as f:
+            data = json.load(f)
+
+        # The JSON format is: { "bundle_path": [ {file_record}, ... ], ... }
+        for bundle_path, files in data.items():
+            for file_record in files:
+                logical_name = file_record.get("logical_name", "")
+                filename = Path(logical_name).name
+
+                result = extract_run_and_file_number(filename)
+                if result:
+                    file_run, file_num = result
+                    # Add source information
+                    file_record["_source_accounting"] = str(json_file)
+                    file_record["_bundle_path"] = bundle_path
+                    records.append((file_run, file_num, file_record))
+    except Exception as e:
+        warnings.append(f"Warning: Failed to read {json_file}: {e}")
+
+    return records, warnings
+
+
+def build_run_index(ndjson_files: List[Path], json_files: List[Path],
+                    num_workers: int = 1) -> Tuple[Dict[int, List[Tuple[int, Dict]]], Dict[int, List[Tuple[int, Dict]]]]:
+    """
+    Parse every NDJSON manifest and JSON accounting file once, in parallel,
+    and group the records by run.
+
+    Returns (pfraw, pass3), each {run_number: [(file_number, record), ...]} with
+    the records in the order of the files and of the records in each file.
+    """
+    pfraw: Dict[int, List[Tuple[int, Dict]]] = defaultdict(list)
+    pass3: Dict[int, List[Tuple[int, Dict]]] = defaultdict(list)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for index, parse, files in ((pfraw, parse_manifest_file, ndjson_files),
+                                    (pass3, parse_accounting_file, json_files)):
+            for records, warnings in executor.map(parse, files, chunksize=16):
+                for warning in warnings:
+                    print(warning, file=sys.stderr)
+                for file_run, file_num, record in records:
+                    index[file_run].append((file_num, record))
+
+    return dict(pfraw), dict(pass3)
 
 
 def load_good_runs(good_runs_path: Path) -> Set[int]:
@@ -433,6 +422,11 @@ def main():
                         help="Write a JSON file summarizing runs with PFraw vs Pass3 count mismatches and PFraw duplicates (default: runs_validation.json)")
     parser.add_argument("--good-runs", type=Path, default=None,
                        help="Path to file containing list of good run numbers (one per line or JSON array); only process these runs")
+    parser.add_argument("-j", "--num-workers", type=int, default=os.cpu_count() or 1,
+                       help="Number of processes parsing the UUID files (default: number of CPUs)")
+    parser.add_argument("--catalog", type=Path, default=None,
+                       help="Campaign catalog (see utils/campaign_catalog.py) to read the files from instead of "
+                            "searching; --run and --year select the runs, --month and --search-days are ignored")
     
     args = parser.parse_args()
     
@@ -455,14 +449,25 @@ def main():
     output_dir = args.output_dir if args.output_dir else args.search_directory
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Get search paths (pass year/month/run if provided)
-    search_paths = get_search_paths(args.search_directory, args.search_days, args.year, args.month, args.run)
-    print(f"Search paths: {search_paths}", file=sys.stderr)
-    
-    # Find UUID files
-    json_files, ndjson_files = find_uuid_files(search_paths)
-    print(f"Found {len(json_files)} UUID JSON files and {len(ndjson_files)} NDJSON manifest files", 
-          file=sys.stderr)
+    if args.catalog is not None:
+        # Indexed lookup in the campaign catalog
+        runs = [args.run] if args.run is not None else None
+        with CampaignCatalog(args.catalog) as catalog:
+            pfraw_index = catalog.run_records("input_files", runs=runs, year=args.year)
+            pass3_index = catalog.run_records("output_files", runs=runs, year=args.year)
+        print(f"Read {len(set(pfraw_index) | set(pass3_index))} runs from catalog {args.catalog}", file=sys.stderr)
+    else:
+        # Get search paths (pass year/month/run if provided)
+        search_paths = get_search_paths(args.search_directory, args.search_days, args.year, args.month, args.run)
+        print(f"Search paths: {search_paths}", file=sys.stderr)
+
+        # Find UUID files
+        json_files, ndjson_files = find_uuid_files(search_paths)
+        print(f"Found {len(json_files)} UUID JSON files and {len(ndjson_files)} NDJSON manifest files",
+              file=sys.stderr)
+
+        # Parse every file once
+        pfraw_index, pass3_index = build_run_index(ndjson_files, json_files, args.num_workers)
     
     # Determine which runs to process
     if args.run is not None:
@@ -471,7 +476,7 @@ def main():
         print(f"Searching for run {args.run} files...", file=sys.stderr)
     else:
         # Multi-run mode: extract all runs, optionally filter by year/month
-        all_runs = extract_all_runs(ndjson_files, json_files)
+        all_runs = set(pfraw_index) | set(pass3_index)
         print(f"Found {len(all_runs)} unique runs", file=sys.stderr)
         
         if args.year is not None:
@@ -508,18 +513,15 @@ def main():
     for run_num in runs_to_process:
         print(f"\nProcessing run {run_num:06d}...", file=sys.stderr)
         
-        # Extract PFRaw files for this run
-        pfraw_files = extract_pfraw_files_for_run(ndjson_files, run_num)
+        # PFRaw files for this run
+        pfraw_entries = pfraw_index.get(run_num, [])
+        pfraw_files = [rec for _, rec in pfraw_entries]
         total_pfraw_raw += len(pfraw_files)
 
         # Group by file number to detect duplicates and to deduplicate for counting
         file_groups = {}
-        for rec in pfraw_files:
-            fname = Path(rec.get("logical_name", "")).name
-            res = extract_run_and_file_number(fname)
-            if res:
-                fnum = res[1]
-                file_groups.setdefault(fnum, []).append(rec)
+        for fnum, rec in pfraw_entries:
+            file_groups.setdefault(fnum, []).append(rec)
 
         # Deduplicated PFraw list (first occurrence per file number)
         dedup_pfraw_files = []
@@ -530,8 +532,8 @@ def main():
         dedup_pfraw_count = len(dedup_pfraw_files)
         total_pfraw += dedup_pfraw_count
         
-        # Extract Pass3 output files for this run
-        pass3_files = extract_pass3_files_for_run(json_files, run_num)
+        # Pass3 output files for this run
+        pass3_files = [rec for _, rec in pass3_index.get(run_num, [])]
         total_pass3 += len(pass3_files)
         
         # Track count mismatches (using deduplicated PFraw count)
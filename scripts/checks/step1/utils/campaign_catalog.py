@@ -0,0 +1,732 @@
+#!/usr/bin/env python3
+"""
+Central SQLite catalog of the Step1 campaign accounting.
+
+Indexes what the Step1 jobs leave next to their outputs, for all years:
+- *.metadata.ndjson / *.metadata.json manifests: input files (input_files)
+- <uuid>.zip.json accounting of run_step1.py: output files (output_files)
+- <uuid>.zip.pfraw.contents.json: members of each bundle (bundle_members)
+- <uuid>.zip.duplicate_skip.json of submit_stampede3.py: skipped duplicates (skipped_members)
+- <outfile>.sha512sum sidecars: checksums of the output files (checksums)
+plus the bundles seen in any of them (bundles), a GRL (runs) and a per-bundle
+bundle_status view.
+
+Imports are incremental: every artifact is a row in sources with its mtime,
+size and a blake2b digest of its content. Unchanged files are not opened
+again, and touched files with the same digest are not parsed again. The rows
+of a changed file are replaced as a whole.
+
+Usage:
+    python3 campaign_catalog.py <catalog.sqlite> import <files or directories> [-j N] [--prune]
+    python3 campaign_catalog.py <catalog.sqlite> grl <grl file>
+    python3 campaign_catalog.py <catalog.sqlite> runs [--year 2020]
+    python3 campaign_catalog.py <catalog.sqlite> missing-files [--year 2020] [--all-runs]
+    python3 campaign_catalog.py <catalog.sqlite> duplicates
+    python3 campaign_catalog.py <catalog.sqlite> bundles [--incomplete]
+    python3 campaign_catalog.py <catalog.sqlite> checksum-mismatches
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    kind TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    digest TEXT,
+    n_rows INTEGER,
+    updated REAL
+);
+
+CREATE TABLE IF NOT EXISTS bundles (
+    bundle TEXT PRIMARY KEY,
+    path TEXT,
+    directory TEXT,
+    year INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS bundles_year ON bundles (year);
+
+CREATE TABLE IF NOT EXISTS input_files (
+    source TEXT,
+    position INTEGER,
+    bundle TEXT,
+    filename TEXT,
+    logical_name TEXT,
+    run INTEGER,
+    file_number INTEGER,
+    year INTEGER,
+    sha512 TEXT,
+    size INTEGER,
+    record TEXT,
+    PRIMARY KEY (source, position)
+);
+CREATE INDEX IF NOT EXISTS input_files_run ON input_files (run, file_number);
+CREATE INDEX IF NOT EXISTS input_files_year ON input_files (year, run);
+CREATE INDEX IF NOT EXISTS input_files_bundle ON input_files (bundle);
+
+CREATE TABLE IF NOT EXISTS output_files (
+    source TEXT,
+    position INTEGER,
+    bundle TEXT,
+    filename TEXT,
+    logical_name TEXT,
+    path TEXT,
+    run INTEGER,
+    file_number INTEGER,
+    year INTEGER,
+    sha512 TEXT,
+    size INTEGER,
+    record TEXT,
+    PRIMARY KEY (source, position)
+);
+CREATE INDEX IF NOT EXISTS output_files_run ON output_files (run, file_number);
+CREATE INDEX IF NOT EXISTS output_files_year ON output_files (year, run);
+CREATE INDEX IF NOT EXISTS output_files_bundle ON output_files (bundle);
+CREATE INDEX IF NOT EXISTS output_files_path ON output_files (path);
+
+CREATE TABLE IF NOT EXISTS bundle_members (
+    source TEXT,
+    bundle TEXT,
+    filename TEXT,
+    run INTEGER,
+    file_number INTEGER,
+    PRIMARY KEY (source, filename)
+);
+CREATE INDEX IF NOT EXISTS bundle_members_bundle ON bundle_members (bundle, filename);
+CREATE INDEX IF NOT EXISTS bundle_members_run ON bundle_members (run, file_number);
+
+CREATE TABLE IF NOT EXISTS skipped_members (
+    source TEXT,
+    bundle TEXT,
+    filename TEXT,
+    winner TEXT,
+    PRIMARY KEY (source, filename)
+);
+CREATE INDEX IF NOT EXISTS skipped_members_bundle ON skipped_members (bundle, filename);
+
+CREATE TABLE IF NOT EXISTS checksums (
+    source TEXT PRIMARY KEY,
+    path TEXT,
+    sha512 TEXT
+);
+CREATE INDEX IF NOT EXISTS checksums_path ON checksums (path);
+
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY,
+    year INTEGER,
+    good_i3 INTEGER,
+    start TEXT,
+    source TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS runs_good ON runs (good_i3, run);
+
+CREATE VIEW IF NOT EXISTS bundle_status AS
+SELECT b.bundle, b.year, b.path, b.directory,
+    (SELECT COUNT(*) FROM bundle_members m WHERE m.bundle = b.bundle) AS n_members,
+    (SELECT COUNT(*) FROM skipped_members s WHERE s.bundle = b.bundle) AS n_skipped,
+    (SELECT COUNT(*) FROM bundle_members m JOIN runs r ON r.run = m.run AND r.good_i3
+        WHERE m.bundle = b.bundle AND NOT EXISTS (
+            SELECT 1 FROM skipped_members s WHERE s.bundle = m.bundle AND s.filename = m.filename)) AS n_expected,
+    (SELECT COUNT(DISTINCT o.filename) FROM output_files o WHERE o.bundle = b.bundle) AS n_outputs
+FROM bundles b;
+"""
+
+# Tables filled from sources, with the rows of one source replaced as a whole
+SOURCE_TABLES = ("input_files", "output_files", "bundle_members", "skipped_members", "checksums")
+
+INSERTS = {
+    "input_files": "INSERT OR REPLACE INTO input_files (source, position, bundle, filename, logical_name, "
+                   "run, file_number, year, sha512, size, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "output_files": "INSERT OR REPLACE INTO output_files (source, position, bundle, filename, logical_name, path, "
+                    "run, file_number, year, sha512, size, record) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "bundle_members": "INSERT OR REPLACE INTO bundle_members (source, bundle, filename, run, file_number) "
+                      "VALUES (?, ?, ?, ?, ?)",
+    "skipped_members": "INSERT OR REPLACE INTO skipped_members (source, bundle, filename, winner) VALUES (?, ?, ?, ?)",
+    "checksums": "INSERT OR REPLACE INTO checksums (source, path, sha512) VALUES (?, ?, ?)",
+}
+
+FILE_PATTERN = re.compile(r"Run(\d+)_Subrun(\d+)_(\d+)")
+YEAR_PATTERN = re.compile(r"/(20\d\d)/")
+SHA512_PATTERN = re.compile(r"^[0-9a-fA-F]{128}$")
+# Accounting-like JSON files written by the checks, never accounting themselves
+NOT_ACCOUNTING = ("summary", "comparison", "contents", "duplicate_skip", "check_mapping", "validation", "index")
+
+
+def classify(name: str) -> Optional[str]:
+    """Kind of a Step1 artifact from its file name, None for anything else."""
+    if name.endswith(".sha512sum"):
+        return "sha512sum"
+    if name.endswith(".pfraw.contents.json"):
+        return "contents"
+    if name.endswith(".duplicate_skip.json"):
+        return "duplicate_skip"
+    if name.endswith(".ndjson") or name.lower().endswith(".metadata.json"):
+        return "manifest"
+    if name.endswith(".json") and not any(x in name for x in NOT_ACCOUNTING):
+        return "accounting"
+    return None
+
+
+def bundle_key(name: str) -> str:
+    """Bundle UUID from a bundle path or any <uuid>.* artifact name."""
+    return Path(str(name)).name.split(".")[0]
+
+
+def _run_and_file_number(filename: str) -> tuple[Optional[int], Optional[int]]:
+    match = FILE_PATTERN.search(filename)
+    if match:
+        return int(match.group(1)), int(match.group(3))
+    return None, None
+
+
+def _year(*paths: Optional[str]) -> Optional[int]:
+    for path in paths:
+        if path:
+            match = YEAR_PATTERN.search(str(path))
+            if match:
+                return int(match.group(1))
+    return None
+
+
+def _sha512(record: dict) -> Optional[str]:
+    checksum = record.get("checksum")
+    if isinstance(checksum, dict):
+        return checksum.get("sha512")
+    if isinstance(checksum, str) and str(record.get("checksumType", "")).lower() == "sha512":
+        return checksum
+    return None
+
+
+def _size(record: dict) -> Optional[int]:
+    for key in ("file_size", "fileSize", "size"):
+        try:
+            return int(record[key])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _manifest_records(text: str) -> list:
+    """Records of an NDJSON manifest or of a JSON manifest (list, or dict with files)."""
+    stripped = text.strip()
+    if stripped[:1] in "[{":
+        try:
+            payload = json.loads(stripped)
+        except json.JSONDecodeError:
+            payload = None
+        if isinstance(payload, dict) and isinstance(payload.get("files"), list):
+            return payload["files"]
+        if isinstance(payload, list):
+            return payload
+    records = []
+    for line in stripped.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records
+
+
+def _parse_manifest(path: Path, text: str) -> tuple[dict, list]:
+    rows, bundles = defaultdict(list), []
+    default_bundle = bundle_key(path.name)
+    for position, record in enumerate(_manifest_records(text)):
+        if not isinstance(record, dict):
+            continue
+        logical_name = record.get("logical_name") or record.get("fileName") or record.get("file") or ""
+        if not logical_name:
+            continue
+        filename = Path(logical_name).name
+        run, file_number = _run_and_file_number(filename)
+        bundle = str(record.get("uuid") or record.get("bundle_uuid") or default_bundle)
+        record["_source_manifest"] = str(path)
+        rows["input_files"].append((str(path), position, bundle, filename, logical_name, run, file_number,
+                                    _year(logical_name, str(path)), _sha512(record), _size(record),
+                                    json.dumps(record)))
+    if rows["input_files"]:
+        bundles.append((default_bundle, None, str(path.parent), None))
+    return rows, bundles
+
+
+def _parse_accounting(path: Path, text: str) -> tuple[dict, list]:
+    data = json.loads(text)
+    if not isinstance(data, dict) or not all(isinstance(files, list) for files in data.values()):
+        return {}, []
+    rows, bundles = defaultdict(list), []
+    position = 0
+    for bundle_path, files in data.items():
+        bundle = bundle_key(bundle_path)
+        bundles.append((bundle, bundle_path, str(path.parent), _year(bundle_path)))
+        for record in files:
+            if not isinstance(record, dict):
+                continue
+            logical_name = record.get("logical_name", "")
+            filename = Path(logical_name).name
+            run, file_number = _run_and_file_number(filename)
+            locations = record.get("locations") or [{}]
+            record["_source_accounting"] = str(path)
+            record["_bundle_path"] = bundle_path
+            rows["output_files"].append((str(path), position, bundle, filename, logical_name,
+                                         locations[0].get("path"), run, file_number,
+                                         _year(logical_name, bundle_path), _sha512(record), _size(record),
+                                         json.dumps(record)))
+            position += 1
+    return rows, bundles
+
+
+def _parse_contents(path: Path, text: str) -> tuple[dict, list]:
+    rows, bundles = defaultdict(list), []
+    for bundle_name, members in json.loads(text).items():
+        bundle = bundle_key(bundle_name)
+        bundles.append((bundle, None, str(path.parent), _year(str(path))))
+        for member in members:
+            filename = Path(member).name
+            rows["bundle_members"].append((str(path), bundle, filename, *_run_and_file_number(filename)))
+    return rows, bundles
+
+
+def _parse_duplicate_skip(path: Path, text: str) -> tuple[dict, list]:
+    payload = json.loads(text)
+    bundle_path = payload.get("bundle") or path.name
+    bundle = bundle_key(bundle_path)
+    winners = payload.get("winners", {})
+    rows = {"skipped_members": [
+        (str(path), bundle, Path(member).name, bundle_key(winners[member]) if member in winners else None)
+        for member in payload.get("skip_members", [])
+    ]}
+    return rows, [(bundle, payload.get("bundle"), None, _year(payload.get("bundle")))]
+
+
+def _parse_sha512sum(path: Path, text: str) -> tuple[dict, list]:
+    # run_step1.py writes "<outfile> <sha512>", sha512sum writes "<sha512>  <file>"
+    words = text.split()
+    if len(words) != 2:
+        return {}, []
+    first, second = words
+    checksum, file_path = (first, second) if SHA512_PATTERN.match(first) else (second, first)
+    if not SHA512_PATTERN.match(checksum):
+        return {}, []
+    return {"checksums": [(str(path), file_path, checksum.lower())]}, []
+
+
+PARSERS = {
+    "manifest": _parse_manifest,
+    "accounting": _parse_accounting,
+    "contents": _parse_contents,
+    "duplicate_skip": _parse_duplicate_skip,
+    "sha512sum": _parse_sha512sum,
+}
+
+
+def parse_source(path: str, kind: str, known_digest: Optional[str] = None) -> dict:
+    """Read, digest and (unless the digest is known) parse one artifact.
+
+    Returns a dict with path, kind, mtime_ns, size, digest, rows ({table: [row tuples]},
+    None if the digest matched known_digest), bundles and warnings."""
+    result = {"path": path, "kind": kind, "rows": None, "bundles": [], "warnings": []}
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        result["warnings"].append(f"Warning: Failed to read {path}: {e}")
+        result.update(mtime_ns=None, size=None, digest=None, rows={})
+        return result
+    result.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+                  digest=hashlib.blake2b(data, digest_size=16).hexdigest())
+    if result["digest"] == known_digest:
+        return result
+    try:
+        rows, bundles = PARSERS[kind](Path(path), data.decode("utf-8", errors="replace"))
+    except (ValueError, AttributeError, TypeError) as e:
+        result["warnings"].append(f"Warning: Failed to parse {path} as {kind}: {e}")
+        rows, bundles = {}, []
+    result["rows"] = dict(rows)
+    result["bundles"] = bundles
+    return result
+
+
+def scan_artifacts(locations: Iterable[Path]) -> dict[str, tuple[str, int, int]]:
+    """{path: (kind, mtime_ns, size)} of all Step1 artifacts in the given files and trees."""
+    found = {}
+    stack = []
+    for location in locations:
+        if location.is_dir():
+            stack.append(str(location))
+        elif location.is_file():
+            kind = classify(location.name)
+            if kind is not None:
+                stat = location.stat()
+                found[str(location)] = (kind, stat.st_mtime_ns, stat.st_size)
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                kind = classify(entry.name)
+                if kind is not None and entry.is_file():
+                    stat = entry.stat()
+                    found[entry.path] = (kind, stat.st_mtime_ns, stat.st_size)
+    return found
+
+
+def load_run_list(path: Path) -> list[tuple]:
+    """(run, year, good_i3, start) from a GRL.
+
+    Supports the i3live JSON ({"runs": [{"run": ..., "good_i3": ...}]}), a JSON list
+    of run records ({"run_number": ..., "start": ..., "latest_snapshot": {"good_i3": ...}})
+    and one good run per line."""
+    text = path.read_text().strip()
+    if not text:
+        return []
+    if text[0] in "[{":
+        payload = json.loads(text)
+        records = payload.get("runs", []) if isinstance(payload, dict) else payload
+        runs = []
+        for record in records:
+            if not isinstance(record, dict):
+                runs.append((int(record), None, True, None))
+                continue
+            run = record.get("run", record.get("run_number"))
+            if run is None:
+                continue
+            good = record.get("good_i3", record.get("latest_snapshot", {}).get("good_i3", False))
+            start = record.get("start") or record.get("good_tstart")
+            runs.append((int(run), int(str(start)[:4]) if start else None, bool(good), start))
+        return runs
+    return [(int(line), None, True, None) for line in map(str.strip, text.splitlines())
+            if line and not line.startswith("#")]
+
+
+class CampaignCatalog:
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Inserts
+
+    def known_sources(self) -> dict[str, tuple]:
+        """{path: (mtime_ns, size, digest)} of all imported artifacts."""
+        return {path: (mtime_ns, size, digest) for path, mtime_ns, size, digest
+                in self.conn.execute("SELECT path, mtime_ns, size, digest FROM sources")}
+
+    def replace_source(self, parsed: dict) -> int:
+        """Store one parse_source result, replacing all rows of a changed source."""
+        now = time.time()
+        with self.conn:
+            if parsed["rows"] is None:
+                # Same content, only touched
+                self.conn.execute("UPDATE sources SET mtime_ns = ?, size = ?, updated = ? WHERE path = ?",
+                                  (parsed["mtime_ns"], parsed["size"], now, parsed["path"]))
+                return 0
+            for table in SOURCE_TABLES:
+                self.conn.execute(f"DELETE FROM {table} WHERE source = ?", (parsed["path"],))
+            n_rows = 0
+            for table, rows in parsed["rows"].items():
+                self.conn.executemany(INSERTS[table], rows)
+                n_rows += len(rows)
+            self.conn.executemany(
+                "INSERT INTO bundles (bundle, path, directory, year, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (bundle) DO UPDATE SET path = COALESCE(excluded.path, path), "
+                "directory = COALESCE(excluded.directory, directory), year = COALESCE(excluded.year, year), "
+                "updated = excluded.updated",
+                [(*bundle, now) for bundle in parsed["bundles"]],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, kind, mtime_ns, size, digest, n_rows, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (parsed["path"], parsed["kind"], parsed["mtime_ns"], parsed["size"], parsed["digest"], n_rows, now),
+            )
+        return n_rows
+
+    def remove_sources(self, paths: Iterable[str]) -> int:
+        paths = list(paths)
+        with self.conn:
+            for table in SOURCE_TABLES:
+                self.conn.executemany(f"DELETE FROM {table} WHERE source = ?", [(path,) for path in paths])
+            self.conn.executemany("DELETE FROM sources WHERE path = ?", [(path,) for path in paths])
+        return len(paths)
+
+    def insert_runs(self, runs: Iterable[tuple], source: Optional[str] = None) -> int:
+        """Insert or replace GRL runs, as (run, year, good_i3, start)."""
+        now = time.time()
+        values = [(run, year, int(good), start, source, now) for run, year, good, start in runs]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO runs (run, year, good_i3, start, source, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                values,
+            )
+        return len(values)
+
+    # Queries
+
+    def has_grl(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM runs LIMIT 1").fetchone() is not None
+
+    def _require_grl(self, what: str) -> None:
+        if not self.has_grl():
+            raise ValueError(f"The catalog has no GRL for {what}. Import one with 'grl'.")
+
+    def _run_filter(self, column: str, year: Optional[int], good_only: bool) -> tuple[str, list]:
+        """WHERE clause on the runs of a table. Rows without a year in their paths
+        take the year of their run in the GRL (see rows_without_year)."""
+        clauses, params = [f"{column}.run IS NOT NULL"], []
+        if year is not None:
+            clauses.append(f"COALESCE({column}.year, (SELECT r.year FROM runs r WHERE r.run = {column}.run)) = ?")
+            params.append(year)
+        if good_only:
+            self._require_grl("selecting the good runs")
+            clauses.append(f"{column}.run IN (SELECT run FROM runs WHERE good_i3)")
+        return " AND ".join(clauses), params
+
+    def rows_without_year(self) -> dict[str, list[int]]:
+        """{table: [runs]} of input and output files with no year in their paths or
+        in the GRL, which no year selects."""
+        runs = {}
+        for table in ("input_files", "output_files"):
+            unknown = [run for run, in self.conn.execute(
+                f"SELECT DISTINCT run FROM {table} t WHERE t.run IS NOT NULL AND t.year IS NULL "
+                f"AND NOT EXISTS (SELECT 1 FROM runs r WHERE r.run = t.run AND r.year IS NOT NULL) ORDER BY run")]
+            if unknown:
+                runs[table] = unknown
+        return runs
+
+    def run_info(self) -> dict[int, dict]:
+        """{run: {"start": ..., "latest_snapshot": {"good_i3": ...}}} of the GRL, as in i3live."""
+        info = {}
+        for run, good, start in self.conn.execute("SELECT run, good_i3, start FROM runs"):
+            info[run] = {"run_number": run, "latest_snapshot": {"good_i3": bool(good)}}
+            if start is not None:
+                info[run]["start"] = start
+        return info
+
+    def file_numbers(self, table: str, year: Optional[int] = None, good_only: bool = False) -> dict[int, set[int]]:
+        """{run: {file numbers}} of the input_files or output_files."""
+        where, params = self._run_filter(table, year, good_only)
+        numbers: dict[int, set[int]] = defaultdict(set)
+        for run, file_number in self.conn.execute(
+                f"SELECT DISTINCT run, file_number FROM {table} WHERE {where}", params):
+            numbers[run].add(file_number)
+        return dict(numbers)
+
+    def run_records(self, table: str, runs: Optional[Iterable[int]] = None,
+                    year: Optional[int] = None) -> dict[int, list[tuple[int, dict]]]:
+        """{run: [(file_number, record), ...]} of the input_files or output_files,
+        in the order of the sources and of the records in each source."""
+        where, params = self._run_filter(table, year, False)
+        if runs is not None:
+            runs = list(runs)
+            where += f" AND {table}.run IN ({', '.join('?' * len(runs))})"
+            params += runs
+        records: dict[int, list[tuple[int, dict]]] = defaultdict(list)
+        for run, file_number, record in self.conn.execute(
+                f"SELECT run, file_number, record FROM {table} WHERE {where} ORDER BY source, position", params):
+            records[run].append((file_number, json.loads(record)))
+        return dict(records)
+
+    def run_summary(self, year: Optional[int] = None) -> list[tuple]:
+        """(year, run, input files, output files) per run, counting distinct file numbers."""
+        where, params = self._run_filter("f", year, False)
+        query = f"""
+            SELECT MAX(year), run, COUNT(DISTINCT CASE WHEN kind = 'in' THEN file_number END),
+                   COUNT(DISTINCT CASE WHEN kind = 'out' THEN file_number END)
+            FROM (SELECT 'in' AS kind, run, file_number, year FROM input_files
+                  UNION ALL SELECT 'out', run, file_number, year FROM output_files) f
+            WHERE {where} GROUP BY run ORDER BY run"""
+        return self.conn.execute(query, params).fetchall()
+
+    def missing_files(self, year: Optional[int] = None, good_only: bool = True) -> dict[int, list[int]]:
+        """{run: [file numbers]} of runs with missing output files.
+
+        A file number is missing if it has no output but is either an input of the
+        run or below the largest file number seen in the run (a gap). With good_only,
+        this needs a GRL."""
+        inputs = self.file_numbers("input_files", year, good_only)
+        outputs = self.file_numbers("output_files", year, good_only)
+        missing = {}
+        for run in sorted(set(inputs) | set(outputs)):
+            have = outputs.get(run, set())
+            expected = set(range(max(inputs.get(run, set()) | have) + 1)) | inputs.get(run, set())
+            if expected - have:
+                missing[run] = sorted(expected - have)
+        return missing
+
+    def runs_without_files(self, year: Optional[int] = None) -> list[int]:
+        """Good runs of the GRL without any input or output file in the catalog."""
+        query = ("SELECT run FROM runs r WHERE good_i3 "
+                 "AND NOT EXISTS (SELECT 1 FROM input_files i WHERE i.run = r.run) "
+                 "AND NOT EXISTS (SELECT 1 FROM output_files o WHERE o.run = r.run)")
+        params: tuple = ()
+        if year is not None:
+            query += " AND year = ?"
+            params = (year,)
+        return [run for run, in self.conn.execute(query + " ORDER BY run", params)]
+
+    def duplicate_inputs(self) -> list[tuple]:
+        """(run, file number, bundles) of input files listed by more than one bundle."""
+        cursor = self.conn.execute(
+            "SELECT run, file_number, GROUP_CONCAT(DISTINCT bundle) FROM input_files WHERE run IS NOT NULL "
+            "GROUP BY run, file_number HAVING COUNT(DISTINCT bundle) > 1 ORDER BY run, file_number")
+        return [(run, file_number, sorted(bundles.split(","))) for run, file_number, bundles in cursor]
+
+    def bundle_statuses(self, incomplete_only: bool = False) -> list[tuple]:
+        """(bundle, year, members, skipped, expected outputs, outputs) per bundle.
+
+        Only members of good runs are expected, so this needs a GRL."""
+        self._require_grl("counting the expected outputs")
+        query = "SELECT bundle, year, n_members, n_skipped, n_expected, n_outputs FROM bundle_status"
+        if incomplete_only:
+            query += " WHERE n_outputs < n_expected"
+        return self.conn.execute(query + " ORDER BY year, bundle").fetchall()
+
+    def checksum_mismatches(self) -> list[tuple]:
+        """(path, accounting sha512, sidecar sha512) of outputs whose checksums differ."""
+        return self.conn.execute(
+            "SELECT o.path, o.sha512, c.sha512 FROM output_files o JOIN checksums c ON c.path = o.path "
+            "WHERE o.sha512 != c.sha512 ORDER BY o.path").fetchall()
+
+
+def import_artifacts(catalog: CampaignCatalog, locations: Iterable[Path], num_workers: int = 1,
+                     prune: bool = False) -> dict:
+    """Import new and changed artifacts from the given trees, parsed in parallel.
+
+    With prune, sources below the given locations that no longer exist are removed."""
+    locations = [location.resolve() for location in locations]
+    found = scan_artifacts(locations)
+    known = catalog.known_sources()
+    todo = [(path, kind, known[path][2] if path in known else None)
+            for path, (kind, mtime_ns, size) in sorted(found.items())
+            if path not in known or known[path][:2] != (mtime_ns, size)]
+
+    counts = {"found": len(found), "unchanged": len(found) - len(todo), "touched": 0,
+              "imported": 0, "rows": 0, "removed": 0}
+    paths, kinds, digests = zip(*todo) if todo else ((), (), ())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for parsed in executor.map(parse_source, paths, kinds, digests, chunksize=16):
+            for warning in parsed["warnings"]:
+                print(warning)
+            if parsed["digest"] is None:
+                continue
+            if parsed["rows"] is None:
+                counts["touched"] += 1
+            else:
+                counts["imported"] += 1
+            counts["rows"] += catalog.replace_source(parsed)
+
+    if prune:
+        roots = [str(location) for location in locations]
+        gone = [path for path in known
+                if path not in found and any(path == root or path.startswith(root + os.sep) for root in roots)]
+        counts["removed"] = catalog.remove_sources(gone)
+    return counts
+
+
+def warn_rows_without_year(catalog: CampaignCatalog) -> None:
+    for table, runs in catalog.rows_without_year().items():
+        print(f"Warning: {table} of runs {runs} have no year in their paths or the GRL, "
+              f"--year does not select them", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and query the Step1 campaign catalog")
+    parser.add_argument("catalog", type=Path, help="SQLite file of the campaign catalog")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import new and changed accounting artifacts")
+    import_parser.add_argument("locations", type=Path, nargs="+", help="Files or directories to search")
+    import_parser.add_argument("-j", "--num-workers", type=int, default=os.cpu_count() or 1)
+    import_parser.add_argument("--prune", action="store_true",
+                               help="Remove artifacts below the locations that no longer exist")
+
+    grl_parser = subparsers.add_parser("grl", help="Import a good run list")
+    grl_parser.add_argument("grl", type=Path)
+
+    runs_parser = subparsers.add_parser("runs", help="Input and output file counts per run")
+    runs_parser.add_argument("--year", type=int, default=None)
+
+    missing_parser = subparsers.add_parser("missing-files", help="GRL runs with missing output files")
+    missing_parser.add_argument("--year", type=int, default=None)
+    missing_parser.add_argument("--all-runs", action="store_true", help="Not only the good runs of the GRL")
+
+    subparsers.add_parser("duplicates", help="Input files listed by more than one bundle")
+
+    bundles_parser = subparsers.add_parser("bundles", help="Expected and produced outputs per bundle")
+    bundles_parser.add_argument("--incomplete", action="store_true", help="Only bundles with missing outputs")
+
+    subparsers.add_parser("checksum-mismatches", help="Outputs whose accounting and sidecar checksums differ")
+
+    args = parser.parse_args()
+
+    with CampaignCatalog(args.catalog) as catalog:
+        if args.command == "import":
+            counts = import_artifacts(catalog, args.locations, args.num_workers, args.prune)
+            print(f"Found {counts['found']} artifacts: {counts['imported']} imported ({counts['rows']} rows), "
+                  f"{counts['touched']} touched but unchanged, {counts['unchanged']} unchanged, "
+                  f"{counts['removed']} removed")
+        elif args.command == "grl":
+            print(f"Imported {catalog.insert_runs(load_run_list(args.grl), str(args.grl))} runs from {args.grl}")
+        elif args.command == "runs":
+            if args.year is not None:
+                warn_rows_without_year(catalog)
+            for year, run, n_inputs, n_outputs in catalog.run_summary(args.year):
+                print(f"{year} {run} {n_inputs} {n_outputs}")
+        elif args.command == "missing-files":
+            if args.year is not None:
+                warn_rows_without_year(catalog)
+            try:
+                missing = catalog.missing_files(args.year, good_only=not args.all_runs)
+            except ValueError as e:
+                sys.exit(f"Error: {e} Or use --all-runs.")
+            # Same format as the input of check_bad_files.py
+            for run, file_numbers in missing.items():
+                print(f"Run {run} is missing files! Missing file numbers: {file_numbers}")
+            if not args.all_runs:
+                for run in catalog.runs_without_files(args.year):
+                    print(f"Run {run} has no files in the catalog", file=sys.stderr)
+        elif args.command == "duplicates":
+            for run, file_number, bundles in catalog.duplicate_inputs():
+                print(f"{run} {file_number} {' '.join(bundles)}")
+        elif args.command == "bundles":
+            try:
+                statuses = catalog.bundle_statuses(args.incomplete)
+            except ValueError as e:
+                sys.exit(f"Error: {e}")
+            for bundle, year, n_members, n_skipped, n_expected, n_outputs in statuses:
+                print(f"{year} {bundle} members={n_members} skipped={n_skipped} "
+                      f"expected={n_expected} outputs={n_outputs}")
+        elif args.command == "checksum-mismatches":
+            for path, accounting, sidecar in catalog.checksum_mismatches():
+                print(f"{path} {accounting} {sidecar}")
+
+
+if __name__ == "__main__":
+    main()
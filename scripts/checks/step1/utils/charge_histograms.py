@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Load the per-file ATWD/FADC charge histogram sidecars (*.fadc_atwd_charge.npz).
+
+Three layouts exist on disk:
+- the compact format written by PulseChargeFilterHarvester
+  (icetray/step1/monitoring_extractors/charge_histogram_format.py)
+- dense (87, 61, nbins) float32 arrays from the numba harvester before that
+- per-DOM (string, om) rows from pass3_charge_fadc_gain.py, whose histograms
+  carry one extra, always empty, bin past the last bin edge
+
+load_charge_histograms returns the same dense arrays for all of them, and
+load_charge_means reads only the per-DOM mean charges.
+"""
+
+import importlib.util
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+CHARGE_HISTOGRAM_FORMAT_PATH = (Path(__file__).resolve().parents[3] / "icetray" / "step1"
+                                / "monitoring_extractors" / "charge_histogram_format.py")
+CHARGE_HISTOGRAM_FORMAT_SPEC = importlib.util.spec_from_file_location("step1_charge_histogram_format",
+                                                                      CHARGE_HISTOGRAM_FORMAT_PATH)
+if CHARGE_HISTOGRAM_FORMAT_SPEC is None or CHARGE_HISTOGRAM_FORMAT_SPEC.loader is None:
+    raise ImportError(f"Could not load the charge histogram format from {CHARGE_HISTOGRAM_FORMAT_PATH}")
+
+charge_histogram_format = importlib.util.module_from_spec(CHARGE_HISTOGRAM_FORMAT_SPEC)
+CHARGE_HISTOGRAM_FORMAT_SPEC.loader.exec_module(charge_histogram_format)
+
+ChargeHistogramFile = charge_histogram_format.ChargeHistogramFile
+HISTOGRAM_SHAPE = charge_histogram_format.HISTOGRAM_SHAPE
+
+
+def _from_per_dom_rows(data: dict) -> dict:
+    nbins = len(data["bins"]) - 1
+    strings, oms = data.pop("string"), data.pop("om")
+    keep = (strings < HISTOGRAM_SHAPE[0]) & (oms < HISTOGRAM_SHAPE[1])
+    for channel in charge_histogram_format.CHANNELS:
+        histograms = np.zeros(HISTOGRAM_SHAPE + (nbins,), dtype=np.float32)
+        histograms[strings[keep], oms[keep]] = data[channel][keep, :nbins]
+        data[channel] = histograms
+    return data
+
+
+def load_charge_histograms(filename: Union[str, Path]) -> dict:
+    """
+    Load a charge histogram sidecar.
+
+    Returns a dict with `bins` and dense (87, 61, nbins) float32 `atwd` and
+    `fadc` histograms, plus whatever else was stored in the file (`start`,
+    `bounds`, `atwd_mean`, ...).
+    """
+    data = charge_histogram_format.read_charge_histograms(filename)
+    if "string" in data:
+        return _from_per_dom_rows(data)
+    return data
+
+
+def load_charge_means(filename: Union[str, Path]) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """
+    (atwd_mean, fadc_mean) of a charge histogram sidecar, None if it has none.
+
+    Only the two arrays are read, the histograms are not decoded.
+    """
+    with ChargeHistogramFile(filename) as sidecar:
+        if "atwd_mean" not in sidecar or "fadc_mean" not in sidecar:
+            return None
+        return np.array(sidecar["atwd_mean"]), np.array(sidecar["fadc_mean"])
+
+
+def load_start_time(data: dict) -> Optional[np.datetime64]:
+    """Start time of a loaded sidecar, None if it was not recorded."""
+    start = data.get("start")
+    if start is None:
+        return None
+    start = start[()]
+    if not isinstance(start, np.datetime64) or np.isnat(start):
+        return None
+    return start
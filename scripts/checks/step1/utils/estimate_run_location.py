@@ -1,73 +1,194 @@
 #!/usr/bin/env python3
 """
 Utility to estimate run location (date) from run number using allruns.csv.
+
+The CSV is parsed once into sorted NumPy arrays of run numbers and start
+times, which are cached as .npz (keyed by the CSV path, mtime and size) so
+later processes skip the CSV parsing. Lookups are binary searches. Run
+numbers increase with time, so runs missing from the CSV are bracketed by
+their neighbours and their start time can be interpolated.
 """
 
 import csv
+import functools
+import hashlib
+import os
+import tempfile
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("PASS3_RUN_CACHE", Path.home() / ".cache" / "pass3" / "runs"))
+FORMAT_VERSION = 1
+
+
+def parse_allruns_csv(csv_path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse allruns.csv into (runs, starts): int64 run numbers and datetime64[s]
+    start times, sorted by run. Rows without a valid run number or start time
+    are skipped, and the first row of a run wins.
+    """
+    runs = []
+    starts = []
+    with open(csv_path, 'r', encoding='utf-8', errors='replace') as f:
+        for row in csv.DictReader(f):
+            try:
+                run = int(row.get("Run number") or "")
+                # Format is typically "YYYY-MM-DD HH:MM:SS..."
+                start = np.datetime64((row.get("Start time") or "").strip()[:19].replace(' ', 'T'), 's')
+            except ValueError:
+                continue
+            if np.isnat(start):
+                continue
+            runs.append(run)
+            starts.append(start)
+
+    runs = np.asarray(runs, dtype=np.int64)
+    starts = np.asarray(starts, dtype='datetime64[s]')
+    order = np.argsort(runs, kind='stable')
+    runs, first = np.unique(runs[order], return_index=True)
+    return runs, starts[order][first]
+
+
+def cache_path(csv_path: Path, cache_dir: Path = DEFAULT_CACHE_DIR) -> Path:
+    key = hashlib.blake2b(str(csv_path.resolve()).encode(), digest_size=8).hexdigest()
+    return Path(cache_dir) / f"{csv_path.stem}.{key}.npz"
+
+
+@functools.lru_cache(maxsize=None)
+def load_run_table(csv_path: Path, cache_dir: Path = DEFAULT_CACHE_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorted (runs, starts) of allruns.csv, from the .npz cache when it matches
+    the CSV's mtime and size. Loaded once per process.
+    """
+    stat = csv_path.stat()
+    stamp = np.array([FORMAT_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cached = cache_path(csv_path, cache_dir)
+    try:
+        with np.load(cached) as data:
+            if np.array_equal(data["stamp"], stamp):
+                return data["runs"], data["starts"].astype('datetime64[s]')
+    except (OSError, KeyError, ValueError):
+        pass
+
+    runs, starts = parse_allruns_csv(csv_path)
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cached.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            # datetime64 is stored as int64 seconds, so the cache loads without pickle
+            np.savez(f, stamp=stamp, runs=runs, starts=starts.astype(np.int64))
+        os.replace(tmp, cached)
+    except OSError as e:
+        print(f"Warning: could not cache {csv_path} in {cached}: {e}")
+    return runs, starts
+
+
+def _to_datetime(start: np.datetime64) -> Optional[datetime]:
+    """Date of a start time as datetime (with time 00:00:00), None for NaT."""
+    if np.isnat(start):
+        return None
+    return datetime.strptime(str(start.astype('datetime64[D]')), "%Y-%m-%d")
+
 
 class RunLocationEstimator:
-    def __init__(self, csv_path: Optional[Path] = None):
+    def __init__(self, csv_path: Optional[Path] = None, cache_dir: Path = DEFAULT_CACHE_DIR):
         if csv_path is None:
             # Default: ../../../../data/allruns.csv relative to this file
             # Current file is scripts/checks/step1/utils/estimate_run_location.py
             self.csv_path = Path(__file__).resolve().parent.parent.parent.parent.parent / "data" / "allruns.csv"
         else:
             self.csv_path = Path(csv_path)
+        self.cache_dir = Path(cache_dir)
+        self._table: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @property
+    def table(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted (runs, starts), empty if allruns.csv does not exist or cannot be read."""
+        if self._table is None:
+            self._table = np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[s]')
+            if self.csv_path.exists():
+                try:
+                    self._table = load_run_table(self.csv_path, self.cache_dir)
+                except Exception as e:
+                    print(f"Error reading allruns.csv: {e}")
+        return self._table
+
+    def get_run_start_times(self, runs: Iterable[int], interpolate: bool = False) -> np.ndarray:
+        """
+        Start times (datetime64[s]) for an array of run numbers. Runs missing from
+        the CSV are NaT, or with interpolate=True linearly interpolated in run number
+        between the neighbouring runs (still NaT outside the range of the CSV).
+        """
+        known_runs, starts = self.table
+        runs = np.asarray(runs, dtype=np.int64)
+        result = np.full(runs.shape, np.datetime64('NaT'), dtype='datetime64[s]')
+        if known_runs.size == 0:
+            return result
+
+        index = np.searchsorted(known_runs, runs)
+        found = index < known_runs.size
+        found[found] = known_runs[index[found]] == runs[found]
+        result[found] = starts[index[found]]
+
+        if interpolate:
+            inside = ~found & (runs > known_runs[0]) & (runs < known_runs[-1])
+            seconds = starts.astype(np.int64)
+            result[inside] = np.interp(runs[inside], known_runs, seconds).astype(np.int64).astype('datetime64[s]')
+        return result
+
+    def get_run_dates(self, runs: Iterable[int], interpolate: bool = False) -> np.ndarray:
+        """
+        Start dates (datetime64[D]) for an array of run numbers, NaT where unknown.
+        See get_run_start_times for interpolate.
+        """
+        return self.get_run_start_times(runs, interpolate).astype('datetime64[D]')
 
     def get_run_date(self, run_number: int) -> Optional[datetime]:
         """
         Get the start date for a given run number.
         Returns datetime object (with time 00:00:00) or None if run not found.
         """
-        if not self.csv_path.exists():
-            return None
-            
-        try:
-            with open(self.csv_path, 'r', encoding='utf-8', errors='replace') as f:
-                reader = csv.DictReader(f)
-                
-                for row in reader:
-                    try:
-                        # Clean up keys if necessary (sometimes BOM or whitespace)
-                        # We iterate keys to find "Run number" and "Start time" if exact match fails?
-                        # But standard DictReader should work if headers are clean.
-                        
-                        run_num_str = row.get("Run number")
-                        if not run_num_str:
-                            continue
-                            
-                        if int(run_num_str) == run_number:
-                            start_time_str = row.get("Start time")
-                            if start_time_str:
-                                # Format is typically "YYYY-MM-DD HH:MM:SS..."
-                                # We only need the date part usually.
-                                try:
-                                    date_str = start_time_str.split(' ')[0]
-                                    return datetime.strptime(date_str, "%Y-%m-%d")
-                                except ValueError:
-                                    return None
-                            return None
-                    except (ValueError, IndexError):
-                        continue
-                        
-        except Exception as e:
-            print(f"Error reading allruns.csv: {e}")
-            return None
-        
-        return None
+        return _to_datetime(self.get_run_start_times([run_number])[0])
+
+    def estimate_run_date(self, run_number: int) -> Optional[datetime]:
+        """
+        Like get_run_date, but interpolated between the neighbouring runs for runs
+        missing from the CSV. None for runs outside the range of the CSV.
+        """
+        return _to_datetime(self.get_run_start_times([run_number], interpolate=True)[0])
+
+    def bracket_run(self, run_number: int) -> Tuple[Optional[Tuple[int, datetime]], Optional[Tuple[int, datetime]]]:
+        """
+        The closest runs in the CSV at or below and at or above run_number,
+        as (run, date) each, or None at either end.
+        """
+        known_runs, starts = self.table
+        above = int(np.searchsorted(known_runs, run_number, side='left'))
+        below = int(np.searchsorted(known_runs, run_number, side='right')) - 1
+        lower = (int(known_runs[below]), _to_datetime(starts[below])) if below >= 0 else None
+        upper = (int(known_runs[above]), _to_datetime(starts[above])) if above < known_runs.size else None
+        return lower, upper
+
 
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1:
-        run = int(sys.argv[1])
         est = RunLocationEstimator()
-        date = est.get_run_date(run)
-        if date:
-            print(f"Run {run} was on {date.strftime('%Y-%m-%d')}")
-        else:
-            print(f"Run {run} not found or date unknown")
+        for arg in sys.argv[1:]:
+            run = int(arg)
+            date = est.get_run_date(run)
+            if date:
+                print(f"Run {run} was on {date.strftime('%Y-%m-%d')}")
+                continue
+            date = est.estimate_run_date(run)
+            if date:
+                lower, upper = est.bracket_run(run)
+                print(f"Run {run} not in allruns.csv, estimated on {date.strftime('%Y-%m-%d')} "
+                      f"(between runs {lower[0]} and {upper[0]})")
+            else:
+                print(f"Run {run} not found or date unknown")
     else:
-        print("Usage: python3 estimate_run_location.py <run_number>")
+        print("Usage: python3 estimate_run_location.py <run_number> [<run_number> ...]")
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Columnar GCD access for the checks, from the GCD cache in icetray/step1/gcd_cache.py.
+
+Cached GCDs only need NumPy; icetray is only needed the first time a GCD is
+seen, to extract it into the cache.
+"""
+
+import importlib.util
+from pathlib import Path
+
+GCD_CACHE_PATH = Path(__file__).resolve().parents[3] / "icetray" / "step1" / "gcd_cache.py"
+GCD_CACHE_SPEC = importlib.util.spec_from_file_location("step1_gcd_cache", GCD_CACHE_PATH)
+if GCD_CACHE_SPEC is None or GCD_CACHE_SPEC.loader is None:
+    raise ImportError(f"Could not load the GCD cache from {GCD_CACHE_PATH}")
+
+gcd_cache = importlib.util.module_from_spec(GCD_CACHE_SPEC)
+GCD_CACHE_SPEC.loader.exec_module(gcd_cache)
+
+DEFAULT_CACHE_DIR = gcd_cache.DEFAULT_CACHE_DIR
+GCDTables = gcd_cache.GCDTables
+ColumnTable = gcd_cache.ColumnTable
+get_gcd_tables = gcd_cache.get_gcd_tables
+get_sha512sum = gcd_cache.get_sha512sum
+pack_omkey = gcd_cache.pack_omkey
+unpack_omkey = gcd_cache.unpack_omkey
+omkey_str = gcd_cache.omkey_str
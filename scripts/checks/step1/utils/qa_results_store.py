@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Central SQLite store for the Step1 QA results, keyed by run.
+
+Holds what used to be spread over one JSON file per run:
+- charge_peak_llh: output of calculate_charge_peak_llh.py
+  ({year}/{run}/Run{run}.fadc_atwd_charge_comparison_results.json)
+- gcd_summary: output of compare_pass2_pass3_gcd.py
+  ({year}/{run}/Run{run:08d}.gcd_summary.json)
+- filter_counts: FilterRateMonitorI3Module sidecars, one row per file and filter
+  with passes, and filter_livetime, one row per file
+
+The producers write into the store directly when given one
+(calculate_charge_peak_llh.py --store, compare_pass2_pass3_gcd.py --store,
+FilterRateMonitorI3Module qa_store). The import command fills it from
+existing JSON files.
+
+Threshold checks become indexed queries, see the query methods below.
+
+Usage:
+    python3 qa_results_store.py <store.sqlite> import <json files or directories> [-j N]
+    python3 qa_results_store.py <store.sqlite> llh-below [--limit 100]
+    python3 qa_results_store.py <store.sqlite> gcd-changed [--limit 0]
+    python3 qa_results_store.py <store.sqlite> filter-rate-below <filter> <rate>
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+LLH_COLUMNS = [
+    "logL_corr",
+    "logL_uncorr",
+    "delta_logL",
+    "pearson_r",
+    "std_atwd",
+    "std_fadc",
+    "data_file",
+    "corrected_template_file",
+    "uncorrected_template_file",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS charge_peak_llh (
+    run INTEGER PRIMARY KEY,
+    year INTEGER,
+    logL_corr REAL,
+    logL_uncorr REAL,
+    delta_logL REAL,
+    pearson_r REAL,
+    std_atwd REAL,
+    std_fadc REAL,
+    data_file TEXT,
+    corrected_template_file TEXT,
+    uncorrected_template_file TEXT,
+    source TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS charge_peak_llh_delta ON charge_peak_llh (delta_logL);
+
+CREATE TABLE IF NOT EXISTS gcd_summary (
+    run INTEGER PRIMARY KEY,
+    year INTEGER,
+    n_changed INTEGER,
+    n_expected INTEGER,
+    n_nans INTEGER,
+    n_charge_dist_different INTEGER,
+    changed TEXT,
+    summary TEXT,
+    source TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS gcd_summary_changed ON gcd_summary (n_changed);
+
+CREATE TABLE IF NOT EXISTS filter_counts (
+    source TEXT,
+    filter TEXT,
+    run INTEGER,
+    year INTEGER,
+    count INTEGER,
+    updated REAL,
+    PRIMARY KEY (source, filter)
+);
+CREATE INDEX IF NOT EXISTS filter_counts_run ON filter_counts (filter, run);
+
+CREATE TABLE IF NOT EXISTS filter_livetime (
+    source TEXT PRIMARY KEY,
+    run INTEGER,
+    year INTEGER,
+    livetime REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS filter_livetime_run ON filter_livetime (run);
+"""
+
+RUN_PATTERN = re.compile(r"Run0*(\d+)")
+
+
+def _year_from_path(path: Path) -> Optional[int]:
+    """Year from a {year}/{run}/file or {year}/{MMDD}/file layout."""
+    try:
+        year = int(path.parts[-3])
+    except (IndexError, ValueError):
+        return None
+    return year if 2000 <= year <= 2100 else None
+
+
+def _run_from_path(path: Path) -> Optional[int]:
+    match = RUN_PATTERN.search(path.name)
+    if match:
+        return int(match.group(1))
+    try:
+        return int(path.parent.name)
+    except ValueError:
+        return None
+
+
+class QAResultsStore:
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Inserts
+
+    def insert_llh_results(self, rows: Iterable[dict]) -> int:
+        """Insert or replace charge peak LLH results.
+
+        Each row is a calc_llh result dict plus run, year and source."""
+        now = time.time()
+        values = [
+            (row["run"], row.get("year"), *(row.get(column) for column in LLH_COLUMNS), row.get("source"), now)
+            for row in rows
+        ]
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO charge_peak_llh (run, year, {', '.join(LLH_COLUMNS)}, source, updated) "
+                f"VALUES ({', '.join('?' * (len(LLH_COLUMNS) + 4))})",
+                values,
+            )
+        return len(values)
+
+    def insert_gcd_summaries(self, rows: Iterable[dict]) -> int:
+        """Insert or replace GCD diff summaries.
+
+        Each row has run, year, source and summary (the summary JSON dict)."""
+        now = time.time()
+        values = []
+        for row in rows:
+            cal = row["summary"]["cal"]
+            values.append((
+                row["run"],
+                row.get("year"),
+                len(cal["changed"]),
+                len(cal["expected"]),
+                len(cal["NaNs"]),
+                len(cal["charge_dist_different"]),
+                json.dumps(cal["changed"]),
+                json.dumps(row["summary"]),
+                row.get("source"),
+                now,
+            ))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO gcd_summary (run, year, n_changed, n_expected, n_nans, "
+                "n_charge_dist_different, changed, summary, source, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+        return len(values)
+
+    def insert_filter_counts(self, rows: Iterable[dict]) -> int:
+        """Insert or replace the filter counts and livetime of single files.
+
+        Each row has source, run, year, livetime and filter_counts ({filter: count}).
+        The livetime of every file is kept, also if no filter passed in it."""
+        rows = list(rows)
+        now = time.time()
+        values = [
+            (row["source"], name, row["run"], row.get("year"), count, now)
+            for row in rows
+            for name, count in row["filter_counts"].items()
+        ]
+        with self.conn:
+            self.conn.executemany("DELETE FROM filter_counts WHERE source = ?", [(row["source"],) for row in rows])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO filter_counts (source, filter, run, year, count, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                values,
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO filter_livetime (source, run, year, livetime, updated) VALUES (?, ?, ?, ?, ?)",
+                [(row["source"], row["run"], row.get("year"), row["livetime"], now) for row in rows],
+            )
+        return len(values)
+
+    # Queries
+
+    def llh_results(self, below: Optional[float] = None, above: Optional[float] = None) -> list[tuple]:
+        """(year, run, delta_logL) of all runs, of runs with delta_logL <= below
+        and/or of runs with delta_logL > above."""
+        conditions, params = [], []
+        if below is not None:
+            conditions.append("delta_logL <= ?")
+            params.append(below)
+        if above is not None:
+            conditions.append("delta_logL > ?")
+            params.append(above)
+        query = "SELECT year, run, delta_logL FROM charge_peak_llh"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return self.conn.execute(query + " ORDER BY run", params).fetchall()
+
+    def gcd_summaries(self, changed_above: Optional[int] = None,
+                      changed_at_most: Optional[int] = None) -> list[tuple]:
+        """(year, run, changed) of all runs, of runs with more than changed_above
+        and/or of runs with at most changed_at_most changed DOMs."""
+        conditions, params = [], []
+        if changed_above is not None:
+            conditions.append("n_changed > ?")
+            params.append(changed_above)
+        if changed_at_most is not None:
+            conditions.append("n_changed <= ?")
+            params.append(changed_at_most)
+        query = "SELECT year, run, changed FROM gcd_summary"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        cursor = self.conn.execute(query + " ORDER BY run", params)
+        return [(year, run, json.loads(changed)) for year, run, changed in cursor]
+
+    def filter_rates(self, filter_name: str, below: Optional[float] = None) -> list[tuple]:
+        """(year, run, rate in Hz) of a filter per run: its count summed over
+        the files of the run, divided by the livetime of all files of the run."""
+        query = ("SELECT l.year, l.run, COALESCE(c.count, 0) / l.livetime AS rate "
+                 "FROM (SELECT run, MAX(year) AS year, SUM(livetime) AS livetime FROM filter_livetime "
+                 "GROUP BY run) AS l "
+                 "LEFT JOIN (SELECT run, SUM(count) AS count FROM filter_counts WHERE filter = ? "
+                 "GROUP BY run) AS c ON c.run = l.run "
+                 "WHERE l.livetime > 0")
+        params: tuple = (filter_name,)
+        if below is not None:
+            query += " AND COALESCE(c.count, 0) / l.livetime <= ?"
+            params = (filter_name, below)
+        return self.conn.execute(query + " ORDER BY l.run", params).fetchall()
+
+
+def parse_result_file(path: Path) -> Optional[tuple[str, dict]]:
+    """Classify and parse one QA JSON file. Returns (kind, row) or None."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    run = _run_from_path(path)
+    if run is None:
+        return None
+    row = {"run": run, "year": _year_from_path(path), "source": str(path)}
+
+    if "delta_logL" in data:
+        row.update(data)
+        return "llh", row
+    if "cal" in data and "changed" in data["cal"] and "charge_dist_different" in data["cal"] \
+            and isinstance(data["cal"]["charge_dist_different"], list):
+        row["summary"] = data
+        return "gcd", row
+    if "filter_rates" in data and "files_cover" in data:
+        row["livetime"] = data["files_cover"]
+        if "filter_counts" in data:
+            row["filter_counts"] = data["filter_counts"]
+        else:
+            row["filter_counts"] = {name: round(rate * data["files_cover"])
+                                    for name, rate in data["filter_rates"].items()}
+        return "filter", row
+    return None
+
+
+def insert_parsed(store: QAResultsStore, parsed: Iterable[Optional[tuple[str, dict]]]) -> dict:
+    """Insert parse_result_file results, one transaction per kind."""
+    rows: dict[str, list] = {"llh": [], "gcd": [], "filter": []}
+    skipped = 0
+    for result in parsed:
+        if result is None:
+            skipped += 1
+            continue
+        kind, row = result
+        rows[kind].append(row)
+    return {
+        "llh": store.insert_llh_results(rows["llh"]),
+        "gcd": store.insert_gcd_summaries(rows["gcd"]),
+        "filter": store.insert_filter_counts(rows["filter"]),
+        "skipped": skipped,
+    }
+
+
+def insert_result_files(store: QAResultsStore, files: Iterable[Path]) -> dict:
+    """Parse and insert the QA JSON files a producer just wrote."""
+    return insert_parsed(store, (parse_result_file(Path(path)) for path in files))
+
+
+def find_result_files(locations: Iterable[Path]) -> list[Path]:
+    files = []
+    for location in locations:
+        if location.is_dir():
+            for pattern in ("*_comparison_results.json", "*.gcd_summary.json", "*.txt"):
+                files.extend(location.rglob(pattern))
+        elif location.is_file():
+            files.append(location)
+    return sorted(set(files))
+
+
+def import_results(store: QAResultsStore, locations: Iterable[Path], num_workers: int = 1) -> dict:
+    """Parse the JSON trees in parallel and insert everything in one transaction per kind."""
+    files = find_result_files(locations)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return insert_parsed(store, list(executor.map(parse_result_file, files, chunksize=64)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and query the Step1 QA results store")
+    parser.add_argument("store", type=Path, help="SQLite file of the QA results store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import existing QA JSON files")
+    import_parser.add_argument("locations", type=Path, nargs="+", help="JSON files or directories to search")
+    import_parser.add_argument("-j", "--num-workers", type=int, default=os.cpu_count() or 1)
+
+    llh_parser = subparsers.add_parser("llh-below", help="Runs with a charge peak delta LLH at or below a limit")
+    llh_parser.add_argument("--limit", type=float, default=100.)
+
+    gcd_parser = subparsers.add_parser("gcd-changed", help="Runs with unexpected GCD changes")
+    gcd_parser.add_argument("--limit", type=int, default=0)
+
+    rate_parser = subparsers.add_parser("filter-rate-below", help="Runs with a filter rate at or below a limit")
+    rate_parser.add_argument("filter", type=str)
+    rate_parser.add_argument("rate", type=float)
+
+    args = parser.parse_args()
+
+    with QAResultsStore(args.store) as store:
+        if args.command == "import":
+            counts = import_results(store, args.locations, args.num_workers)
+            print(f"Imported {counts['llh']} LLH results, {counts['gcd']} GCD summaries and "
+                  f"{counts['filter']} filter counts, skipped {counts['skipped']} files")
+        elif args.command == "llh-below":
+            for year, run, delta in store.llh_results(below=args.limit):
+                print(f"{year} {run} {delta}")
+        elif args.command == "gcd-changed":
+            for year, run, changed in store.gcd_summaries(changed_above=args.limit):
+                print(f"{year} {run} {len(changed)} changed DOMs")
+        elif args.command == "filter-rate-below":
+            for year, run, rate in store.filter_rates(args.filter, below=args.rate):
+                print(f"{year} {run} {rate}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,173 +1,134 @@
+"""Check the FADC gain correction applied to scaled (corrected) GCDs.
+
+For every in-ice DOM the observed correction, nominal fadc_gain / scaled
+fadc_gain, is compared to the true correction from the corrections JSON.
+The fadc_gain columns are read through the columnar GCD cache
+(gcd_cache.py), so many scaled GCDs can be checked in one invocation. The
+report of each GCD is appended to <outloc>/GCD_check_result<_label>.txt.
+"""
 import argparse
-import math
+import concurrent.futures
 import json
 
-from icecube.icetray import I3Frame
-from icecube.icetray import I3Tray
-from icecube.icetray import I3Units
-from icecube.dataio import I3File
-
-from os.path import expandvars
-from collections import Counter
-
-import numpy as np 
-
-parser = argparse.ArgumentParser(
-    usage='%prog [OPTIONS] FILE1 [FILE2, FILE3, ...]',
-    description='Concatenate tables, optionally converting between supported table formats.')
-
-parser.add_argument("-g",
-                    "--gcdfile", 
-                    type=str,
-                    help='gcd to check',
-                    default = '/data/ana/Calibration/SPE_Templates_v3/SPE_GCD//GCD_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_FADCGainCorrected/GeoCalibDetectorStatus_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_3G_FADCGainCorrected.i3.gz')
-parser.add_argument("-o",
-                    "--outloc",
-                    type=str,
-                    help='location for plots & output',
-                    default = '')
-parser.add_argument("-l",
-                    "--label",
-                    type=str,
-                    help='label to distinguish names for file outputs',
-                    default = '')
-args=parser.parse_args()
-
-gcd_scaled	= args.gcdfile
-outloc	    = args.outloc
-plot        = args.plot
-label       = args.label
-
-if label != '':
-    label = "_" + label
-
-
-gcd_nom = '/data/ana/Calibration/SPE_Templates_v3/SPE_GCD/GCD_v3_923_NWD_50ns_3G_0.116_0.1_Pass3/GeoCalibDetectorStatus_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_3G.i3.gz' #this is the old (non-scaled) GCD to  compare to-- shouldn't need updating, but you never know.
-
-corr_factors = []
-calc_corrs = []
-corr_dict = {}
-calibration_nom = {}
-
-if not outloc.endswith('/'):
-    outloc = outloc + '/'
-
-print('Outloc: '+outloc)
-
-with open(outloc+"GCD_check_result"+label+".txt", "a") as f:
-    f.write('*** Testing GCD file: {}\n'.format(gcd_scaled))
-    f.write('Using Nominal GCD: {}\n'.format(gcd_nom))
-
-file_path = '/data/ana/Calibration/MeasuringFADCGain/v3_923_NWD_50ns/AVG_FADC_bias_corrections.json' #true corrections as saved currently-- this may or may not need updating
-
-
-with open(file_path, 'r') as file:
-    # Load the JSON data from the file into a dictionary
-    FADC_corrections = json.load(file)
-
-def populate_cal_nom(frame):
-    cal_nom = frame['I3Calibration']
-    DOMs = list(cal_nom.dom_cal.keys())
-    for i in range(len(DOMs)):
-        key = DOMs[i]
-        string = key.string
-        om = key.om
-        dom_label = '{},{}'.format(string,om)
-        if string<87 and string >0 and om >0 and om <61:
-            nom_gain = cal_nom.dom_cal[key].fadc_gain
-            calibration_nom[dom_label] = {}
-            calibration_nom[dom_label]['fadc_gain'] = nom_gain
-
-def get_scaled_corrections(frame,plot=should_plot):
-    
-    calibration_scaled = frame['I3Calibration']
-    DOMs = list(calibration_scaled.dom_cal.keys())
-    
-    for i in range(len(DOMs)):
-        key = DOMs[i]
-        string = key.string
-        om = key.om
-        dom_label = '{},{}'.format(string,om)
-        if string<87 and string >0 and om >0 and om <61:
-
-            corr_dict[dom_label] = {}
-            corr_factor = FADC_corrections['FADC_gain_correction']['{},{}'.format(string,om)]
-            scaled_gain = calibration_scaled.dom_cal[key].fadc_gain
-            nom_gain = calibration_nom[dom_label]['fadc_gain']
-            calc_corr = nom_gain/scaled_gain
+import numpy as np
+
+from gcd_cache import DEFAULT_CACHE_DIR, get_gcd_tables, unpack_omkey
+
+NOMINAL_GCD = '/data/ana/Calibration/SPE_Templates_v3/SPE_GCD/GCD_v3_923_NWD_50ns_3G_0.116_0.1_Pass3/GeoCalibDetectorStatus_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_3G.i3.gz' #this is the old (non-scaled) GCD to  compare to-- shouldn't need updating, but you never know.
+CORRECTIONS = '/data/ana/Calibration/MeasuringFADCGain/v3_923_NWD_50ns/AVG_FADC_bias_corrections.json' #true corrections as saved currently-- this may or may not need updating
+
+
+def in_ice_fadc_gains(tables):
+    """(omkey, string, om, fadc_gain) of the in-ice DOMs of a cached GCD."""
+    cal = tables.cal
+    string, om, _ = unpack_omkey(cal.omkey)
+    in_ice = (string < 87) & (string > 0) & (om > 0) & (om < 61)
+    return cal.omkey[in_ice], string[in_ice], om[in_ice], cal["fadc_gain"][in_ice]
+
+
+def check_scaled_gcd(gcd_scaled, gcd_nom, tables_scaled, tables_nom, fadc_corrections) -> str:
+    """Report of one scaled GCD against the nominal GCD."""
+    omkey, string, om, scaled_gain = in_ice_fadc_gains(tables_scaled)
+    labels = ['{},{}'.format(s, o) for s, o in zip(string.tolist(), om.tolist())]
+
+    nom_rows = tables_nom.cal.lookup(omkey)
+    if (nom_rows < 0).any():
+        raise KeyError(labels[np.argmax(nom_rows < 0)])
+    nom_gain = tables_nom.cal["fadc_gain"][nom_rows]
+
+    corr_factor = np.array([fadc_corrections['FADC_gain_correction'][label] for label in labels], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        calc_corr = nom_gain / scaled_gain
+        pdiff = ((calc_corr - corr_factor) / corr_factor) * 100
+
+    is_nan = np.isnan(calc_corr)
+    matches = ~is_nan & (np.round(calc_corr, 3) == np.round(corr_factor, 3))
+    num_true = int(matches.sum())
+    num_NaN = int(is_nan.sum())
+    num_false = len(calc_corr) - num_true - num_NaN
+
+    lines = ['*** Testing GCD file: {}\n'.format(gcd_scaled),
+             'Using Nominal GCD: {}\n'.format(gcd_nom)]
+    for i, (s, o) in enumerate(zip(string.tolist(), om.tolist())):
+        if is_nan[i]:
+            lines.append('***************NAN************\n')
+            lines.append('scaled_gain: {}, nom_gain: {}\n'.format(scaled_gain[i].item(), nom_gain[i].item()))
+        lines.append('DOM: {},{}\n'.format(s, o))
+        lines.append('True Correction: {}, Observed Correction: {}\n'.format(corr_factor[i].item(), calc_corr[i].item()))
+        lines.append('diff: {}\n'.format((calc_corr[i] - corr_factor[i]).item()))
+        lines.append('-------------------\n')
+    lines.append('\n')
+    lines.append('Out of {} DOMs, {} correction factors match to ~0.1%, {} do not match, and {} correction factors were NaN\n'.format(len(calc_corr), num_true, num_false, num_NaN))
+    if num_NaN < len(pdiff):
+        lines.append('Largest difference: {:.4f}%\n'.format(np.nanmax(np.abs(pdiff)).item()))
+    return ''.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the FADC gain correction of scaled GCDs against a nominal GCD.')
+
+    parser.add_argument("-g",
+                        "--gcdfile",
+                        type=str,
+                        nargs='+',
+                        help='gcd(s) to check',
+                        default = ['/data/ana/Calibration/SPE_Templates_v3/SPE_GCD//GCD_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_FADCGainCorrected/GeoCalibDetectorStatus_v3_923_NWD_50ns_3G_0.116_0.1_Pass3_3G_FADCGainCorrected.i3.gz'])
+    parser.add_argument("-n",
+                        "--nominal-gcd",
+                        type=str,
+                        help='nominal (non-scaled) GCD to compare to',
+                        default = NOMINAL_GCD)
+    parser.add_argument("-c",
+                        "--corrections",
+                        type=str,
+                        help='JSON with the true FADC gain corrections',
+                        default = CORRECTIONS)
+    parser.add_argument("-o",
+                        "--outloc",
+                        type=str,
+                        help='location for plots & output',
+                        default = '')
+    parser.add_argument("-l",
+                        "--label",
+                        type=str,
+                        help='label to distinguish names for file outputs',
+                        default = '')
+    parser.add_argument("-j",
+                        "--num-workers",
+                        type=int,
+                        help='number of processes extracting GCDs that are not cached yet',
+                        default = 1)
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        help='columnar GCD cache directory (see gcd_cache.py)',
+                        default = str(DEFAULT_CACHE_DIR))
+    args=parser.parse_args()
+
+    outloc = args.outloc
+    label = args.label
+
+    if label != '':
+        label = "_" + label
+
+    if not outloc.endswith('/'):
+        outloc = outloc + '/'
+
+    print('Outloc: '+outloc)
+
+    with open(args.corrections, 'r') as file:
+        # Load the JSON data from the file into a dictionary
+        FADC_corrections = json.load(file)
+
+    tables_nom = get_gcd_tables(args.nominal_gcd, args.cache_dir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        all_tables = executor.map(get_gcd_tables, args.gcdfile, [args.cache_dir] * len(args.gcdfile))
+        for gcd_scaled, tables_scaled in zip(args.gcdfile, all_tables):
+            report = check_scaled_gcd(gcd_scaled, args.nominal_gcd, tables_scaled, tables_nom, FADC_corrections)
             with open(outloc+"GCD_check_result"+label+".txt", "a") as f:
-    
-                if np.isnan(calc_corr):
-                    f.write('***************NAN************\n')
-                    f.write('scaled_gain: {}, nom_gain: {}\n'.format(scaled_gain,nom_gain))
-                    
-                f.write('DOM: {},{}\n'.format(string,om))
-                f.write('True Correction: {}, Observed Correction: {}\n'.format(corr_factor,calc_corr))
-                f.write('diff: {}\n'.format(calc_corr-corr_factor))
-                f.write('-------------------\n')
-            
-            corr_factors.append(corr_factor)
-            calc_corrs.append(calc_corr)
-            corr_dict[dom_label]['corr_factor'] = corr_factor
-            corr_dict[dom_label]['calc_corr'] = calc_corr
-            
-    truth_arr = []
-    for i in range(len(corr_factors)):
-        calc = calc_corrs[i]
-        true = corr_factors[i]
-        if not np.isnan(calc):
-            calc = np.round(calc,3)
-            true = np.round(true,3)
-            if calc == true:
-                truth_arr.append(True)
-            elif calc != true:
-                truth_arr.append(False)
-        elif np.isnan(calc) or np.isnan(true):
-            truth_arr.append('NaN')
-            
-    element_counts = Counter(truth_arr)
-    if True in list(element_counts.keys()):
-        num_true = element_counts[True]
-    else:
-        num_true = 0
-
-    if False in list(element_counts.keys()):
-        num_false = element_counts[False]
-    else: 
-        num_false = 0
-
-    if 'NaN' in list(element_counts.keys()):
-        num_NaN = element_counts['NaN']
-    else:
-        num_NaN = 0
-        
-    calc_corrs_nonan = [x for x in calc_corrs if not math.isnan(x)]
-
-    calc_corrs_arr = np.asarray(calc_corrs)
-    corr_factors_arr = np.asarray(corr_factors)
-
-    pdiff = ((calc_corrs_arr-corr_factors_arr)/corr_factors_arr)*100
-    
-    with open(outloc+"GCD_check_result"+label+".txt", "a") as f:
-        f.write('\n')
-        f.write('Out of {} DOMs, {} correction factors match to ~0.1%, {} do not match, and {} correction factors were NaN\n'.format(len(truth_arr),num_true,num_false,num_NaN))
-
-
-infiles_scaled = [gcd_scaled]
-infiles_nom = [gcd_nom]
-tray = I3Tray()
-#tray.Add("I3Reader",FilenameList = infiles)
-tray.AddModule("I3Reader", "reader",
-    FilenameList=infiles_nom)
-tray.Add(populate_cal_nom,
-         Streams = [icetray.I3Frame.Calibration])
-tray.Execute()
-tray.Finish()
-
-tray = I3Tray()
-tray.AddModule("I3Reader", "reader2",
-    FilenameList=infiles_scaled)
-tray.Add(get_scaled_corrections,
-         Streams = [icetray.I3Frame.Calibration])
-tray.Execute()
-tray.Finish()
+                f.write(report)
+            print(gcd_scaled + ': ' + next(line for line in report.splitlines() if line.startswith('Out of')))
+
+
+if __name__ == "__main__":
+    main()
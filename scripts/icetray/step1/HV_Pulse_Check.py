@@ -1,163 +1,131 @@
-import h5py
-import numpy as np 
-import icecube
-from icecube.dataio import I3File #have to be running latest icetray, so use from my home dir
-from icecube import dataclasses
-from icecube import simclasses
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-import numpy as np
-import tables
-import argparse
-from icecube import LeptonInjector
-from icecube.icetray import I3Frame
-import math, glob, sys, os
-from os.path import expandvars
-# from icecube import MuonInjector
+"""Check that every in-ice DOM with HV on has at least one pulse in a run.
+
+The subrun files are read in a process pool. Each file gives a boolean
+(87, 61) mask of the DOMs with a non-zero charge pulse in InIceDSTPulses,
+and the masks are OR-reduced over the run. The HV-on mask comes from the
+detector status of the run's GCD, read through the columnar GCD cache
+(gcd_cache.py), by default under <outloc>. DOMs with HV on but no pulse are appended to
+HV_check_result_<year>_<date>_<run>.txt in <outloc>.
+"""
+import concurrent.futures
+import glob
+import os
 from optparse import OptionParser
+
 import numpy as np
-from icecube import tableio, hdfwriter
-from icecube.icetray import I3Tray
-from icecube.dataio import I3File #have to be running latest icetray, so use from my home dir
-from icecube import dataclasses
-from icecube import simclasses
-from icecube import icetray, dataio, dataclasses
-from icecube.common_variables import direct_hits
-from icecube.common_variables import hit_multiplicity
-from icecube.icetray import I3Units
-from icecube.common_variables import track_characteristics
-from icecube import phys_services
-import json
-
-from icecube import VHESelfVeto, DomTools
-
-#from icecube import weighting
-#from icecube.weighting.weighting import from_simprod
-#from icecube.weighting.fluxes import GaisserH3a
-from icecube import truncated_energy
-import subprocess
-from collections import Counter
-
-parser = OptionParser(usage='%prog [OPTIONS] FILE1 [FILE2, FILE3, ...]',
-    description='Concatenate tables, optionally converting between supported table formats.')
-
-
-parser.add_option("-i","--inloc", type="string",help='location of files (subruns) for run to check',
-		default = '/data/exp/IceCube/2018/filtered/level2/0129/Run00130607/')
-parser.add_option("-o","--outloc",type="string",help='location for output file',
-		default = '')
-
-options,args = parser.parse_args()
-runloc	= options.inloc
-outloc = options.outloc
-
-if not runloc.endswith('/'):
-    runloc = runloc + '/'
-
-print('Run location: {}'.format(runloc))
-
-print('Outloc: {}'.format(outloc))
-
-run = runloc.split('/')[-2]
-date = runloc.split('/')[-3]
-year = runloc.split('/')[-6]
-
-with open(outloc+"HV_check_result_"+year+"_"+date+"_"+run+".txt", "a") as f:
-    f.write('*** HV Check for Run: {}\n'.format(runloc))
-    f.write('\n')
-
-
-def check_HV(frame):
-    detector_test = frame['I3DetectorStatus']
-    DOMs = list(detector_test.dom_status.keys())
-    
-    for i in range(len(DOMs)):
-        key = DOMs[i]
-        string = key.string
-        om = key.om
-        dom_label = '{},{}'.format(string,om)
-        if string<87 and string >0 and om >0 and om <61:
-            if detector_test.dom_status[DOMs[i]].pmt_hv != 0:
-                HV_on.append(dom_label)
-                
-    return True
-
-def check_pulses(frame):
-    
-    if not "I3EventHeader" in frame:
-        print("Frame Failed: No I3EventHeader")
-        return False
-    event_id = float(str(frame["I3EventHeader"].run_id)+'.'+str(frame["I3EventHeader"].event_id))
-
-    try:
-        pulse_series 	= dataclasses.I3RecoPulseSeriesMap.from_frame(frame,'InIceDSTPulses')
-        #print(pulse_series)
-        #print('xxxxxxx')
-        
-        for om, pulses in pulse_series.items():
-            #print(om[0]) #string
-            #print(om[1]) #dom
-            #print(pulses)
-            
-            for pulse in pulses:
-                
-                string =om[0]
-                dom = om[1]
-                dom_name = '{},{}'.format(string,dom)
-                Qom = pulse.charge
-                
-                if Qom != 0:
-                    if dom_name not in has_pulse:
-                        has_pulse.append(dom_name)
-                    n_pulses.append(1)
-                
-                
-    except KeyError:
-        print('Frame missing InIceDST')
-                
-    return True
-
-run_gcd = glob.glob(runloc+'*GCD*')
-run_gcd = run_gcd[0]
-
-filelist = []
-for file in sorted(glob.glob(runloc+'*Subrun*')):
-    if 'IT' not in file:
-        filelist.append(file)
-
-uselist = filelist
-uselist.insert(0,run_gcd)
-
-HV_on = [] #list of DOMs that have HV on
-has_pulse = [] #list of DOMs that have a pulse in the run
-n_pulses = []
-
-tray = I3Tray()
-#tray.Add("I3Reader",FilenameList = infiles)
-tray.AddModule("I3Reader","reader",
-    FilenameList=uselist)
-tray.Add(check_HV,Streams = [icetray.I3Frame.DetectorStatus])
-tray.Add(check_pulses,Streams = [icetray.I3Frame.DAQ])
-tray.Execute()
-tray.Finish()
-
-dom_has_pulse = []
-for dom in has_pulse:
-    if dom not in dom_has_pulse:
-        dom_has_pulse.append(dom)
-
-truth_arr_HV = []
-for dom in HV_on:
-    
-    if dom in dom_has_pulse:
-        truth_arr_HV.append(True)
-    else:
-        truth_arr_HV.append(False)
-
-dom_list = Counter(truth_arr_HV)
-
-for i in range(len(truth_arr_HV)):
-        if truth_arr_HV[i] == False:
-            with open(outloc+"HV_check_result_"+year+"_"+date+"_"+run+".txt", "a") as f:
-                f.write('---------------\n')
-                f.write(HV_on[i]+'\n')
+
+from gcd_cache import get_gcd_tables, unpack_omkey
+
+MASK_SHAPE = (87, 61)  # [string, om], in-ice strings 1-86 and DOMs 1-60
+
+
+def hv_on_mask(run_gcd, cache_dir):
+    """In-ice DOMs with pmt_hv != 0 in the detector status."""
+    status = get_gcd_tables(run_gcd, cache_dir).status
+    string, om, _ = unpack_omkey(status.omkey)
+    in_ice = (string > 0) & (string < MASK_SHAPE[0]) & (om > 0) & (om < MASK_SHAPE[1])
+    mask = np.zeros(MASK_SHAPE, dtype=bool)
+    hv_on = in_ice & (status["pmt_hv"] != 0)
+    mask[string[hv_on], om[hv_on]] = True
+    return mask
+
+
+def scan_subrun(run_gcd, filename):
+    """Mask of DOMs with a non-zero charge pulse in one subrun file, plus counters."""
+    from icecube import dataclasses, icetray
+    from icecube.icetray import I3Tray
+
+    result = {
+        "mask": np.zeros(MASK_SHAPE, dtype=bool),
+        "frames": 0,
+        "no_header": 0,
+        "no_pulses": 0,
+    }
+
+    def check_pulses(frame):
+        if "I3EventHeader" not in frame:
+            result["no_header"] += 1
+            return False
+        result["frames"] += 1
+        try:
+            pulse_series = dataclasses.I3RecoPulseSeriesMap.from_frame(frame, 'InIceDSTPulses')
+        except KeyError:
+            result["no_pulses"] += 1
+            return True
+        seen = [(om.string, om.om) for om, pulses in pulse_series.items()
+                if any(pulse.charge != 0 for pulse in pulses)]
+        if seen:
+            strings, oms = np.asarray(seen).T
+            keep = (strings < MASK_SHAPE[0]) & (oms < MASK_SHAPE[1])
+            result["mask"][strings[keep], oms[keep]] = True
+        return True
+
+    tray = I3Tray()
+    # The GCD first, so the pulses can be unpacked with its calibration
+    tray.AddModule("I3Reader", "reader", FilenameList=[run_gcd, filename])
+    tray.Add(check_pulses, Streams=[icetray.I3Frame.DAQ])
+    tray.Execute()
+    tray.Finish()
+    return result
+
+
+def main():
+    parser = OptionParser(usage='%prog [OPTIONS]',
+                          description='Check that all in-ice DOMs with HV on have pulses in a run.')
+    parser.add_option("-i", "--inloc", type="string", help='location of files (subruns) for run to check',
+                      default='/data/exp/IceCube/2018/filtered/level2/0129/Run00130607/')
+    parser.add_option("-o", "--outloc", type="string", help='location for output file',
+                      default='')
+    parser.add_option("-j", "--num-workers", type="int", help='number of processes reading subruns',
+                      default=os.cpu_count() or 1)
+    parser.add_option("--cache-dir", type="string",
+                      help='columnar GCD cache directory (see gcd_cache.py), default <outloc>/gcd_cache',
+                      default=None)
+
+    options, args = parser.parse_args()
+    runloc = options.inloc
+    outloc = options.outloc
+
+    if not runloc.endswith('/'):
+        runloc = runloc + '/'
+
+    print('Run location: {}'.format(runloc))
+
+    print('Outloc: {}'.format(outloc))
+
+    run = runloc.split('/')[-2]
+    date = runloc.split('/')[-3]
+    year = runloc.split('/')[-6]
+    report = outloc + "HV_check_result_" + year + "_" + date + "_" + run + ".txt"
+
+    with open(report, "a") as f:
+        f.write('*** HV Check for Run: {}\n'.format(runloc))
+        f.write('\n')
+
+    run_gcd = glob.glob(runloc + '*GCD*')[0]
+    filelist = [file for file in sorted(glob.glob(runloc + '*Subrun*')) if 'IT' not in file]
+
+    cache_dir = options.cache_dir if options.cache_dir is not None else os.path.join(outloc or '.', 'gcd_cache')
+    hv_on = hv_on_mask(run_gcd, cache_dir)
+    has_pulse = np.zeros(MASK_SHAPE, dtype=bool)
+    frames = no_header = no_pulses = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.num_workers) as executor:
+        for result in executor.map(scan_subrun, [run_gcd] * len(filelist), filelist):
+            has_pulse |= result["mask"]
+            frames += result["frames"]
+            no_header += result["no_header"]
+            no_pulses += result["no_pulses"]
+
+    print(f"Read {frames} frames from {len(filelist)} subruns, {no_header} frames without I3EventHeader, "
+          f"{no_pulses} frames without InIceDSTPulses")
+
+    missing = np.argwhere(hv_on & ~has_pulse)
+    print(f"{int(hv_on.sum())} DOMs with HV on, {len(missing)} without pulses")
+    with open(report, "a") as f:
+        for string, om in missing:
+            f.write('---------------\n')
+            f.write('{},{}\n'.format(string, om))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
 import json
+import os
 import sys
+from collections import defaultdict
 from pathlib import Path
-from manifest_utils import extract_manifest_members_from_file, extract_manifest_uuid_from_file, is_manifest_file_path
+from typing import Optional
+from manifest_utils import Manifest, extract_manifest_members_from_file, is_manifest_file_path, is_manifest_member_name
 
 
 DEFAULT_GRL_PATH = Path(__file__).resolve().parents[3] / "data" / "grl.pass3"
@@ -63,10 +67,16 @@ def get_outfilename(infile: Path) -> Path:
         raise ValueError(f"Unexpected infile name format: {infile}")
     return Path("_".join(outfilewords) + ".i3.zst")
 
-def find_manifest_files(path: Path) -> list[Path]:
+def find_manifest_files(path: Path, recursive: bool = False) -> list[Path]:
     if path.is_file():
         return [path]
 
+    if recursive:
+        manifests = []
+        for root, _, filenames in os.walk(path):
+            manifests.extend(Path(root) / name for name in filenames if is_manifest_member_name(name))
+        return sorted(manifests)
+
     manifests = sorted(
         member for member in path.iterdir()
         if is_manifest_file_path(member)
@@ -74,7 +84,24 @@ def find_manifest_files(path: Path) -> list[Path]:
     return manifests
 
 
-def check_manifest(manifest_path: Path, output_dir: Path, grl: dict[int, bool]) -> dict[str, object]:
+def list_output_names(output_dir: Path) -> set[str]:
+    """Names in the output directory, from one listing instead of a stat per expected output."""
+    with os.scandir(output_dir) as entries:
+        return {entry.name for entry in entries}
+
+
+def check_manifest(
+    manifest_path: Path,
+    output_dir: Path,
+    grl: dict[int, bool],
+    members: Optional[list[str]] = None,
+    output_names: Optional[set[str]] = None,
+) -> dict[str, object]:
+    if members is None:
+        members = extract_manifest_members_from_file(manifest_path)
+    if output_names is None:
+        output_names = list_output_names(output_dir)
+
     missing: list[tuple[str, str]] = []
     invalid_inputs: list[str] = []
     invalid_run_numbers: list[str] = []
@@ -84,7 +111,7 @@ def check_manifest(manifest_path: Path, output_dir: Path, grl: dict[int, bool])
     output_count_in_grl = 0
     output_count = 0
 
-    for infile_name in extract_manifest_members_from_file(manifest_path):
+    for infile_name in members:
         try:
             run_number = get_run_number(Path(infile_name))
         except ValueError:
@@ -103,7 +130,7 @@ def check_manifest(manifest_path: Path, output_dir: Path, grl: dict[int, bool])
             invalid_inputs.append(infile_name)
             continue
 
-        output_exists = (output_dir / expected_output).exists()
+        output_exists = expected_output in output_names
         if output_exists:
             output_count_in_grl += 1
 
@@ -142,11 +169,17 @@ def report_has_issues(report: dict[str, object]) -> bool:
     )
 
 
-def build_manifest_report(manifest_path: Path, grl: dict[int, bool], grl_path: Path) -> dict[str, object]:
+def build_manifest_report(
+    manifest_path: Path,
+    grl: dict[int, bool],
+    grl_path: Path,
+    output_names: Optional[set[str]] = None,
+) -> dict[str, object]:
     output_dir = manifest_path.parent
-    manifest_members = extract_manifest_members_from_file(manifest_path)
-    manifest_uuid = extract_manifest_uuid_from_file(manifest_path)
-    results = check_manifest(manifest_path, output_dir, grl)
+    manifest = Manifest.from_file(manifest_path)
+    manifest_members = manifest.members
+    manifest_uuid = manifest.uuid
+    results = check_manifest(manifest_path, output_dir, grl, manifest_members, output_names)
     return {
         "manifest": str(manifest_path),
         "manifest_uuid": manifest_uuid,
@@ -157,6 +190,27 @@ def build_manifest_report(manifest_path: Path, grl: dict[int, bool], grl_path: P
     }
 
 
+def build_directory_reports(manifest_paths: list[Path], grl: dict[int, bool], grl_path: Path) -> list[dict[str, object]]:
+    """Reports of manifests sharing one output directory, which is listed once."""
+    output_names = list_output_names(manifest_paths[0].parent)
+    return [build_manifest_report(manifest_path, grl, grl_path, output_names) for manifest_path in manifest_paths]
+
+
+def build_reports(manifests: list[Path], grl: dict[int, bool], grl_path: Path, num_workers: int = 1) -> list[dict[str, object]]:
+    """Reports of all manifests, in their order, with the output directories processed in parallel."""
+    by_dir: dict[Path, list[Path]] = defaultdict(list)
+    for manifest_path in manifests:
+        by_dir[manifest_path.parent].append(manifest_path)
+
+    groups = list(by_dir.values())
+    report_by_manifest: dict[Path, dict[str, object]] = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for group, reports in zip(groups, executor.map(
+                build_directory_reports, groups, [grl] * len(groups), [grl_path] * len(groups))):
+            report_by_manifest.update(zip(group, reports))
+    return [report_by_manifest[manifest_path] for manifest_path in manifests]
+
+
 def write_issue_report(manifest_path: Path, report: dict[str, object]) -> Path:
     manifest_uuid = report.get("manifest_uuid")
     filename_stem = str(manifest_uuid) if manifest_uuid else manifest_path.stem
@@ -186,14 +240,26 @@ def main() -> int:
         default=DEFAULT_GRL_PATH,
         help="Path to GRL file. Supports either one-run-per-line text or JSON with runs[].good_i3",
     )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="Also check the manifests in all subdirectories of --path, e.g. a full year of output",
+    )
+    parser.add_argument(
+        "-j",
+        "--num-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes checking output directories (default: number of CPUs)",
+    )
     args = parser.parse_args()
 
-    manifests = find_manifest_files(args.path)
+    manifests = find_manifest_files(args.path, args.recursive)
     if not manifests:
         raise FileNotFoundError(f"No manifest files found in {args.path}")
 
     grl = load_grl(args.grl)
-    reports = [build_manifest_report(manifest_path, grl, args.grl) for manifest_path in manifests]
+    reports = build_reports(manifests, grl, args.grl, args.num_workers)
     issue_report_files: list[str] = []
     for manifest_path, report in zip(manifests, reports):
         if not report_has_issues(report):
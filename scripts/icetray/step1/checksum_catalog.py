@@ -0,0 +1,187 @@
+"""Indexed catalog of the bundle checksum file (checksums.sha512sum).
+
+Each line of the checksum file is "<sha512> <archive path>" with archive
+paths like
+
+    old ranch: /stornext/ranch_01/ranch/projects/TG-PHY150040/data/exp/IceCube/2020/unbiased/PFRaw/0420/<uuid>.zip
+    new ranch: /scoutfs/projects/TG-PHY150040/data/exp/IceCube/2020/unbiased/PFRaw/0420/<uuid>.zip
+
+The file is parsed once into NumPy columns (year, MMDD, uuid, sha512, path),
+which are cached as .npz (keyed by the file path, mtime and size) so later
+processes skip the parsing. Bundles are indexed by (year, MMDD, uuid), so a
+bundle is found whatever its path prefix, and by uuid alone for bundles given
+without the YYYY/.../MMDD layout. If the file lists a bundle more than once,
+the line under the current Ranch prefix (CURRENT_PREFIX) wins over the old
+/stornext one, and the last line wins among lines under the same prefix.
+
+Usage:
+    python3 checksum_catalog.py <checksums.sha512sum> <bundle> [<bundle> ...]
+    python3 checksum_catalog.py <checksums.sha512sum> --year 2020 --month 4
+"""
+import argparse
+import functools
+import hashlib
+import os
+import tempfile
+from collections import defaultdict
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("PASS3_CHECKSUM_CACHE", Path.home() / ".cache" / "pass3" / "checksums"))
+FORMAT_VERSION = 2
+CURRENT_PREFIX = "/scoutfs/"
+COLUMNS = ("year", "mmdd", "uuid", "sha512", "path")
+
+
+def bundle_key(bundle: Union[str, Path]) -> tuple[int, int, str]:
+    """(year, MMDD, uuid) of a bundle path, year and MMDD are 0 if the path has none."""
+    parts = PurePosixPath(str(bundle)).parts
+    uuid = PurePosixPath(parts[-1]).stem if parts else ""
+    mmdd = int(parts[-2]) if len(parts) >= 2 and len(parts[-2]) == 4 and parts[-2].isdigit() else 0
+    year = next((int(part) for part in reversed(parts[:-2]) if len(part) == 4 and part.isdigit()), 0)
+    return year, mmdd, uuid
+
+
+def parse_checksum_file(checksum_file: Path) -> dict[str, np.ndarray]:
+    """Columns of the checksum file, one row per bundle, sorted by path."""
+    rows: dict[tuple[int, int, str], tuple[str, str]] = {}
+    with open(checksum_file, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 2:
+                raise ValueError(f"{checksum_file}:{line_number}: expected '<sha512sum> <path>', got {line.rstrip()!r}")
+            checksum, archive_path = fields
+            key = bundle_key(archive_path)
+            if (key in rows and rows[key][1].startswith(CURRENT_PREFIX)
+                    and not archive_path.startswith(CURRENT_PREFIX)):
+                # Keep the current path over a stale one listed later
+                continue
+            rows[key] = (checksum, archive_path)
+
+    ordered = sorted(rows.items(), key=lambda item: item[1][1])
+    return {
+        "year": np.array([key[0] for key, _ in ordered], dtype=np.int32),
+        "mmdd": np.array([key[1] for key, _ in ordered], dtype=np.int32),
+        "uuid": np.array([key[2] for key, _ in ordered], dtype=str),
+        "sha512": np.array([value[0] for _, value in ordered], dtype=str),
+        "path": np.array([value[1] for _, value in ordered], dtype=str),
+    }
+
+
+def cache_path(checksum_file: Path, cache_dir: Path = DEFAULT_CACHE_DIR) -> Path:
+    key = hashlib.blake2b(str(checksum_file.resolve()).encode(), digest_size=8).hexdigest()
+    return Path(cache_dir) / f"{checksum_file.name}.{key}.npz"
+
+
+@functools.lru_cache(maxsize=None)
+def load_checksum_table(checksum_file: Path, cache_dir: Path = DEFAULT_CACHE_DIR) -> dict[str, np.ndarray]:
+    """
+    Columns of the checksum file, from the .npz cache when it matches the
+    file's mtime and size. Loaded once per process.
+    """
+    stat = checksum_file.stat()
+    stamp = np.array([FORMAT_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cached = cache_path(checksum_file, cache_dir)
+    try:
+        with np.load(cached) as data:
+            if np.array_equal(data["stamp"], stamp):
+                return {name: data[name] for name in COLUMNS}
+    except (OSError, KeyError, ValueError):
+        pass
+
+    table = parse_checksum_file(checksum_file)
+    try:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cached.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, stamp=stamp, **table)
+        os.replace(tmp, cached)
+    except OSError as e:
+        print(f"Warning: could not cache {checksum_file} in {cached}: {e}")
+    return table
+
+
+class ChecksumCatalog:
+    def __init__(self, table: dict[str, np.ndarray]):
+        self.table = table
+        self.paths = table["path"].tolist()
+        self.sha512s = table["sha512"].tolist()
+        self._by_key: dict[tuple[int, int, str], int] = {}
+        self._by_uuid: dict[str, list[int]] = defaultdict(list)
+        self._by_month: dict[tuple[int, int], list[int]] = defaultdict(list)
+        for i, (year, mmdd, uuid) in enumerate(zip(table["year"].tolist(), table["mmdd"].tolist(),
+                                                   table["uuid"].tolist())):
+            self._by_key[(year, mmdd, uuid)] = i
+            self._by_uuid[uuid].append(i)
+            self._by_month[(year, mmdd // 100)].append(i)
+
+    @classmethod
+    def from_file(cls, checksum_file: Union[str, Path], cache_dir: Path = DEFAULT_CACHE_DIR) -> "ChecksumCatalog":
+        return cls(load_checksum_table(Path(checksum_file), Path(cache_dir)))
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, bundle) -> bool:
+        return self.find(bundle) is not None
+
+    def find(self, bundle: Union[str, Path]) -> Optional[int]:
+        """Row of a bundle by (year, MMDD, uuid), or by uuid alone if the
+        path has no year and MMDD and the uuid is unique. None if unknown."""
+        year, mmdd, uuid = bundle_key(bundle)
+        if year and mmdd:
+            return self._by_key.get((year, mmdd, uuid))
+        rows = self._by_uuid.get(uuid, [])
+        return rows[0] if len(rows) == 1 else None
+
+    def checksum(self, bundle: Union[str, Path]) -> Optional[str]:
+        i = self.find(bundle)
+        return self.sha512s[i] if i is not None else None
+
+    def archive_path(self, bundle: Union[str, Path]) -> Optional[Path]:
+        i = self.find(bundle)
+        return Path(self.paths[i]) if i is not None else None
+
+    def _items(self, rows: Iterable[int]) -> dict[Path, str]:
+        return {Path(self.paths[i]): self.sha512s[i] for i in sorted(rows)}
+
+    def month(self, year: int, month: int) -> dict[Path, str]:
+        """{archive path: sha512} of all bundles of a month, sorted by path."""
+        return self._items(self._by_month.get((year, month), []))
+
+    def bundles(self, bundles: Iterable[Union[str, Path]]) -> dict[Path, str]:
+        """{archive path: sha512} of the given bundles, sorted by path. Unknown bundles are reported and left out."""
+        rows = set()
+        for bundle in bundles:
+            i = self.find(bundle)
+            if i is None:
+                print(f"Warning: bundle {bundle} is not in the checksum file")
+            else:
+                rows.add(i)
+        return self._items(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up bundle checksums in the checksum file")
+    parser.add_argument("checksum_file", type=Path, help="checksums.sha512sum")
+    parser.add_argument("bundles", type=Path, nargs="*", help="bundle paths or names")
+    parser.add_argument("--year", type=int)
+    parser.add_argument("--month", type=int)
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    catalog = ChecksumCatalog.from_file(args.checksum_file, args.cache_dir)
+    if args.year is not None and args.month is not None:
+        checksums = catalog.month(args.year, args.month)
+    else:
+        checksums = catalog.bundles(args.bundles)
+    for path, checksum in checksums.items():
+        print(f"{checksum} {path}")
+
+
+if __name__ == "__main__":
+    main()
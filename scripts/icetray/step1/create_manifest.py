@@ -1,14 +1,31 @@
 from __future__ import annotations
 
 import argparse
+import concurrent.futures
 import hashlib
 import json
+import os
+import sys
+import tempfile
+import threading
+import time
 import uuid
 import zipfile
 from datetime import datetime, timezone
 from pathlib import Path
 
 
+def _default_file_mode() -> int:
+    """Mode of a file created with open() under the current umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Read once at import, setting the umask is not safe while threads create files
+DEFAULT_FILE_MODE = _default_file_mode()
+
+
 def iter_tar_members(bundle_zip_path: Path) -> list[str]:
     with zipfile.ZipFile(bundle_zip_path) as zf:
         return sorted(
@@ -17,20 +34,69 @@ def iter_tar_members(bundle_zip_path: Path) -> list[str]:
         )
 
 
-def get_member_sha512sum(bundle_zip_path: Path, member_name: str) -> str:
+class ZipHandles:
+    """One open ZipFile per thread for a bundle, all closed together.
+
+    Threads never share a handle (and its file position), and the central
+    directory is parsed once per thread instead of once per member."""
+
+    def __init__(self, bundle_zip_path: Path):
+        self.bundle_zip_path = bundle_zip_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: list[zipfile.ZipFile] = []
+
+    def get(self) -> zipfile.ZipFile:
+        zf = getattr(self._local, "zf", None)
+        if zf is None:
+            zf = self._local.zf = zipfile.ZipFile(self.bundle_zip_path)
+            with self._lock:
+                self._opened.append(zf)
+        return zf
+
+    def close(self) -> None:
+        with self._lock:
+            for zf in self._opened:
+                zf.close()
+            self._opened.clear()
+
+    def __enter__(self) -> ZipHandles:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _sha512sum_from_zip(zf: zipfile.ZipFile, member_name: str) -> str:
     h = hashlib.sha512()
     buffer = bytearray(8192 * 1024)
     view = memoryview(buffer)
+    with zf.open(member_name) as member_fh:
+        while True:
+            chunk_size = member_fh.readinto(view)
+            if chunk_size == 0:
+                break
+            h.update(view[:chunk_size])
+
+    return h.hexdigest()
+
+
+def get_member_sha512sum(bundle_zip_path: Path, member_name: str, handles: ZipHandles | None = None) -> str:
     print(f"Bundle: {bundle_zip_path}, member: {member_name}")
+    if handles is not None:
+        return _sha512sum_from_zip(handles.get(), member_name)
     with zipfile.ZipFile(bundle_zip_path) as zf:
-        with zf.open(member_name) as member_fh:
-            while True:
-                chunk_size = member_fh.readinto(view)
-                if chunk_size == 0:
-                    break
-                h.update(view[:chunk_size])
+        return _sha512sum_from_zip(zf, member_name)
 
-    return h.hexdigest()
+
+def get_member_sha512sums(bundle_zip_path: Path, members: list[str], num_threads: int = 1) -> list[str]:
+    """sha512sums of the members, in member order, hashed by a thread pool.
+
+    hashlib releases the GIL while hashing, so threads scale with the reads."""
+    with ZipHandles(bundle_zip_path) as handles:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return list(executor.map(
+                lambda member_name: get_member_sha512sum(bundle_zip_path, member_name, handles), members))
 
 
 def build_manifest_header(file_count: int) -> dict[str, object]:
@@ -43,14 +109,14 @@ def build_manifest_header(file_count: int) -> dict[str, object]:
     }
 
 
-def build_manifest_records(bundle_zip_path: Path) -> list[dict[str, object]]:
+def build_manifest_records(bundle_zip_path: Path, num_threads: int = 1) -> list[dict[str, object]]:
     members = iter_tar_members(bundle_zip_path)
     if not members:
         raise FileNotFoundError(f"No .tar.gz files found in bundle {bundle_zip_path}")
 
     records: list[dict[str, object]] = [build_manifest_header(len(members))]
-    for member_name in members:
-        checksum = get_member_sha512sum(bundle_zip_path, member_name)
+    checksums = get_member_sha512sums(bundle_zip_path, members, num_threads)
+    for member_name, checksum in zip(members, checksums):
         records.append({
             "name": Path(member_name).name,
             "checksum": {"sha512": checksum},
@@ -59,11 +125,19 @@ def build_manifest_records(bundle_zip_path: Path) -> list[dict[str, object]]:
     return records
 
 
-def write_manifest(bundle_zip_path: Path, output_path: Path) -> Path:
-    records = build_manifest_records(bundle_zip_path)
-    output_path.write_text(
-        "\n".join(json.dumps(record, sort_keys=True) for record in records) + "\n"
-    )
+def write_manifest(bundle_zip_path: Path, output_path: Path, num_threads: int = 1) -> Path:
+    records = build_manifest_records(bundle_zip_path, num_threads)
+    # Write to a temporary file first, so --skip-existing never sees a truncated manifest
+    fd, tmp_name = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix=".tmp")
+    try:
+        # mkstemp makes the file 0600, publish it with the usual mode
+        os.fchmod(fd, DEFAULT_FILE_MODE)
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(json.dumps(record, sort_keys=True) for record in records) + "\n")
+        os.replace(tmp_name, output_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
     return output_path
 
 
@@ -71,6 +145,60 @@ def default_output_path(bundle_zip_path: Path) -> Path:
     return bundle_zip_path.with_name(f"{bundle_zip_path.stem}.metadata.ndjson")
 
 
+def find_archives(archive_dir: Path) -> list[Path]:
+    archives = []
+    for root, _, filenames in os.walk(archive_dir):
+        archives.extend(Path(root) / name for name in filenames if name.endswith(".zip"))
+    return sorted(archives)
+
+
+def write_manifests(
+    archives: list[Path],
+    num_threads: int = 1,
+    num_archives: int = 1,
+    skip_existing: bool = False,
+) -> tuple[list[Path], list[tuple[Path, str]]]:
+    """Write the default manifest of every archive, num_archives at a time with
+    num_threads hashing threads each, so at most num_archives * num_threads
+    members are read at once.
+
+    Returns (manifest paths, [(archive, error), ...])."""
+    todo = [archive for archive in archives
+            if not (skip_existing and default_output_path(archive).exists())]
+    if len(todo) < len(archives):
+        print(f"Skipping {len(archives) - len(todo)} archives with an existing manifest")
+
+    def write_one(archive: Path) -> tuple[Path, float, int]:
+        start = time.monotonic()
+        with zipfile.ZipFile(archive) as zf:
+            size = sum(info.file_size for info in zf.infolist() if info.filename.endswith(".tar.gz"))
+        manifest_path = write_manifest(archive, default_output_path(archive), num_threads)
+        return manifest_path, time.monotonic() - start, size
+
+    written: list[Path] = []
+    failed: list[tuple[Path, str]] = []
+    start = time.monotonic()
+    total_size = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_archives) as executor:
+        futures = {executor.submit(write_one, archive): archive for archive in todo}
+        for future in concurrent.futures.as_completed(futures):
+            archive = futures[future]
+            try:
+                manifest_path, elapsed, size = future.result()
+            except Exception as e:
+                print(f"ERROR: could not create a manifest for {archive}: {e}", file=sys.stderr)
+                failed.append((archive, str(e)))
+                continue
+            written.append(manifest_path)
+            total_size += size
+            print(f"Wrote {manifest_path} ({size / 1e6:.1f} MB hashed in {elapsed:.1f} s)")
+
+    elapsed = time.monotonic() - start
+    print(f"Wrote {len(written)} manifests, {len(failed)} failed, "
+          f"{total_size / 1e6:.1f} MB in {elapsed:.1f} s ({total_size / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+    return sorted(written), failed
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description=(
@@ -78,17 +206,50 @@ def main() -> None:
             "The manifest is written as NDJSON with a bundle header followed by file records."
         )
     )
-    parser.add_argument("--archive", type=Path, required=True, help="Path to the source zip archive")
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--archive", type=Path, nargs="+", help="Path(s) to the source zip archive(s)")
+    sources.add_argument(
+        "--archive-dir",
+        type=Path,
+        help="Create manifests for all zip archives below this directory, e.g. a day or month of bundles",
+    )
     parser.add_argument(
         "--output",
         type=Path,
         help="Path to the output NDJSON manifest. Defaults to <archive-stem>.metadata.ndjson beside the archive",
     )
+    parser.add_argument(
+        "-j",
+        "--num-threads",
+        type=int,
+        default=min(8, os.cpu_count() or 1),
+        help="Number of threads hashing the members of one archive",
+    )
+    parser.add_argument(
+        "--parallel-archives",
+        type=int,
+        default=2,
+        help="Number of archives processed at the same time with several archives",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="With several archives, skip archives whose manifest already exists",
+    )
     args = parser.parse_args()
 
-    output_path = args.output or default_output_path(args.archive)
-    manifest_path = write_manifest(args.archive, output_path)
-    print(manifest_path)
+    if args.archive is not None and len(args.archive) == 1:
+        output_path = args.output or default_output_path(args.archive[0])
+        manifest_path = write_manifest(args.archive[0], output_path, args.num_threads)
+        print(manifest_path)
+        return
+
+    if args.output is not None:
+        parser.error("--output needs exactly one --archive")
+    archives = args.archive if args.archive is not None else find_archives(args.archive_dir)
+    _, failed = write_manifests(archives, args.num_threads, args.parallel_archives, args.skip_existing)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
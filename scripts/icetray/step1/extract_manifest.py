@@ -1,8 +1,25 @@
 import argparse
+import concurrent.futures
+import os
 import shutil
+import sys
+import tempfile
+import time
 import zipfile
+import zlib
 from pathlib import Path
-from manifest_utils import find_manifest_members_in_zip
+from manifest_utils import is_manifest_member_name
+
+
+def _default_file_mode() -> int:
+    """Mode of a file created with open() under the current umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Read once at import, setting the umask is not safe while threads create files
+DEFAULT_FILE_MODE = _default_file_mode()
 
 
 def get_archive_key(archive_path: Path) -> str:
@@ -23,10 +40,8 @@ def get_archive_date_parts(archive_path: Path) -> tuple[str, str]:
     return year, mmdd
 
 
-def find_manifest_member(bundle_zip_path: Path) -> str:
+def _check_manifest_matches(bundle_zip_path: Path, matches: list[str]) -> str:
     archive_key = get_archive_key(bundle_zip_path)
-    matches = find_manifest_members_in_zip(bundle_zip_path, archive_key=archive_key)
-
     if not matches:
         raise FileNotFoundError(
             f"No manifest named {archive_key}.metadata.json or {archive_key}.metadata.ndjson found in {bundle_zip_path}"
@@ -37,39 +52,145 @@ def find_manifest_member(bundle_zip_path: Path) -> str:
     return matches[0]
 
 
-def extract_manifest(bundle_zip_path: Path, output_root: Path) -> Path:
-    year, mmdd = get_archive_date_parts(bundle_zip_path)
-    manifest_member = find_manifest_member(bundle_zip_path)
-    destination_dir = output_root / year / mmdd
-    destination_dir.mkdir(parents=True, exist_ok=True)
-    destination_path = destination_dir / Path(manifest_member).name
+def file_crc32(path: Path) -> int:
+    crc = 0
+    buffer = bytearray(8192 * 1024)
+    view = memoryview(buffer)
+    with path.open("rb") as fh:
+        while True:
+            chunk_size = fh.readinto(view)
+            if chunk_size == 0:
+                break
+            crc = zlib.crc32(view[:chunk_size], crc)
+    return crc
+
+
+def is_extracted(destination_path: Path, info: zipfile.ZipInfo) -> bool:
+    """True if destination_path has the size and CRC-32 of the zip member."""
+    try:
+        if destination_path.stat().st_size != info.file_size:
+            return False
+    except FileNotFoundError:
+        return False
+    return file_crc32(destination_path) == info.CRC
 
 
-    print(f"Extracing {destination_path}. From bundle {bundle_zip_path}")
-    if not destination_path.exists():
-        with zipfile.ZipFile(bundle_zip_path) as zf:
-            with zf.open(manifest_member) as src_fh, destination_path.open("wb") as dst_fh:
+def extract_manifest_status(bundle_zip_path: Path, output_root: Path) -> tuple[Path, bool, int]:
+    """Extract the manifest of one bundle, opening the zip once.
+
+    Returns (destination path, whether it was written, bytes written). An existing
+    manifest with the size and CRC-32 of the zip member is kept."""
+    year, mmdd = get_archive_date_parts(bundle_zip_path)
+    archive_key = get_archive_key(bundle_zip_path)
+    with zipfile.ZipFile(bundle_zip_path) as zf:
+        matches = sorted(
+            member for member in zf.namelist()
+            if is_manifest_member_name(member, archive_key=archive_key)
+        )
+        manifest_member = _check_manifest_matches(bundle_zip_path, matches)
+        info = zf.getinfo(manifest_member)
+
+        destination_dir = output_root / year / mmdd
+        destination_dir.mkdir(parents=True, exist_ok=True)
+        destination_path = destination_dir / Path(manifest_member).name
+
+        if is_extracted(destination_path, info):
+            print(f"Output file {destination_path} already exists. Skipping")
+            return destination_path, False, 0
+
+        print(f"Extracing {destination_path}. From bundle {bundle_zip_path}")
+        fd, tmp_name = tempfile.mkstemp(dir=destination_dir, prefix=f".{destination_path.name}.", suffix=".tmp")
+        try:
+            # mkstemp makes the file 0600, publish it with the usual mode
+            os.fchmod(fd, DEFAULT_FILE_MODE)
+            with zf.open(manifest_member) as src_fh, os.fdopen(fd, "wb") as dst_fh:
                 shutil.copyfileobj(src_fh, dst_fh)
-    else:
-        print(f"Output file {destination_path} already exists. Skipping")
+            os.replace(tmp_name, destination_path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
 
+    return destination_path, True, info.file_size
+
+
+def extract_manifest(bundle_zip_path: Path, output_root: Path) -> Path:
+    destination_path, _, _ = extract_manifest_status(bundle_zip_path, output_root)
     return destination_path
 
 
+def find_archives(archive_dir: Path) -> list[Path]:
+    archives = []
+    for root, _, filenames in os.walk(archive_dir):
+        archives.extend(Path(root) / name for name in filenames if name.lower().endswith(".zip"))
+    return sorted(archives)
+
+
+def read_archive_list(archive_list: Path) -> list[Path]:
+    return [
+        Path(line.strip()) for line in archive_list.read_text().splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def extract_manifests(archives: list[Path], output_root: Path, num_threads: int = 8) -> dict[str, object]:
+    """Extract the manifests of many bundles with a bounded thread pool."""
+    counts: dict[str, object] = {"extracted": 0, "skipped": 0, "failed": [], "bytes": 0}
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = {executor.submit(extract_manifest_status, archive, output_root): archive for archive in archives}
+        for future in concurrent.futures.as_completed(futures):
+            archive = futures[future]
+            try:
+                _, written, size = future.result()
+            except Exception as e:
+                print(f"ERROR: could not extract the manifest of {archive}: {e}", file=sys.stderr)
+                counts["failed"].append(str(archive))
+                continue
+            if written:
+                counts["extracted"] += 1
+                counts["bytes"] += size
+            else:
+                counts["skipped"] += 1
+
+    elapsed = time.monotonic() - start
+    rate = len(archives) / elapsed if elapsed > 0 else 0.
+    print(f"{len(archives)} archives in {elapsed:.1f} s ({rate:.1f} archives/s): "
+          f"{counts['extracted']} manifests extracted ({counts['bytes'] / 1e6:.1f} MB), "
+          f"{counts['skipped']} already present, {len(counts['failed'])} failed")
+    return counts
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description=(
             "Extract <archive-stem>.metadata.json or <archive-stem>.metadata.ndjson "
-            "from a zip archive into <output-root>/YYYY/MMDD/."
+            "from zip archives into <output-root>/YYYY/MMDD/."
         )
     )
-    parser.add_argument("--archive", type=Path, help="Path to the source zip archive")
-    parser.add_argument("--output_root", type=Path, help="Root directory where YYYY/MMDD/manifest will be written")
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument("--archive", type=Path, nargs="+", help="Path(s) to the source zip archive(s)")
+    sources.add_argument("--archive-dir", type=Path, help="Extract the manifests of all zip archives below this directory")
+    sources.add_argument("--archive-list", type=Path, help="Text file with one zip archive path per line")
+    parser.add_argument("--output_root", type=Path, required=True, help="Root directory where YYYY/MMDD/manifest will be written")
+    parser.add_argument("-j", "--num-threads", type=int, default=8, help="Number of archives read at the same time")
     args = parser.parse_args()
 
-    destination_path = extract_manifest(args.archive, args.output_root)
-    print(destination_path)
+    if args.archive is not None and len(args.archive) == 1:
+        destination_path = extract_manifest(args.archive[0], args.output_root)
+        print(destination_path)
+        return
+
+    if args.archive is not None:
+        archives = args.archive
+    elif args.archive_dir is not None:
+        archives = find_archives(args.archive_dir)
+    else:
+        archives = read_archive_list(args.archive_list)
+
+    counts = extract_manifests(archives, args.output_root, args.num_threads)
+    if counts["failed"]:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,417 @@
+"""Columnar cache of GCD files.
+
+A GCD is read with icetray once and turned into per-DOM NumPy columns:
+
+- cal/<attribute>: I3DOMCal attributes, from I3Calibration.dom_cal
+- status/<attribute>: I3DOMStatus attributes, from I3DetectorStatus.dom_status
+- geo/<attribute>: I3OMGeo attributes, from I3Geometry.omgeo
+- map/<frame key>: other OMKey -> double maps in the frames (e.g. Original_FADC_Gain)
+- list/<frame key>: OMKey lists in the frames (e.g. BadDomsList)
+
+Every table has its own sorted <table>/omkey column with packed OMKeys (see
+pack_omkey). Attributes are flattened generically:
+
+- bool, int, float, str values become columns of that type
+- enums become int columns, the names are kept in the kinds
+- other objects become a uint64 digest column for equality checks, and
+  their simple sub-attributes become <attribute>.<sub> columns (e.g.
+  cal/combined_spe_charge_distribution.pdfs)
+- objects without a stable digest become "opaque" columns of zeros, which
+  never differ, so only their <attribute>.<sub> columns can be compared
+
+The columns only cover the per-DOM maps. Each whole I3Calibration,
+I3DetectorStatus and I3Geometry object, including e.g. the trigger status
+and the start and end times, is digested into object/cal, /status and /geo,
+which is what equality checks of a frame have to use.
+
+Each frame also gets a content fingerprint (fingerprint/cal, /status, /geo
+for the C, D and G frame), a digest of all the columns extracted from that
+frame and of its whole object with the start and end times left out
+(content/<table>). The validity times are the run's own, so runs that share
+a calibration share its fingerprint, even though their GCD files differ.
+
+Cache files are content-addressed by the sha512 of the GCD file, so the
+same GCD is only extracted once no matter where it is stored. Reading a
+cached GCD only needs NumPy.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+FORMAT_VERSION = 3
+DEFAULT_CACHE_DIR = Path(os.environ.get("PASS3_GCD_CACHE", Path.home() / ".cache" / "pass3" / "gcd"))
+TABLES = ("cal", "status", "geo")
+
+
+def get_sha512sum(filename: Union[str, Path]) -> str:
+    """Compute the SHA512 hash of the data in the specified file."""
+    h = hashlib.sha512()
+    b = bytearray(8192 * 1024)
+    mv = memoryview(b)
+    with open(str(filename), 'rb', buffering=0) as f:
+        for n in iter(lambda: f.readinto(mv), 0):
+            h.update(mv[:n])
+    return h.hexdigest()
+
+
+def pack_omkey(string, om, pmt=0):
+    """Pack OMKeys into sortable int64, works on scalars and arrays."""
+    return ((np.asarray(string, dtype=np.int64) << 32)
+            | (np.asarray(om, dtype=np.int64) << 16)
+            | np.asarray(pmt, dtype=np.int64))
+
+
+def unpack_omkey(packed):
+    """(string, om, pmt) arrays from packed OMKeys."""
+    packed = np.asarray(packed, dtype=np.int64)
+    return packed >> 32, (packed >> 16) & 0xFFFF, packed & 0xFFFF
+
+
+def omkey_str(packed) -> str:
+    """Same text as str(icecube.icetray.OMKey)."""
+    string, om, pmt = (int(v) for v in unpack_omkey(packed))
+    return f"OMKey({string},{om},{pmt})"
+
+
+# Extraction, needs icetray
+
+def _digest(value) -> Optional[int]:
+    """Stable 64 bit digest of an icetray object, None if there is none."""
+    try:
+        data = pickle.dumps(value, protocol=4)
+    except Exception:
+        try:
+            data = repr(tuple(value)).encode()
+        except TypeError:
+            text = str(value)
+            if " at 0x" in text:
+                # Default repr with an address, not stable between reads
+                return None
+            data = text.encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _object_digest(obj) -> str:
+    """Hex digest of a whole frame object, from its serialization."""
+    try:
+        data = pickle.dumps(obj, protocol=4)
+    except Exception as e:
+        raise TypeError(f"Cannot serialize {type(obj).__name__} for its digest: {e}") from e
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _content_digest(obj) -> str:
+    """Hex digest of a whole frame object without its start and end times."""
+    start_time, end_time = obj.start_time, obj.end_time
+    no_time = type(start_time)()
+    obj.start_time, obj.end_time = no_time, no_time
+    try:
+        return _object_digest(obj)
+    finally:
+        obj.start_time, obj.end_time = start_time, end_time
+
+
+def _is_enum(value) -> bool:
+    return isinstance(value, int) and hasattr(value, "name") and hasattr(value, "values")
+
+
+def _public_attributes(obj) -> list:
+    names = []
+    for name in dir(obj):
+        if name.startswith('_'):
+            continue
+        try:
+            value = getattr(obj, name)
+        except Exception:
+            continue
+        if callable(value) and not _is_enum(value):
+            continue
+        names.append(name)
+    return names
+
+
+def _classify(value) -> tuple:
+    """(kind, column value) of one attribute value."""
+    if isinstance(value, (bool, np.bool_)):
+        return "bool", bool(value)
+    if _is_enum(value):
+        return "enum", int(value)
+    if isinstance(value, (int, np.integer)):
+        return "int", int(value)
+    if isinstance(value, (float, np.floating)):
+        return "float", float(value)
+    if isinstance(value, str):
+        return "str", value
+    return "object", _digest(value)
+
+
+def _flatten_items(items) -> tuple:
+    """Columns and kinds of a sequence of (OMKey, object) pairs."""
+    items = sorted(items, key=lambda item: (item[0].string, item[0].om, item[0].pmt))
+    omkeys = pack_omkey([k.string for k, _ in items], [k.om for k, _ in items], [k.pmt for k, _ in items])
+    values: dict = {}
+    kinds: dict = {}
+    for row, (_, obj) in enumerate(items):
+        for name in _public_attributes(obj):
+            try:
+                value = getattr(obj, name)
+            except Exception:
+                continue
+            kind, column_value = _classify(value)
+            entries = [(name, kind, column_value, value)]
+            if kind == "object":
+                for sub in _public_attributes(value):
+                    try:
+                        sub_value = getattr(value, sub)
+                    except Exception:
+                        continue
+                    sub_kind, sub_column_value = _classify(sub_value)
+                    entries.append((f"{name}.{sub}", sub_kind, sub_column_value, sub_value))
+            for column, kind, column_value, raw in entries:
+                if column not in kinds:
+                    kinds[column] = {"kind": kind}
+                    values[column] = [None] * len(items)
+                if kind == "enum":
+                    kinds[column].setdefault("names", {})[str(int(raw))] = str(raw.name)
+                if kinds[column]["kind"] == "object" and column_value is None:
+                    kinds[column]["kind"] = "opaque"
+                values[column][row] = column_value
+
+    columns = {}
+    for column, column_values in values.items():
+        kind = kinds[column]["kind"]
+        if kind in ("float", "int"):
+            # Mixed int/float or missing values, keep everything as float
+            if kind == "int" and all(v is not None for v in column_values):
+                columns[column] = np.array(column_values, dtype=np.int64)
+            else:
+                kinds[column]["kind"] = "float"
+                columns[column] = np.array([np.nan if v is None else v for v in column_values], dtype=np.float64)
+        elif kind == "bool":
+            columns[column] = np.array([bool(v) for v in column_values], dtype=bool)
+        elif kind == "enum":
+            columns[column] = np.array([-1 if v is None else v for v in column_values], dtype=np.int64)
+        elif kind == "str":
+            columns[column] = np.array(["" if v is None else v for v in column_values], dtype=str)
+        elif kind == "object":
+            columns[column] = np.array([0 if v is None else v for v in column_values], dtype=np.uint64)
+        else:
+            columns[column] = np.zeros(len(column_values), dtype=np.uint64)
+    return omkeys, columns, kinds
+
+
+def fingerprint_arrays(arrays: dict, names) -> str:
+    """Hex digest of the named arrays, independent of the order of the names."""
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(names):
+        values = np.ascontiguousarray(arrays[name])
+        h.update(f"{name}:{values.dtype.str}:{values.shape}".encode())
+        h.update(values.tobytes())
+    return h.hexdigest()
+
+
+def extract_gcd(gcd_path: Union[str, Path]) -> dict:
+    """Read a GCD with icetray and return the arrays of the cache file."""
+    from icecube import dataclasses, dataio, icetray  # noqa: F401
+
+    arrays: dict = {}
+    kinds: dict = {}
+    frame_arrays: dict = {table: set() for table in TABLES}
+    frame_objects = {
+        icetray.I3Frame.Geometry: ("I3Geometry", "geo", "omgeo"),
+        icetray.I3Frame.Calibration: ("I3Calibration", "cal", "dom_cal"),
+        icetray.I3Frame.DetectorStatus: ("I3DetectorStatus", "status", "dom_status"),
+    }
+    gcd_keys = {key for key, _, _ in frame_objects.values()}
+
+    with dataio.I3File(str(gcd_path), "r") as f:
+        while f.more():
+            frame = f.pop_frame()
+            if frame.Stop not in frame_objects:
+                continue
+            key, table, member = frame_objects[frame.Stop]
+            if key in frame and f"{table}/omkey" not in arrays:
+                omkeys, columns, table_kinds = _flatten_items(getattr(frame[key], member).items())
+                arrays[f"{table}/omkey"] = omkeys
+                for column, values in columns.items():
+                    arrays[f"{table}/{column}"] = values
+                kinds[table] = table_kinds
+                arrays[f"object/{table}"] = np.array(_object_digest(frame[key]))
+                arrays[f"content/{table}"] = np.array(_content_digest(frame[key]))
+                frame_arrays[table].update(name for name in arrays if name.startswith(f"{table}/"))
+                frame_arrays[table].add(f"content/{table}")
+            # Only look at keys of this frame's own stop, the rest is inherited
+            for frame_key in frame.keys():
+                if frame_key in gcd_keys or frame.get_stop(frame_key) != frame.Stop:
+                    continue
+                obj = frame[frame_key]
+                if isinstance(obj, dataclasses.I3MapKeyDouble):
+                    items = sorted(obj.items(), key=lambda item: (item[0].string, item[0].om, item[0].pmt))
+                    arrays[f"map/{frame_key}/omkey"] = pack_omkey([k.string for k, _ in items],
+                                                                  [k.om for k, _ in items],
+                                                                  [k.pmt for k, _ in items])
+                    arrays[f"map/{frame_key}/value"] = np.array([v for _, v in items], dtype=np.float64)
+                    frame_arrays[table].update([f"map/{frame_key}/omkey", f"map/{frame_key}/value"])
+                elif isinstance(obj, dataclasses.I3VectorOMKey):
+                    arrays[f"list/{frame_key}"] = np.sort(pack_omkey([k.string for k in obj],
+                                                                     [k.om for k in obj],
+                                                                     [k.pmt for k in obj]))
+                    frame_arrays[table].add(f"list/{frame_key}")
+
+    missing = [table for table in TABLES if f"{table}/omkey" not in arrays]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)} information in {gcd_path}")
+
+    for table in TABLES:
+        arrays[f"fingerprint/{table}"] = np.array(fingerprint_arrays(arrays, frame_arrays[table]))
+    arrays["kinds"] = np.array(json.dumps(kinds, sort_keys=True))
+    return arrays
+
+
+# Cache
+
+def cache_path(sha512: str, cache_dir: Union[str, Path, None] = None) -> Path:
+    cache_dir = Path(cache_dir) if cache_dir is not None else DEFAULT_CACHE_DIR
+    return cache_dir / sha512[:2] / f"{sha512}.gcd.npz"
+
+
+def write_cache_file(path: Path, arrays: dict, sha512: str, source: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp.npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f,
+                     format_version=FORMAT_VERSION,
+                     sha512=np.array(sha512),
+                     source=np.array(source),
+                     **arrays)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class ColumnTable:
+    """Per-DOM columns of one GCD table, rows sorted by packed OMKey."""
+
+    def __init__(self, omkey: np.ndarray, columns: dict, kinds: dict):
+        self.omkey = omkey
+        self.columns = columns
+        self.kinds = kinds
+
+    def __len__(self):
+        return len(self.omkey)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name) -> np.ndarray:
+        return self.columns[name]
+
+    @property
+    def string(self):
+        return unpack_omkey(self.omkey)[0]
+
+    @property
+    def om(self):
+        return unpack_omkey(self.omkey)[1]
+
+    def kind(self, name) -> str:
+        return self.kinds.get(name, {}).get("kind", "float")
+
+    def enum_value(self, name, enum_name) -> int:
+        """Integer value of an enum by name, e.g. enum_value("omtype", "IceCube")."""
+        for value, value_name in self.kinds[name].get("names", {}).items():
+            if value_name == enum_name:
+                return int(value)
+        raise KeyError(f"{enum_name} is not a known value of {name}")
+
+    def lookup(self, omkeys) -> np.ndarray:
+        """Row of each packed OMKey, -1 where the table has no such DOM."""
+        omkeys = np.asarray(omkeys, dtype=np.int64)
+        if len(self.omkey) == 0:
+            return np.full(omkeys.shape, -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.omkey, omkeys), len(self.omkey) - 1)
+        return np.where(self.omkey[idx] == omkeys, idx, -1)
+
+    def contains(self, omkeys) -> np.ndarray:
+        return self.lookup(omkeys) >= 0
+
+
+class GCDTables:
+    """A cached, columnar GCD."""
+
+    def __init__(self, arrays: dict):
+        self.format_version = int(arrays["format_version"])
+        self.sha512 = str(arrays["sha512"])
+        self.source = str(arrays["source"])
+        kinds = json.loads(str(arrays["kinds"]))
+        for table in TABLES:
+            prefix = f"{table}/"
+            columns = {name[len(prefix):]: values for name, values in arrays.items()
+                       if name.startswith(prefix) and name != f"{table}/omkey"}
+            setattr(self, table, ColumnTable(arrays[f"{table}/omkey"], columns, kinds.get(table, {})))
+        self.maps = {}
+        self.lists = {}
+        for name, values in arrays.items():
+            if name.startswith("map/") and name.endswith("/omkey"):
+                key = name[len("map/"):-len("/omkey")]
+                self.maps[key] = ColumnTable(values, {"value": arrays[f"map/{key}/value"]},
+                                             {"value": {"kind": "float"}})
+            elif name.startswith("list/"):
+                self.lists[name[len("list/"):]] = values
+        self.fingerprints = {table: str(arrays[f"fingerprint/{table}"]) for table in TABLES}
+        self.object_digests = {table: str(arrays[f"object/{table}"]) for table in TABLES}
+
+    def in_ice(self, omkeys) -> np.ndarray:
+        """DOMs in the geometry with omtype IceCube."""
+        rows = self.geo.lookup(omkeys)
+        in_ice = self.geo["omtype"][np.maximum(rows, 0)] == self.geo.enum_value("omtype", "IceCube")
+        return (rows >= 0) & in_ice
+
+
+def cache_file_version(path: Union[str, Path]) -> int:
+    with np.load(path) as data:
+        return int(data["format_version"])
+
+
+def load_cache_file(path: Union[str, Path]) -> GCDTables:
+    with np.load(path) as data:
+        if int(data["format_version"]) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported GCD cache version {int(data['format_version'])} in {path}")
+        return GCDTables({name: data[name] for name in data.files})
+
+
+def get_gcd_tables(gcd_path: Union[str, Path],
+                   cache_dir: Union[str, Path, None] = None,
+                   sha512: Optional[str] = None) -> GCDTables:
+    """Columnar GCD, extracted with icetray only if it is not cached yet.
+
+    Pass sha512 if it is already known (e.g. from a manifest) to skip hashing.
+    Cache files of an older format are extracted again."""
+    if sha512 is None:
+        sha512 = get_sha512sum(gcd_path)
+    path = cache_path(sha512, cache_dir)
+    if not path.exists() or cache_file_version(path) < FORMAT_VERSION:
+        write_cache_file(path, extract_gcd(gcd_path), sha512, str(gcd_path))
+    return load_cache_file(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract GCD files into the columnar GCD cache")
+    parser.add_argument("gcds", type=Path, nargs="+", help="GCD files to extract")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR,
+                        help="Cache directory, default $PASS3_GCD_CACHE or ~/.cache/pass3/gcd")
+    args = parser.parse_args()
+
+    for gcd in args.gcds:
+        tables = get_gcd_tables(gcd, args.cache_dir)
+        print(f"{gcd}: {tables.sha512[:16]} cal {len(tables.cal)} status {len(tables.status)} geo {len(tables.geo)} DOMs")
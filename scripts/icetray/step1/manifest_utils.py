@@ -3,6 +3,13 @@ import zipfile
 from pathlib import Path
 from typing import Optional
 
+try:
+    # Several times faster on the large NDJSON manifests of year-scale scans
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 
 def is_manifest_member_name(
         member_name: str,
@@ -105,149 +112,144 @@ def manifest_record_uuid(
     return None
 
 
+class Manifest:
+    """Members, checksums, uuid and header records of a manifest, from one parse.
+
+    Accepts JSON ({"files": [...]} or a list of records) and NDJSON manifests.
+    members and sha512s are parallel lists in manifest order (members are
+    basenames), index maps a member to its position (the last one for repeated
+    members) and headers holds the records without a member."""
+
+    def __init__(
+            self,
+            members: list[str],
+            sha512s: list[Optional[str]],
+            uuid: Optional[str],
+            headers: list[object]
+        ):
+        self.members = members
+        self.sha512s = sha512s
+        self.uuid = uuid
+        self.headers = headers
+        self.index = {member: i for i, member in enumerate(members)}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, member: str) -> bool:
+        return member in self.index
+
+    def sha512(self, member: str) -> Optional[str]:
+        i = self.index.get(member)
+        return None if i is None else self.sha512s[i]
+
+    def checksums(self) -> dict[str, Optional[str]]:
+        """{member: sha512} of the members with a checksum."""
+        return {member: sha512 for member, sha512 in zip(self.members, self.sha512s) if sha512}
+
+    @staticmethod
+    def _records(text: str) -> tuple[list[object], Optional[dict]]:
+        """(records, JSON document holding them or None for NDJSON)."""
+        stripped = text.strip()
+        if not stripped:
+            return [], None
+
+        if stripped[0] in "[{":
+            try:
+                payload = _json_loads(stripped)
+            except json.JSONDecodeError:
+                # NDJSON, or broken JSON
+                payload = None
+
+            if isinstance(payload, dict) and isinstance(payload.get("files"), list):
+                return payload["files"], payload
+            if isinstance(payload, list):
+                return payload, None
+            if isinstance(payload, dict):
+                return [payload], None
+
+        records = []
+        for line in stripped.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(_json_loads(line))
+            except json.JSONDecodeError:
+                continue
+        return records, None
+
+    @classmethod
+    def from_text(
+            cls,
+            text: str
+        ) -> "Manifest":
+        records, document = cls._records(text)
+        members: list[str] = []
+        sha512s: list[Optional[str]] = []
+        headers: list[object] = []
+        uuid = manifest_record_uuid(document) if document is not None else None
+        for record in records:
+            if uuid is None:
+                uuid = manifest_record_uuid(record)
+            member = manifest_record_member(record)
+            if not member:
+                headers.append(record)
+                continue
+            members.append(Path(member).name)
+            sha512s.append(manifest_record_sha512(record))
+        if document is not None:
+            headers.insert(0, {key: value for key, value in document.items() if key != "files"})
+        return cls(members, sha512s, uuid, headers)
+
+    @classmethod
+    def from_file(
+            cls,
+            manifest_path: Path
+        ) -> "Manifest":
+        return cls.from_text(manifest_path.read_text())
+
+    @classmethod
+    def from_zip(
+            cls,
+            bundle_zip_path: Path,
+            archive_key: Optional[str] = None
+        ) -> Optional["Manifest"]:
+        """Manifest of the first manifest member of a zip file, None if there is none."""
+        manifest = read_manifest_from_zip(bundle_zip_path, archive_key=archive_key)
+        if manifest is None:
+            return None
+        return cls.from_text(manifest[0])
+
+
 def extract_manifest_members_from_text(
         text: str
     ) -> list[str]:
-    stripped = text.strip()
-    if not stripped:
-        return []
-
-    if stripped[0] in "[{":
-        try:
-            payload = json.loads(stripped)
-        except json.JSONDecodeError:
-            payload = None
-
-        if isinstance(payload, dict) and isinstance(payload.get("files"), list):
-            members: list[str] = []
-            for record in payload["files"]:
-                member = manifest_record_member(record)
-                if member:
-                    members.append(Path(member).name)
-            return members
-
-        if isinstance(payload, list):
-            members: list[str] = []
-            for record in payload:
-                member = manifest_record_member(record)
-                if member:
-                    members.append(Path(member).name)
-            return members
-
-    members: list[str] = []
-    for line in stripped.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            record = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-
-        member = manifest_record_member(record)
-        if member:
-            members.append(Path(member).name)
-
-    return members
+    return Manifest.from_text(text).members
 
 
 def extract_manifest_members_from_file(
         manifest_path: Path
     ) -> list[str]:
-    return extract_manifest_members_from_text(manifest_path.read_text())
+    return Manifest.from_file(manifest_path).members
 
 
 def extract_manifest_uuid_from_text(
         text: str
     ) -> Optional[str]:
-    stripped = text.strip()
-    if not stripped:
-        return None
-
-    if stripped[0] in "[{":
-        try:
-            payload = json.loads(stripped)
-        except json.JSONDecodeError:
-            payload = None
-
-        if isinstance(payload, dict):
-            uuid_value = manifest_record_uuid(payload)
-            if uuid_value:
-                return uuid_value
-
-            files = payload.get("files")
-            if isinstance(files, list):
-                for record in files:
-                    uuid_value = manifest_record_uuid(record)
-                    if uuid_value:
-                        return uuid_value
-
-        if isinstance(payload, list):
-            for record in payload:
-                uuid_value = manifest_record_uuid(record)
-                if uuid_value:
-                    return uuid_value
-
-    for line in stripped.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            record = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-
-        uuid_value = manifest_record_uuid(record)
-        if uuid_value:
-            return uuid_value
-
-    return None
+    return Manifest.from_text(text).uuid
 
 
 def extract_manifest_uuid_from_file(
         manifest_path: Path
     ) -> Optional[str]:
-    return extract_manifest_uuid_from_text(manifest_path.read_text())
+    return Manifest.from_file(manifest_path).uuid
 
 
 def extract_manifest_checksums_from_text(
         text: str
     ) -> dict[str, Optional[str]]:
-    stripped = text.strip()
-    if not stripped:
-        return {}
-
-    checksums: dict[str, Optional[str]] = {}
-
-    if stripped[0] == "{":
-        try:
-            payload = json.loads(stripped)
-        except json.JSONDecodeError:
-            payload = None
-
-        if isinstance(payload, dict) and isinstance(payload.get("files"), list):
-            for record in payload["files"]:
-                member = manifest_record_member(record)
-                sha512 = manifest_record_sha512(record)
-                if member and sha512:
-                    checksums[Path(member).name] = sha512
-            return checksums
-
-    for line in stripped.splitlines():
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            record = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-
-        member = manifest_record_member(record)
-        sha512 = manifest_record_sha512(record)
-        if member and sha512:
-            checksums[Path(member).name] = sha512
-
-    return checksums
+    return Manifest.from_text(text).checksums()
 
 
 def extract_manifest_checksums_from_zip(
@@ -255,8 +257,10 @@ def extract_manifest_checksums_from_zip(
         archive_key: Optional[str] = None
     ) -> dict[str, Optional[str]]:
     checksums: dict[str, Optional[str]] = {}
-    for manifest_member in find_manifest_members_in_zip(bundle_zip_path, archive_key=archive_key):
-        with zipfile.ZipFile(bundle_zip_path) as zf:
+    with zipfile.ZipFile(bundle_zip_path) as zf:
+        for manifest_member in sorted(
+                member for member in zf.namelist()
+                if is_manifest_member_name(member, archive_key=archive_key)):
             with zf.open(manifest_member) as handle:
-                checksums.update(extract_manifest_checksums_from_text(handle.read().decode("utf-8", errors="replace")))
-    return checksums
\ No newline at end of file
+                checksums.update(Manifest.from_text(handle.read().decode("utf-8", errors="replace")).checksums())
+    return checksums
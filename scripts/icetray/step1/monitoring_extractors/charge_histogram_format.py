@@ -0,0 +1,205 @@
+"""Compact on-disk format for the per-DOM ATWD/FADC charge histograms.
+
+The harvester histograms are (87, 61, nbins) arrays where string 0, om 0,
+IceTop and dead DOMs are always empty and every entry is an integer count.
+This format only stores the rows of DOMs that saw a pulse, using the
+smallest unsigned integer type that holds the counts:
+
+- format_version: FORMAT_VERSION
+- encoding: "dense" or "sparse"
+- dom_mask: (87, 61) bool, DOMs with a stored row, in C order
+- bins: charge bin edges
+- dense: {channel}_counts, (ndoms, nbins)
+- sparse: {channel}_indptr (ndoms + 1), {channel}_bin and {channel}_count,
+  i.e. CSR rows holding only the non-empty bins
+
+Any other arrays (fit results, start time, ...) are stored unchanged.
+Uncompressed files can be memory-mapped, so a single DOM's histogram can be
+read without loading the whole file (see ChargeHistogramFile).
+
+Kept free of icetray imports so the checks can read the sidecars without an
+icetray environment."""
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+CHANNELS = ("atwd", "fadc")
+HISTOGRAM_SHAPE = (87, 61)
+FORMAT_KEYS = {"format_version", "encoding", "dom_mask"} | {
+    f"{channel}_{suffix}" for channel in CHANNELS
+    for suffix in ("counts", "indptr", "bin", "count")}
+
+
+def _count_dtype(max_count):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _to_counts(histograms):
+    counts = np.rint(histograms)
+    if counts.size and counts.min() < 0:
+        raise ValueError("Charge histograms can not hold negative counts")
+    return counts.astype(_count_dtype(counts.max() if counts.size else 0))
+
+
+def encode_charge_histograms(histograms, bins, sparse=False):
+    """Encode {channel: (87, 61, nbins) array} into the arrays of the format."""
+    dom_mask = np.zeros(HISTOGRAM_SHAPE, dtype=bool)
+    for channel in CHANNELS:
+        dom_mask |= histograms[channel].sum(axis=-1) > 0
+
+    arrays = {
+        "format_version": np.int64(FORMAT_VERSION),
+        "encoding": np.array("sparse" if sparse else "dense"),
+        "dom_mask": dom_mask,
+        "bins": np.asarray(bins),
+    }
+    for channel in CHANNELS:
+        rows = histograms[channel][dom_mask]
+        if not sparse:
+            arrays[f"{channel}_counts"] = _to_counts(rows)
+            continue
+        dom_idx, bin_idx = np.nonzero(rows)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dom_idx, minlength=len(rows)), out=indptr[1:])
+        arrays[f"{channel}_indptr"] = indptr
+        arrays[f"{channel}_bin"] = bin_idx.astype(_count_dtype(rows.shape[-1]))
+        arrays[f"{channel}_count"] = _to_counts(rows[dom_idx, bin_idx])
+    return arrays
+
+
+def write_charge_histograms(filename, atwd, fadc, bins, sparse=False, compress=False, **extra):
+    """Write the histograms in the compact format.
+
+    `extra` arrays are stored next to the histograms unchanged. Compressed
+    files are smaller but can not be memory-mapped."""
+    arrays = encode_charge_histograms({"atwd": atwd, "fadc": fadc}, bins, sparse=sparse)
+    overlap = set(arrays) & set(extra)
+    if overlap:
+        raise ValueError(f"Reserved charge histogram keys passed as extra arrays: {sorted(overlap)}")
+    arrays.update(extra)
+    savez = np.savez_compressed if compress else np.savez
+    savez(filename, **arrays)
+
+
+def is_compact(data):
+    """True if the loaded npz was written by write_charge_histograms."""
+    return "format_version" in data
+
+
+def decode_channel(data, channel):
+    """Return the dense (87, 61, nbins) float32 histograms of one channel."""
+    if int(data["format_version"]) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported charge histogram format version {int(data['format_version'])}")
+    dom_mask = data["dom_mask"]
+    nbins = len(data["bins"]) - 1
+    histograms = np.zeros(dom_mask.shape + (nbins,), dtype=np.float32)
+    if str(data["encoding"]) == "sparse":
+        indptr = data[f"{channel}_indptr"]
+        rows = np.zeros((len(indptr) - 1, nbins), dtype=np.float32)
+        dom_idx = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        rows[dom_idx, data[f"{channel}_bin"]] = data[f"{channel}_count"]
+    else:
+        rows = data[f"{channel}_counts"]
+    histograms[dom_mask] = rows
+    return histograms
+
+
+def read_charge_histograms(filename):
+    """Load a sidecar into a dict with dense float32 `atwd` and `fadc`.
+
+    Works for both the compact format and the dense files written before it,
+    so callers get the same arrays either way."""
+    with np.load(filename, allow_pickle=False) as data:
+        if not is_compact(data):
+            return {key: data[key] for key in data.files}
+        result = {key: data[key] for key in data.files if key not in FORMAT_KEYS}
+        for channel in CHANNELS:
+            result[channel] = decode_channel(data, channel)
+    return result
+
+
+def _memmap_npz_member(filename, zip_info):
+    """Memory-map an uncompressed .npy member of an npz file."""
+    with open(filename, "rb") as f:
+        # Local file header: 30 fixed bytes, then the name and extra field
+        f.seek(zip_info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+        f.seek(zip_info.header_offset + 30 + int(name_len) + int(extra_len))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject:
+        raise ValueError(f"Can not memory-map object array {zip_info.filename}")
+    if shape == ():
+        return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(1,))[0]
+    return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+class ChargeHistogramFile:
+    """Lazy access to single DOM histograms of a sidecar.
+
+    Arrays of uncompressed members are memory-mapped, so reading one DOM only
+    touches the pages of that DOM. Compressed members are loaded on first
+    access. Legacy dense sidecars are supported as well."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._arrays = {}
+        self._npz = np.load(filename, allow_pickle=False)
+        with zipfile.ZipFile(filename) as zf:
+            self._members = {info.filename[:-len(".npy")]: info for info in zf.infolist()
+                             if info.filename.endswith(".npy")}
+        self.compact = "format_version" in self._members
+        if self.compact:
+            self.dom_mask = np.asarray(self["dom_mask"])
+            self.sparse = str(self["encoding"]) == "sparse"
+            # Row of each DOM in the stored arrays, -1 for DOMs without one
+            self._row = np.full(self.dom_mask.shape, -1, dtype=np.int64)
+            self._row[self.dom_mask] = np.arange(self.dom_mask.sum())
+        self.bins = np.asarray(self["bins"])
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            info = self._members[key]
+            if info.compress_type == zipfile.ZIP_STORED:
+                self._arrays[key] = _memmap_npz_member(self.filename, info)
+            else:
+                self._arrays[key] = self._npz[key]
+        return self._arrays[key]
+
+    def __contains__(self, key):
+        return key in self._members
+
+    def dom(self, channel, string, om):
+        """Histogram of one DOM as a float32 array of length nbins."""
+        if not self.compact:
+            return np.asarray(self[channel][string, om], dtype=np.float32)
+        nbins = len(self.bins) - 1
+        histogram = np.zeros(nbins, dtype=np.float32)
+        row = self._row[string, om]
+        if row < 0:
+            return histogram
+        if self.sparse:
+            start, stop = self[f"{channel}_indptr"][row:row + 2]
+            histogram[self[f"{channel}_bin"][start:stop]] = self[f"{channel}_count"][start:stop]
+        else:
+            histogram[:] = self[f"{channel}_counts"][row]
+        return histogram
+
+    def close(self):
+        self._arrays.clear()
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,77 @@
+"""Gaussian peak fits for the per-DOM ATWD/FADC charge histograms.
+
+Kept free of icetray imports so the run-level checks can refit summed
+histograms without an icetray environment."""
+import numpy as np
+from scipy.stats import norm as gaus
+from scipy.optimize import minimize
+
+
+def charge_bins_center(charge_bins):
+    """Bin positions used when fitting, matching PulseChargeFilterHarvester."""
+    return charge_bins[:-1] + np.diff(charge_bins)
+
+
+def peak_fit_bin_mask(charge_bins, peak_fit_bounds):
+    """Boolean mask over histogram bins that fall inside the fit bounds."""
+    return ((peak_fit_bounds[0] <= charge_bins)
+            & (charge_bins <= peak_fit_bounds[1]))[:-1]
+
+
+def estimate_peak(histogram, charge_bins, bin_mask):
+    """Fit a gaussian to the SPE peak of every histogram in `histogram`.
+
+    `histogram` can be a single histogram or an array of histograms with the
+    charge bins along the last axis, e.g. (87, 61, nbins). Returns the fitted
+    means and sigmas with the leading shape of `histogram`; empty histograms
+    are left at 0."""
+    xvals = charge_bins_center(charge_bins)[bin_mask]
+    yvals = histogram[..., bin_mask]
+    mean = (xvals * yvals).sum(axis=-1) / yvals.sum(axis=-1)
+    variance = (xvals**2 * yvals).sum(axis=-1) / yvals.sum(axis=-1) - mean**2
+
+    gaus_mean, gaus_sigma = np.zeros_like(mean), np.zeros_like(mean)
+
+    # Get the bins edges associated with the masked bin centers
+    bins = np.unique([charge_bins[:-1][bin_mask],
+                      charge_bins[1:][bin_mask]])
+
+    for idx in np.ndindex(mean.shape):
+        # We're using 0-indexed arrays with empty string=0 rows and om=0 columns.
+        # Skip those cases.
+        if np.sum(yvals[idx]) == 0:
+            continue
+        min_opts = {'maxiter': 10000, 'gtol': 1e-6, 'disp': False}
+        seed = (mean[idx], np.sqrt(variance[idx]))
+        min_bds = ((seed[0] - 0.5, seed[0] + 0.5),
+                   (seed[1] * 0.5, seed[1] * 2))
+        def chi2(params, summed=True):
+            mean, sigma = params
+            cdf = gaus.cdf(bins, loc=mean, scale=sigma)
+            expected = np.diff(cdf)
+            expected *= yvals[idx].sum() / expected.sum()
+
+            perbin = (yvals[idx]-expected)**2 / expected#yvals[idx]
+            if summed:
+                total = np.nansum(perbin)
+                if total == 0:
+                    # This is only likely to happen when the fit wanders off. Penalize it.
+                    return np.finfo(np.float64).max
+                return total
+            else:
+                return perbin
+
+        method = "Nelder-Mead"
+        result = minimize(chi2, x0=seed, method=method,
+                          bounds=min_bds, options=min_opts)
+        if not result.success:
+            seed1 = [sv * 0.9 for sv in seed]
+            result = minimize(chi2, x0=seed1, method=method,
+                              bounds=min_bds, options=min_opts)
+            if not result.success:
+                seed1 = [sv * 1.1 for sv in seed]
+                result = minimize(chi2, x0=seed1, method=method,
+                                  bounds=min_bds, options=min_opts)
+        gaus_mean[idx] = result.x[0]
+        gaus_sigma[idx] = result.x[1]
+    return gaus_mean, gaus_sigma
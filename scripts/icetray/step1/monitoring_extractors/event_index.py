@@ -0,0 +1,153 @@
+"""Per-output event index of Step1 files.
+
+One row per Q frame written to the output file:
+
+- frame: ordinal of the frame among those the I3Writer received, for seeking
+  (the frames the writer adds in front are found when reading)
+- run_id, event_id: from I3EventHeader (-1 if the frame has no header)
+- start_time: event start time in ns since the unix epoch
+- filter_mask: OnlineFilterMask prescale_passed bits, see filter_names
+- npulses: number of I3SuperDST pulses
+
+Rates, livetime and duplicate checks only need these columns, so they can be
+computed without decoding the i3 files. Seeking back into the i3 file is done
+by pass3_event_indexer.read_indexed_frames, by frame ordinal (compressed files
+are still decompressed up to the frame, see pass3_event_indexer).
+
+Kept free of icetray imports so the checks can use the indices without an
+icetray environment."""
+import calendar
+
+import numpy as np
+
+from .filter_rate_bins import FilterBitTable
+
+INDEX_VERSION = 1
+COLUMNS = {
+    "frame": np.int64,
+    "run_id": np.int64,
+    "event_id": np.int64,
+    "start_time": np.int64,
+    "filter_mask": np.uint64,
+    "npulses": np.int64,
+}
+
+
+def i3time_to_unix_ns(utc_year, utc_daq_time):
+    """Integer ns since the unix epoch from an I3Time's (utc_year, utc_daq_time)."""
+    return calendar.timegm((int(utc_year), 1, 1, 0, 0, 0)) * 10**9 + int(utc_daq_time) // 10
+
+
+class EventIndex:
+    """Columns of one or more event indices plus the filter bit table."""
+
+    def __init__(self, filter_names=(), columns=None, source=None):
+        self.filter_names = list(filter_names)
+        self.source = source
+        if columns is None:
+            columns = {}
+        self.columns = {name: np.asarray(columns.get(name, []), dtype=dtype)
+                        for name, dtype in COLUMNS.items()}
+
+    def __len__(self):
+        return len(self.columns["frame"])
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get("columns", {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def write(self, filename):
+        np.savez(filename,
+                 index_version=INDEX_VERSION,
+                 filter_names=np.array(self.filter_names, dtype=str),
+                 **self.columns)
+
+    @classmethod
+    def read(cls, filename):
+        with np.load(filename) as data:
+            if int(data["index_version"]) > INDEX_VERSION:
+                raise ValueError(f"Unsupported event index version {int(data['index_version'])} in {filename}")
+            return cls([str(name) for name in data["filter_names"]],
+                       {name: data[name] for name in COLUMNS},
+                       source=str(filename))
+
+    def take(self, rows):
+        """Sub-index with the selected rows."""
+        return EventIndex(self.filter_names,
+                          {name: column[rows] for name, column in self.columns.items()},
+                          source=self.source)
+
+    def find_event(self, run_id, event_id):
+        """Rows of the given event."""
+        return np.flatnonzero((self.run_id == run_id) & (self.event_id == event_id))
+
+    def find_time_range(self, start, stop):
+        """Rows with start <= start_time < stop, in ns since the unix epoch."""
+        return np.flatnonzero((self.start_time >= start) & (self.start_time < stop))
+
+    def passed(self, filter_name):
+        """Bool array of events passing a filter."""
+        if filter_name not in self.filter_names:
+            return np.zeros(len(self), dtype=bool)
+        bit = np.uint64(self.filter_names.index(filter_name))
+        return ((self.filter_mask >> bit) & np.uint64(1)).astype(bool)
+
+    def filter_counts(self):
+        """{filter name: number of passing events}"""
+        table = FilterBitTable(self.filter_names)
+        counts = table.unpack(self.filter_mask).sum(axis=0)
+        return {name: int(count) for name, count in zip(self.filter_names, counts)}
+
+    def livetime(self):
+        """Seconds between the first and last event with a header."""
+        times = self.start_time[self.run_id >= 0]
+        if len(times) == 0:
+            return 0.
+        return (times.max() - times.min()) / 1e9
+
+    def filter_rates(self):
+        """{filter name: rate in Hz} over the livetime of the index."""
+        livetime = self.livetime()
+        if livetime <= 0:
+            raise ValueError(f"Invalid livetime {livetime} s for {self.source}")
+        return {name: count / livetime for name, count in self.filter_counts().items()}
+
+
+def merge_indices(indices):
+    """Concatenate indices of several files, remapping the filter bits onto the canonical table."""
+    table = FilterBitTable.canonical()
+    for index in indices:
+        for name in index.filter_names:
+            table.bit(name)
+    columns = {name: [] for name in COLUMNS}
+    for index in indices:
+        for name in COLUMNS:
+            if name != "filter_mask":
+                columns[name].append(index.columns[name])
+        passed = FilterBitTable(index.filter_names).unpack(index.filter_mask)
+        bits = np.array([table.bit(name) for name in index.filter_names], dtype=np.uint64)
+        masks = (passed.astype(np.uint64) << bits).sum(axis=1, dtype=np.uint64) if len(bits) \
+            else np.zeros(len(index), dtype=np.uint64)
+        columns["filter_mask"].append(masks)
+    return EventIndex(table.names, {name: np.concatenate(parts) if parts else []
+                                    for name, parts in columns.items()})
+
+
+def find_duplicate_events(indices):
+    """(run_id, event_id) pairs that appear more than once across the indices.
+
+    Returns a structured array with run_id, event_id and count."""
+    merged = merge_indices(indices)
+    has_header = merged.run_id >= 0
+    keys = np.stack([merged.run_id[has_header], merged.event_id[has_header]], axis=1)
+    if len(keys) == 0:
+        keys = np.zeros((0, 2), dtype=np.int64)
+    unique, counts = np.unique(keys, axis=0, return_counts=True)
+    dup = counts > 1
+    result = np.zeros(dup.sum(), dtype=[("run_id", np.int64), ("event_id", np.int64), ("count", np.int64)])
+    result["run_id"] = unique[dup, 0]
+    result["event_id"] = unique[dup, 1]
+    result["count"] = counts[dup]
+    return result
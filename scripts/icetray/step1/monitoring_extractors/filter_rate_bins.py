@@ -0,0 +1,227 @@
+"""Time-binned filter counts, cheap to merge across files and runs.
+
+Each frame's filter decisions are packed into a uint64 bitmask using a
+FilterBitTable (filter name -> bit). FilterBitTable.canonical() gives the
+filters of CANONICAL_FILTERS fixed bits, so a bit means the same filter in
+every file and run written with the same FILTER_TABLE_VERSION. Counts are kept in
+a (time bin x filter) array whose time bins are absolute, i.e. bin i covers
+[i * bin_width, (i + 1) * bin_width) seconds since the unix epoch, so files
+and runs can be merged by aligning bins and filter names.
+
+Kept free of icetray imports so the checks can merge and plot the outputs
+without an icetray environment."""
+import calendar
+
+import numpy as np
+
+MAX_FILTERS = 64
+DEFAULT_BIN_WIDTH = 60.
+
+# OnlineFilterMask names of the online_filterscripts filter_config.json used by
+# pass3_reprocess_PFRaw.py, plus the Step1 SuperDST filter. The bits are the
+# positions in this list. Only ever append, and bump FILTER_TABLE_VERSION.
+FILTER_TABLE_VERSION = 1
+CANONICAL_FILTERS = (
+    "Keep_SuperDST_23",
+    "CascadeFilter_13",
+    "DeepCoreFilter_13",
+    "DeepCoreFilter_TwoLayerExp_13",
+    "EHEAlertFilter_15",
+    "EHEAlertFilterHB_15",
+    "EstresAlertFilter_18",
+    "FilterMinBias_13",
+    "FixedRateFilter_13",
+    "FSSCandidate_13",
+    "FSSFilter_13",
+    "GFUFilter_17",
+    "GRECOOnlineFilter_19",
+    "HESEFilter_15",
+    "HighQFilter_17",
+    "I3DAQDecodeException",
+    "IceActTrigFilter_18",
+    "IceTopSTA3_13",
+    "IceTopSTA5_13",
+    "IceTop_InFill_STA2_17",
+    "IceTop_InFill_STA3_13",
+    "InIceSMT_IceTopCoincidence_13",
+    "LowUp_13",
+    "MESEFilter_15",
+    "MonopoleFilter_16",
+    "MoonFilter_13",
+    "MuonFilter_13",
+    "OnlineL2Filter_17",
+    "SDST_IceTopSTA3_13",
+    "SDST_InIceSMT_IceTopCoincidence_13",
+    "ScintMinBias_16",
+    "SlopFilter_13",
+    "SunFilter_13",
+    "VEFFilter_13",
+)
+
+
+def i3time_to_unix(utc_year, utc_daq_time):
+    """Seconds since the unix epoch from an I3Time's (utc_year, utc_daq_time).
+
+    utc_daq_time is in units of 0.1 ns since the start of the year."""
+    return calendar.timegm((int(utc_year), 1, 1, 0, 0, 0)) + utc_daq_time * 1e-10
+
+
+class FilterBitTable:
+    """Filter name -> bit mapping, at most 64 filters.
+
+    The given names get the first bits, names seen later the following bits
+    in first-seen order. Filter names are stored with every output, so
+    readers can still match bits by name for filters outside the canonical
+    list."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._bits = {}
+        for name in names:
+            self.bit(name)
+
+    @classmethod
+    def canonical(cls):
+        """Table with the fixed bits of CANONICAL_FILTERS."""
+        return cls(CANONICAL_FILTERS)
+
+    def bit(self, name):
+        bit = self._bits.get(name)
+        if bit is None:
+            if len(self.names) >= MAX_FILTERS:
+                raise ValueError(f"Can not encode more than {MAX_FILTERS} filters in a bitmask, got {name}")
+            bit = len(self.names)
+            self._bits[name] = bit
+            self.names.append(name)
+        return bit
+
+    def pack(self, passed_names):
+        """Bitmask of the given passed filter names."""
+        mask = 0
+        for name in passed_names:
+            mask |= 1 << self.bit(name)
+        return mask
+
+    def unpack(self, masks):
+        """(nframes, nfilters) bool array from an array of uint64 masks."""
+        masks = np.asarray(masks, dtype=np.uint64)
+        shifts = np.arange(len(self.names), dtype=np.uint64)
+        return ((masks[:, None] >> shifts) & np.uint64(1)).astype(bool)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class TimeBinnedFilterCounts:
+    """Per time bin counts of frames and of frames passing each filter.
+
+    - first_bin: absolute index of the first time bin
+    - frames: (nbins,) frames with an event header per bin
+    - counts: (nbins, nfilters) frames passing each filter per bin
+    - livetime: (nbins,) seconds of each bin covered by the input files
+    """
+
+    def __init__(self, filter_names=(), bin_width=DEFAULT_BIN_WIDTH,
+                 first_bin=0, frames=None, counts=None, livetime=None):
+        self.bin_width = float(bin_width)
+        self.filter_names = list(filter_names)
+        self.first_bin = int(first_bin)
+        nfilters = len(self.filter_names)
+        self.frames = np.zeros(0, dtype=np.int64) if frames is None else np.asarray(frames, dtype=np.int64)
+        self.counts = (np.zeros((len(self.frames), nfilters), dtype=np.int64)
+                       if counts is None else np.asarray(counts, dtype=np.int64))
+        self.livetime = (np.zeros(len(self.frames), dtype=np.float64)
+                         if livetime is None else np.asarray(livetime, dtype=np.float64))
+
+    @classmethod
+    def from_frames(cls, bit_table, unix_times, masks, start, stop, bin_width=DEFAULT_BIN_WIDTH):
+        """Bin the buffered (time, bitmask) pairs of one file.
+
+        start and stop are the first and last event times in unix seconds,
+        they define which part of the first and last bins is live."""
+        time_bins = np.floor(np.asarray(unix_times, dtype=np.float64) / bin_width).astype(np.int64)
+        first_bin = int(np.floor(start / bin_width))
+        nbins = int(np.floor(stop / bin_width)) - first_bin + 1
+        idx = time_bins - first_bin
+
+        frames = np.bincount(idx, minlength=nbins)
+        passed = bit_table.unpack(masks)
+        counts = np.zeros((nbins, len(bit_table)), dtype=np.int64)
+        for bit in range(len(bit_table)):
+            counts[:, bit] = np.bincount(idx, weights=passed[:, bit], minlength=nbins)
+
+        edges = (first_bin + np.arange(nbins + 1)) * bin_width
+        livetime = np.clip(np.minimum(edges[1:], stop) - np.maximum(edges[:-1], start), 0., None)
+        return cls(bit_table.names, bin_width, first_bin, frames, counts, livetime)
+
+    @property
+    def nbins(self):
+        return len(self.frames)
+
+    def bin_starts(self):
+        """Unix time of the start of each bin."""
+        return (self.first_bin + np.arange(self.nbins)) * self.bin_width
+
+    def merge(self, other):
+        """Return the sum of two sets of counts, aligning time bins and filter names."""
+        if self.nbins == 0:
+            return other
+        if other.nbins == 0:
+            return self
+        if self.bin_width != other.bin_width:
+            raise ValueError(f"Can not merge bin widths {self.bin_width} and {other.bin_width}")
+        names = FilterBitTable(self.filter_names + other.filter_names).names
+        first_bin = min(self.first_bin, other.first_bin)
+        last_bin = max(self.first_bin + self.nbins, other.first_bin + other.nbins)
+        merged = TimeBinnedFilterCounts(names, self.bin_width, first_bin,
+                                        np.zeros(last_bin - first_bin, dtype=np.int64))
+        for part in (self, other):
+            rows = slice(part.first_bin - first_bin, part.first_bin - first_bin + part.nbins)
+            cols = [names.index(name) for name in part.filter_names]
+            merged.frames[rows] += part.frames
+            merged.livetime[rows] += part.livetime
+            merged.counts[rows, cols] += part.counts
+        return merged
+
+    def totals(self):
+        """{filter name: total count}"""
+        return {name: int(count) for name, count in zip(self.filter_names, self.counts.sum(axis=0))}
+
+    def rates(self):
+        """(nbins, nfilters) rates in Hz, NaN for bins without livetime."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(self.livetime[:, None] > 0,
+                            self.counts / self.livetime[:, None], np.nan)
+
+    def rate_curves(self):
+        """{filter name: per bin rates in Hz} with None for dead bins, for JSON."""
+        rates = self.rates()
+        return {name: [None if np.isnan(rate) else float(rate) for rate in rates[:, i]]
+                for i, name in enumerate(self.filter_names)}
+
+    def write(self, filename):
+        np.savez(filename,
+                 bin_width=self.bin_width,
+                 first_bin=self.first_bin,
+                 filter_names=np.array(self.filter_names, dtype=str),
+                 frames=self.frames,
+                 counts=self.counts,
+                 livetime=self.livetime)
+
+    @classmethod
+    def read(cls, filename):
+        with np.load(filename) as data:
+            return cls([str(name) for name in data["filter_names"]],
+                       float(data["bin_width"]),
+                       int(data["first_bin"]),
+                       data["frames"],
+                       data["counts"],
+                       data["livetime"])
+
+
+def merge_filter_counts(filenames):
+    """Merge the binned filter counts written for several files or runs."""
+    merged = TimeBinnedFilterCounts()
+    for filename in filenames:
+        merged = merged.merge(TimeBinnedFilterCounts.read(filename))
+    return merged
@@ -1,6 +1,7 @@
 """Utility to calculate filter rates from filtered output files."""
 from __future__ import annotations
 
+import importlib.util
 import json
 
 from icecube.icetray import I3ConditionalModule, I3Units
@@ -9,6 +10,23 @@ from collections import defaultdict
 
 from pathlib import Path
 
+import numpy as np
+
+from .filter_rate_bins import DEFAULT_BIN_WIDTH, FilterBitTable, TimeBinnedFilterCounts, i3time_to_unix
+
+QA_RESULTS_STORE_PATH = Path(__file__).resolve().parents[3] / "checks" / "step1" / "utils" / "qa_results_store.py"
+
+
+def _load_qa_results_store():
+    """The QAResultsStore class of the checks, which live in another tree."""
+    spec = importlib.util.spec_from_file_location("checks_qa_results_store", QA_RESULTS_STORE_PATH)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Could not load the QA results store from {QA_RESULTS_STORE_PATH}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.QAResultsStore
+
+
 class FilterRateMonitorI3Module(I3ConditionalModule):
     """Getting filter rates"""
 
@@ -24,59 +42,139 @@ class FilterRateMonitorI3Module(I3ConditionalModule):
         self.AddParameter("output_file",
                           "file to write information to",
                           None)
+        self.AddParameter("binned_output_file",
+                          "npz file to write the time-binned filter counts to",
+                          None)
+        self.AddParameter("bin_width",
+                          "Width of the time bins in seconds",
+                          DEFAULT_BIN_WIDTH)
+        self.AddParameter("qa_store",
+                          "SQLite QA results store (checks/step1/utils/qa_results_store.py) to insert the "
+                          "filter counts and livetime of this file into",
+                          None)
+        self.AddParameter("min_superdst_rate",
+                          "Warn if the Keep_SuperDST_23 rate drops below this in any time bin [Hz]",
+                          1300.)
         self.filter_cnt = defaultdict(int)
         self.start_time = None
         self.stop_time = None
+        self.first_time = None
+        self.last_time = None
+        self.run_id = None
         self.header_cnt = 0
         self.frame_cnt = 0
+        self.bit_table = FilterBitTable.canonical()
+        self.event_times = []
+        self.event_masks = []
 
     def Configure(self):
         """Getting params"""
         self.eventheader_key = self.GetParameter("eventheader_key")
         self.filtermask_key = self.GetParameter("filtermask_key")
         self.outfile = self.GetParameter("output_file")
+        self.binned_outfile = self.GetParameter("binned_output_file")
+        self.bin_width = self.GetParameter("bin_width")
+        self.min_superdst_rate = self.GetParameter("min_superdst_rate")
+        self.qa_store = self.GetParameter("qa_store")
 
     def DAQ(self, frame):
         """Counting filters and time for Q frames"""
         if self.eventheader_key in frame:
             self.header_cnt += 1
+            event_time = frame[self.eventheader_key].start_time
             if (self.start_time is None) or (self.frame_cnt == 0):
                 # Save the first event time
-                self.start_time = frame[self.eventheader_key].start_time
+                self.start_time = event_time
                 # Save the event time as potential last...
-                self.stop_time = frame[self.eventheader_key].start_time
-            if self.start_time > frame[self.eventheader_key].start_time:
-                self.start_time = frame[self.eventheader_key].start_time
-            if frame[self.eventheader_key].start_time > self.stop_time:
-                self.stop_time = frame[self.eventheader_key].start_time
+                self.stop_time = event_time
+            if self.start_time > event_time:
+                self.start_time = event_time
+            if event_time > self.stop_time:
+                self.stop_time = event_time
+            # First and last header in file order, as pass3_calc_filter_rates.py uses them
+            if self.first_time is None:
+                self.first_time = event_time
+                self.run_id = frame[self.eventheader_key].run_id
+            self.last_time = event_time
+            mask = 0
             if self.filtermask_key in frame:
-                for name in frame[self.filtermask_key].keys():
-                    if frame[self.filtermask_key][name].prescale_passed:
-                        self.filter_cnt[name] += 1
+                for name, result in frame[self.filtermask_key].items():
+                    if result.prescale_passed:
+                        if name not in self.filter_cnt:
+                            # Keeps the filters in first-seen order
+                            self.filter_cnt[name] = 0
+                        mask |= 1 << self.bit_table.bit(name)
+            self.event_times.append(i3time_to_unix(event_time.utc_year, event_time.utc_daq_time))
+            self.event_masks.append(mask)
         self.frame_cnt += 1
         self.PushFrame(frame)
 
+    def _binned_counts(self):
+        """Unpack the buffered bitmasks into time-binned counts."""
+        return TimeBinnedFilterCounts.from_frames(
+            self.bit_table,
+            np.array(self.event_times, dtype=np.float64),
+            np.array(self.event_masks, dtype=np.uint64),
+            i3time_to_unix(self.start_time.utc_year, self.start_time.utc_daq_time),
+            i3time_to_unix(self.stop_time.utc_year, self.stop_time.utc_daq_time),
+            bin_width=self.bin_width)
+
+    def _check_rate_dips(self, binned):
+        """Warn about time bins where the SuperDST rate drops below the limit."""
+        if "Keep_SuperDST_23" not in binned.filter_names:
+            return
+        rates = binned.rates()[:, binned.filter_names.index("Keep_SuperDST_23")]
+        # Partially covered bins at the file edges are too noisy to judge
+        full = binned.livetime >= 0.5 * binned.bin_width
+        for bin_start, rate in zip(binned.bin_starts()[full], rates[full]):
+            if rate <= self.min_superdst_rate:
+                print(f"WARNING: Keep_SuperDST_23 rate is {rate:.1f} Hz in the {binned.bin_width:.0f} s "
+                      f"bin starting at unix time {bin_start:.0f}, below {self.min_superdst_rate} Hz")
+
     def Finish(self):
         """"Aggregate info and write to txt file"""
         if self.frame_cnt > 0 and self.stop_time and self.start_time:
             time_l = (self.stop_time - self.start_time) / I3Units.second
             if time_l <= 0:
                 raise ValueError(f"Invalid time length: {time_l} seconds. Start time: {self.start_time}, Stop time: {self.stop_time}")
+            binned = self._binned_counts()
+            self.filter_cnt.update({name: count for name, count in binned.totals().items() if count})
             json_out = {
                 "files_cover": time_l,
                 "header_count": self.header_cnt,
                 "frame_count": self.frame_cnt,
                 "overall_frame_rate": self.frame_cnt / time_l,
-                "filter_rates": {afilter: self.filter_cnt[afilter] / time_l for afilter in self.filter_cnt}
+                "filter_rates": {afilter: self.filter_cnt[afilter] / time_l for afilter in self.filter_cnt},
+                "filter_counts": dict(self.filter_cnt),
+                "start_time": [self.start_time.utc_year, self.start_time.utc_daq_time],
+                "stop_time": [self.stop_time.utc_year, self.stop_time.utc_daq_time],
+                "first_event_time": [self.first_time.utc_year, self.first_time.utc_daq_time],
+                "last_event_time": [self.last_time.utc_year, self.last_time.utc_daq_time],
+                "bin_width": binned.bin_width,
+                "bin_starts": binned.bin_starts().tolist(),
+                "bin_livetime": binned.livetime.tolist(),
+                "rate_curves": binned.rate_curves(),
             }
             with Path.open(self.outfile, "w") as f:
                 json.dump(json_out, f, indent=2)
+            if self.binned_outfile is not None:
+                binned.write(self.binned_outfile)
+            if self.qa_store is not None:
+                with _load_qa_results_store()(self.qa_store) as store:
+                    store.insert_filter_counts([{
+                        "source": str(self.outfile),
+                        "run": self.run_id,
+                        "year": self.first_time.utc_year,
+                        "livetime": time_l,
+                        "filter_counts": dict(self.filter_cnt),
+                    }])
             if "Keep_SuperDST_23" in self.filter_cnt.keys():
                 if (self.filter_cnt["Keep_SuperDST_23"] / time_l) <= 1300.:
                     print("WARNING: Keep_SuperDST_23 rate is below 1300 Hz")
+            self._check_rate_dips(binned)
         else:
             with Path.open(self.outfile, "w") as f:
                 f.write(f"Start time: {self.start_time}\n")
                 f.write(f"Stop time: {self.stop_time}\n")
                 f.write(f"Frame count: {self.frame_cnt}\n")
-                f.write(f"Broken frames: {self.broken_frames}\n")
\ No newline at end of file
+                f.write(f"Header count: {self.header_cnt}\n")
@@ -1,10 +1,10 @@
 import logging
 import numpy as np
-from scipy.stats import norm as gaus
-from scipy.optimize import minimize
 from icecube import dataclasses, icetray
 
 from .numba_charge_histogram import pulsemap_to_histograms
+from .charge_peak_fit import charge_bins_center, estimate_peak, peak_fit_bin_mask
+from .charge_histogram_format import write_charge_histograms
 
 class PulseChargeFilterHarvester(icetray.I3ConditionalModule):
     """A simple I3Module to gather SPE pulse charges for testing.
@@ -38,6 +38,19 @@ class PulseChargeFilterHarvester(icetray.I3ConditionalModule):
                           "Maximum charge to histogram. Default 5 PE.",
                           5.0)
 
+        self.AddParameter("CompactHistograms",
+                          "Store only the integer counts of DOMs with pulses (see charge_histogram_format). "
+                          "The default dense layout is what the plotting notebooks read.",
+                          False)
+
+        self.AddParameter("SparseHistograms",
+                          "Only store the non-empty bins of each DOM. Requires CompactHistograms.",
+                          False)
+
+        self.AddParameter("CompressHistograms",
+                          "Compress the output file. Compressed files can not be memory-mapped.",
+                          False)
+
     def Configure(self):
         """Do any preliminary setup."""
         self.output_filename = self.GetParameter("OutputFilename")
@@ -48,18 +61,22 @@ class PulseChargeFilterHarvester(icetray.I3ConditionalModule):
         self.charge_binsize = self.GetParameter("ChargeBinsize")
         self.charge_binmin = self.GetParameter("ChargeBinMin")
         self.charge_binmax = self.GetParameter("ChargeBinMax")
+        self.compact_histograms = self.GetParameter("CompactHistograms")
+        self.sparse_histograms = self.GetParameter("SparseHistograms")
+        self.compress_histograms = self.GetParameter("CompressHistograms")
+        if self.sparse_histograms and not self.compact_histograms:
+            raise ValueError("SparseHistograms requires CompactHistograms")
 
         self.charge_bins = np.arange(
             self.charge_binmin,
             self.charge_binmax + self.charge_binsize,
             self.charge_binsize)
 
-        self.charge_bins_center = self.charge_bins[:-1] + np.diff(self.charge_bins)
+        self.charge_bins_center = charge_bins_center(self.charge_bins)
         self.shape = (87, 61, len(self.charge_bins)-1)
         self.atwd_histograms = np.zeros(self.shape, dtype=np.float32)
         self.fadc_histograms = np.zeros(self.shape, dtype=np.float32)
-        self.bin_mask = ((self.peak_fit_bounds[0] <= self.charge_bins)
-                          & (self.charge_bins <= self.peak_fit_bounds[1]))[:-1]
+        self.bin_mask = peak_fit_bin_mask(self.charge_bins, self.peak_fit_bounds)
         self.start_time = None
         self.nframes = 0
 
@@ -101,72 +118,38 @@ class PulseChargeFilterHarvester(icetray.I3ConditionalModule):
                     self.logger.warning(f"PulseChargeFilterHarvester: ATWD and FADC mean charge differ for OMKey {omkey[0]}-{omkey[1]} by > 1%")
 
     def _estimate_peak(self, histogram):
-        xvals = self.charge_bins_center[self.bin_mask]
-        yvals = histogram[..., self.bin_mask]
-        mean = (xvals * yvals).sum(axis=-1) / yvals.sum(axis=-1)
-        variance = (xvals**2 * yvals).sum(axis=-1) / yvals.sum(axis=-1) - mean**2
-
-        gaus_mean, gaus_sigma = np.zeros_like(mean), np.zeros_like(mean)
-
-        # Get the bins edges associated with the masked bin centers
-        bins = np.unique([self.charge_bins[:-1][self.bin_mask],
-                          self.charge_bins[1:][self.bin_mask]])
-
-        for idx in np.ndindex(mean.shape):
-            # We're using 0-indexed arrays with empty string=0 rows and om=0 columns.
-            # Skip those cases.
-            if np.sum(yvals[idx]) == 0:
-                continue
-            min_opts = {'maxiter': 10000, 'gtol': 1e-6, 'disp': False}
-            seed = (mean[idx], np.sqrt(variance[idx]))
-            min_bds = ((seed[0] - 0.5, seed[0] + 0.5),
-                       (seed[1] * 0.5, seed[1] * 2))
-            def chi2(params, summed=True):
-                mean, sigma = params
-                cdf = gaus.cdf(bins, loc=mean, scale=sigma)
-                expected = np.diff(cdf)
-                expected *= yvals[idx].sum() / expected.sum()
-
-                perbin = (yvals[idx]-expected)**2 / expected#yvals[idx]
-                if summed:
-                    total = np.nansum(perbin)
-                    if total == 0:
-                        # This is only likely to happen when the fit wanders off. Penalize it.
-                        return np.finfo(np.float64).max
-                    return total
-                else:
-                    return perbin
-
-            method = "Nelder-Mead"
-            result = minimize(chi2, x0=seed, method=method,
-                              bounds=min_bds, options=min_opts)
-            if not result.success:
-                seed1 = [sv * 0.9 for sv in seed]
-                result = minimize(chi2, x0=seed1, method=method,
-                                  bounds=min_bds, options=min_opts)
-                if not result.success:
-                    seed1 = [sv * 1.1 for sv in seed]
-                    result = minimize(chi2, x0=seed1, method=method,
-                                      bounds=min_bds, options=min_opts)
-            gaus_mean[idx] = result.x[0]
-            gaus_sigma[idx] = result.x[1]
-        return gaus_mean, gaus_sigma
+        return estimate_peak(histogram, self.charge_bins, self.bin_mask)
 
     def _write_histogram(self):
         """Write any output files you'll need for testing."""
         atwd_mean, atwd_sigma = self._estimate_peak(self.atwd_histograms)
         fadc_mean, fadc_sigma = self._estimate_peak(self.fadc_histograms)
-        np.savez(self.output_filename,
-                 bounds    = self.peak_fit_bounds,
-                 start     = self.start_time,
-                 atwd      = self.atwd_histograms,
-                 atwd_mean = atwd_mean,
-                 atwd_sigma = atwd_sigma,
-                 fadc      = self.fadc_histograms,
-                 fadc_mean = fadc_mean,
-                 fadc_sigma = fadc_sigma,
-                 bins      = self.charge_bins,
-                 allow_pickle = False)
+        if self.compact_histograms:
+            write_charge_histograms(self.output_filename,
+                                    self.atwd_histograms,
+                                    self.fadc_histograms,
+                                    self.charge_bins,
+                                    sparse     = self.sparse_histograms,
+                                    compress   = self.compress_histograms,
+                                    bounds     = self.peak_fit_bounds,
+                                    start      = np.datetime64("NaT") if self.start_time is None else self.start_time,
+                                    atwd_mean  = atwd_mean,
+                                    atwd_sigma = atwd_sigma,
+                                    fadc_mean  = fadc_mean,
+                                    fadc_sigma = fadc_sigma)
+        else:
+            savez = np.savez_compressed if self.compress_histograms else np.savez
+            savez(self.output_filename,
+                  bounds    = self.peak_fit_bounds,
+                  start     = self.start_time,
+                  atwd      = self.atwd_histograms,
+                  atwd_mean = atwd_mean,
+                  atwd_sigma = atwd_sigma,
+                  fadc      = self.fadc_histograms,
+                  fadc_mean = fadc_mean,
+                  fadc_sigma = fadc_sigma,
+                  bins      = self.charge_bins,
+                  allow_pickle = False)
         self.logger.warning(f"PulseChargeFilterHarvester: Found " +
                             "and wrote ATWD and FADC mean charges" +
                             f" to {self.output_filename}.")
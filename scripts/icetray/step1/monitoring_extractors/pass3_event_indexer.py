@@ -0,0 +1,188 @@
+"""Write an event index (see event_index.py) of a Step1 output file.
+
+EventIndexerI3Module indexes the Q frames on their way to the I3Writer, so
+the output file is not read again. index_i3_file indexes a file that was
+written without it.
+
+The index stores frame ordinals, not byte offsets: I3Writer does not expose
+where a frame starts in the compressed stream. read_indexed_frames seeks to
+the ordinal with dataio.I3File, which for compressed files (.gz, .zst)
+still decompresses and skips everything before the frame. It saves decoding
+the skipped frames, but a seek is not O(1).
+
+Usage:
+    python3 -m monitoring_extractors.pass3_event_indexer <output.i3.zst> <output.i3.zst.index.npz>
+"""
+from __future__ import annotations
+
+import numpy as np
+
+from icecube import dataclasses, dataio
+from icecube.icetray import I3ConditionalModule, I3Frame
+
+from .event_index import COLUMNS, EventIndex, i3time_to_unix_ns
+from .filter_rate_bins import FilterBitTable
+
+
+def _frame_row(frame, eventheader_key, filtermask_key, pulses_key, bit_table):
+    """(run_id, event_id, start_time, filter_mask, npulses) of one Q frame."""
+    run_id, event_id, start_time = -1, -1, 0
+    if eventheader_key in frame:
+        header = frame[eventheader_key]
+        run_id, event_id = header.run_id, header.event_id
+        start_time = i3time_to_unix_ns(header.start_time.utc_year, header.start_time.utc_daq_time)
+    mask = 0
+    if filtermask_key in frame:
+        for name, result in frame[filtermask_key].items():
+            if result.prescale_passed:
+                mask |= 1 << bit_table.bit(name)
+    npulses = 0
+    if pulses_key in frame:
+        pulsemap = dataclasses.I3RecoPulseSeriesMap.from_frame(frame, pulses_key)
+        npulses = sum(len(pulses) for pulses in pulsemap.values())
+    return run_id, event_id, start_time, mask, npulses
+
+
+class EventIndexerI3Module(I3ConditionalModule):
+    """Index the Q frames on their way to the I3Writer.
+
+    Add it as the last module before the I3Writer, with the writer's streams,
+    so the filter bits are those of the written frames. Frame ordinals count
+    the frames the writer receives. Frames the writer adds itself in front
+    (its TrayInfo frame) are not counted, read_indexed_frames skips them."""
+
+    def __init__(self, context):
+        """Setting things up"""
+        I3ConditionalModule.__init__(self, context)
+        self.AddParameter("output_file",
+                          "npz file to write the index to",
+                          None)
+        self.AddParameter("i3_filename",
+                          "i3 file written by the I3Writer, recorded as the source of the index",
+                          None)
+        self.AddParameter("eventheader_key",
+                          "I3EventHeader to use",
+                          "I3EventHeader")
+        self.AddParameter("filtermask_key",
+                          "FilterMask to use",
+                          "OnlineFilterMask")
+        self.AddParameter("pulses_key",
+                          "Pulses to count",
+                          "I3SuperDST")
+        self.AddParameter("written_streams",
+                          "Streams written by the I3Writer",
+                          [I3Frame.DAQ, I3Frame.TrayInfo, I3Frame.Simulation, I3Frame.Stream("M")])
+
+    def Configure(self):
+        """Getting params"""
+        self.outfile = self.GetParameter("output_file")
+        self.i3_filename = self.GetParameter("i3_filename")
+        self.eventheader_key = self.GetParameter("eventheader_key")
+        self.filtermask_key = self.GetParameter("filtermask_key")
+        self.pulses_key = self.GetParameter("pulses_key")
+        self.written_streams = set(self.GetParameter("written_streams"))
+        self.frame_ordinal = 0
+        self.bit_table = FilterBitTable.canonical()
+        self.rows = {name: [] for name in COLUMNS}
+
+    def Process(self):
+        frame = self.PopFrame()
+        if frame.Stop == I3Frame.DAQ:
+            run_id, event_id, start_time, mask, npulses = _frame_row(
+                frame, self.eventheader_key, self.filtermask_key, self.pulses_key, self.bit_table)
+            self.rows["frame"].append(self.frame_ordinal)
+            self.rows["run_id"].append(run_id)
+            self.rows["event_id"].append(event_id)
+            self.rows["start_time"].append(start_time)
+            self.rows["filter_mask"].append(mask)
+            self.rows["npulses"].append(npulses)
+        if frame.Stop in self.written_streams:
+            self.frame_ordinal += 1
+        self.PushFrame(frame)
+
+    def Finish(self):
+        index = EventIndex(self.bit_table.names,
+                           {name: np.array(values, dtype=COLUMNS[name]) for name, values in self.rows.items()},
+                           source=None if self.i3_filename is None else str(self.i3_filename))
+        index.write(self.outfile)
+
+
+def index_i3_file(i3_filename, output_file=None, eventheader_key="I3EventHeader",
+                  filtermask_key="OnlineFilterMask", pulses_key="I3SuperDST"):
+    """Index the Q frames of an i3 file that was written without EventIndexerI3Module.
+
+    The frame ordinals are the positions of the frames in the file."""
+    bit_table = FilterBitTable.canonical()
+    rows = {name: [] for name in COLUMNS}
+    i3file = dataio.I3File(str(i3_filename))
+    try:
+        ordinal = 0
+        while i3file.more():
+            frame = i3file.pop_frame()
+            if frame.Stop == I3Frame.DAQ:
+                run_id, event_id, start_time, mask, npulses = _frame_row(
+                    frame, eventheader_key, filtermask_key, pulses_key, bit_table)
+                rows["frame"].append(ordinal)
+                rows["run_id"].append(run_id)
+                rows["event_id"].append(event_id)
+                rows["start_time"].append(start_time)
+                rows["filter_mask"].append(mask)
+                rows["npulses"].append(npulses)
+            ordinal += 1
+    finally:
+        i3file.close()
+    index = EventIndex(bit_table.names,
+                       {name: np.array(values, dtype=COLUMNS[name]) for name, values in rows.items()},
+                       source=str(i3_filename))
+    if output_file is not None:
+        index.write(output_file)
+    return index
+
+
+def _leading_frames(i3file, index, i3_filename):
+    """Frames in the file before the first indexed frame that the index does not count.
+
+    These are the frames the I3Writer wrote itself, before the first frame it
+    received. The first indexed frame is the first Q frame of the file."""
+    ordinal = 0
+    i3file.rewind()
+    while i3file.more():
+        frame = i3file.pop_frame()
+        if frame.Stop == I3Frame.DAQ:
+            return ordinal - int(index.frame[0])
+        ordinal += 1
+    raise ValueError(f"{i3_filename} has no Q frames, index out of sync")
+
+
+def read_indexed_frames(i3_filename, index, rows, eventheader_key="I3EventHeader"):
+    """Yield the Q frames of the given index rows, seeking instead of decoding every frame.
+
+    Each frame is checked against the run/event id of its index row."""
+    i3file = dataio.I3File(str(i3_filename))
+    try:
+        offset = None
+        for row in rows:
+            if offset is None:
+                offset = _leading_frames(i3file, index, i3_filename)
+            i3file.seek(offset + int(index.frame[row]))
+            frame = i3file.pop_frame()
+            if frame is None or frame.Stop != I3Frame.DAQ:
+                raise ValueError(f"Frame {index.frame[row]} of {i3_filename} is not a Q frame, index out of sync")
+            # Frames cleaned after indexing may have lost their header
+            if index.run_id[row] >= 0 and eventheader_key in frame:
+                header = frame[eventheader_key]
+                if (header.run_id, header.event_id) != (index.run_id[row], index.event_id[row]):
+                    raise ValueError(f"Frame {index.frame[row]} of {i3_filename} is run {header.run_id} "
+                                     f"event {header.event_id}, index says run {index.run_id[row]} "
+                                     f"event {index.event_id[row]}")
+            yield frame
+    finally:
+        i3file.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("Usage: python3 -m monitoring_extractors.pass3_event_indexer <i3 file> <index npz>")
+        sys.exit(1)
+    index_i3_file(sys.argv[1], sys.argv[2])
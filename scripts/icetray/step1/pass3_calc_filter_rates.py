@@ -1,49 +1,139 @@
 """Utility to calculate filter rates from filtered output files."""
 # ruff: noqa: T201
 import argparse
-from typing import cast
+import concurrent.futures
+import json
+import os
+from typing import Optional, cast
 
 from pathlib import Path
 
 from icecube import dataclasses, dataio, icetray  # noqa: F401
 
-def get_rates(infiles: list[str], outfile: str):
-    start_time = None
-    stop_time = None
-    frame_cnt = 0
-    header_cnt = 0
-    filter_cnt = {}  # type: dict[str,int]
-    for file in infiles:
-        infile = dataio.I3File(file)
-        while infile.more():
-            try:
-                frame = infile.pop_daq()
-            except Exception: # ruff: noqa: BLE001
-                break
-            frame_cnt += 1
-            # handle times
-            if "I3EventHeader" in frame:
-                header_cnt += 1
-                header = cast(dataclasses.I3EventHeader, frame["I3EventHeader"])
-                if start_time is None:
-                    # Save the first event time
-                    start_time = header.start_time
-                # Save the event time as potential last...
-                stop_time = header.start_time
-            if "OnlineFilterMask" in frame:
-                fm = cast(dataclasses.I3FilterResultMap, frame["OnlineFilterMask"])
-                for name in fm.keys():
-                    if fm[name].prescale_passed:
-                        if name in filter_cnt:
-                            filter_cnt[name] += 1
-                        else:
-                            filter_cnt[name] = 1
+SIDECAR_SUFFIX = ".txt"
 
+
+def _empty_partial() -> dict:
+    """Mergeable summary of one file.
+
+    start/stop are (utc_year, utc_daq_time) of the first and last event
+    header in file order, so they can be passed between processes and
+    turned back into I3Time."""
+    return {
+        "start": None,
+        "stop": None,
+        "frame_count": 0,
+        "header_count": 0,
+        "filter_counts": {},
+    }
+
+
+def get_file_partial(file: str) -> dict:
+    """Count frames, headers and passed filters of one i3 file."""
+    partial = _empty_partial()
+    filter_cnt = partial["filter_counts"]  # type: dict[str,int]
+    infile = dataio.I3File(file)
+    while infile.more():
+        try:
+            frame = infile.pop_daq()
+        except Exception: # ruff: noqa: BLE001
+            break
+        partial["frame_count"] += 1
+        # handle times
+        if "I3EventHeader" in frame:
+            partial["header_count"] += 1
+            header = cast(dataclasses.I3EventHeader, frame["I3EventHeader"])
+            event_time = (header.start_time.utc_year, header.start_time.utc_daq_time)
+            if partial["start"] is None:
+                # Save the first event time
+                partial["start"] = event_time
+            # Save the event time as potential last...
+            partial["stop"] = event_time
+        if "OnlineFilterMask" in frame:
+            fm = cast(dataclasses.I3FilterResultMap, frame["OnlineFilterMask"])
+            for name, result in fm.items():
+                if result.prescale_passed:
+                    filter_cnt[name] = filter_cnt.get(name, 0) + 1
+    infile.close()
+    return partial
+
+
+def read_sidecar_partial(sidecar: Path) -> Optional[dict]:
+    """Summary of one file from the JSON written by FilterRateMonitorI3Module.
+
+    Only sidecars with raw counts and the first and last event time in file
+    order give the same summary as decoding the file. Returns None for
+    older sidecars (rates only, or min/max times) and unreadable ones, so the
+    file is decoded instead."""
+    try:
+        with open(sidecar) as f:
+            moni = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(moni, dict) or not all(
+            key in moni for key in ("filter_counts", "first_event_time", "last_event_time")):
+        return None
+
+    partial = _empty_partial()
+    partial["frame_count"] = moni["frame_count"]
+    partial["header_count"] = moni["header_count"]
+    partial["filter_counts"] = dict(moni["filter_counts"])
+    partial["start"] = tuple(moni["first_event_time"])
+    partial["stop"] = tuple(moni["last_event_time"])
+    return partial
+
+
+def get_partial(file: str, use_sidecars: bool = True) -> dict:
+    """Summary of one file, from its sidecar if possible."""
+    if use_sidecars:
+        sidecar = Path(file + SIDECAR_SUFFIX)
+        if sidecar.is_file():
+            partial = read_sidecar_partial(sidecar)
+            if partial is not None:
+                return partial
+    return get_file_partial(file)
+
+
+def merge_partials(partials: list[dict]) -> dict:
+    """Combine per-file summaries in input file order, like a single serial pass.
+
+    As in the serial loop, start is the first event of the first file and
+    stop the last event of the last file with events, in the order the files
+    are given (not sorted by time). The livetime is stop - start, which is
+    the sum over files of the time from the previous file's last event to the
+    file's own last event."""
+    merged = _empty_partial()
+    filter_cnt = merged["filter_counts"]
+    for partial in partials:
+        if partial["start"] is not None:
+            if merged["start"] is None:
+                merged["start"] = partial["start"]
+            merged["stop"] = partial["stop"]
+        merged["frame_count"] += partial["frame_count"]
+        merged["header_count"] += partial["header_count"]
+        for name, count in partial["filter_counts"].items():
+            filter_cnt[name] = filter_cnt.get(name, 0) + count
+    return merged
+
+
+def get_rates(infiles: list[str], outfile: str, num_workers: int = 1, use_sidecars: bool = True):
+    if num_workers > 1 and len(infiles) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            partials = list(executor.map(get_partial, infiles, [use_sidecars] * len(infiles)))
+    else:
+        partials = [get_partial(file, use_sidecars) for file in infiles]
+    merged = merge_partials(partials)
+
+    filter_cnt = merged["filter_counts"]
+    frame_cnt = merged["frame_count"]
+    header_cnt = merged["header_count"]
     print(filter_cnt)
     print(frame_cnt)
     print(header_cnt)
-    assert start_time is not None  # noqa: S101
-    assert stop_time is not None  # noqa: S101
+    assert merged["start"] is not None  # noqa: S101
+    assert merged["stop"] is not None  # noqa: S101
+    start_time = dataclasses.I3Time(*merged["start"])
+    stop_time = dataclasses.I3Time(*merged["stop"])
     time_l = (stop_time - start_time) / 1.0E9
     if time_l < 0:
         raise ValueError("Invalid time length, quitting")
@@ -68,6 +158,14 @@ if __name__ == "__main__":
                         help="input files",
                         nargs="+",
                         required=True)
+    parser.add_argument("-j", "--num-workers",
+                        help="number of files to process in parallel",
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--no-sidecars",
+                        help=f"always decode the i3 files, even if a {SIDECAR_SUFFIX} filter rate sidecar exists",
+                        action="store_true",
+                        default=False)
     args = parser.parse_args()
 
-    get_rates(args.infiles, args.outfile)
+    get_rates(args.infiles, args.outfile, args.num_workers, not args.no_sidecars)
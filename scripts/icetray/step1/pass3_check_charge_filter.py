@@ -23,6 +23,10 @@ parser.add_argument("-g","--gcd",
                     dest="GCD",
                     required=True,
                     help="GCD File to be used for unpacking")
+parser.add_argument("--qa-store",
+                    dest="QA_STORE",
+                    default=None,
+                    help="SQLite QA results store to insert the filter counts into")
 args = parser.parse_args()
 
 icetray.set_log_level_for_unit('I3Tray', icetray.I3LogLevel.LOG_TRACE)
@@ -36,7 +40,9 @@ tray.Add(ChargeMonitorI3Module, "charge_histogram",
          output_file_path = args.OUTPUT_FILENAME + ".npz")
 
 tray.Add(FilterRateMonitorI3Module, "filter_rates",
-         output_file = args.OUTPUT_FILENAME + ".txt")
+         output_file = args.OUTPUT_FILENAME + ".txt",
+         binned_output_file = args.OUTPUT_FILENAME + ".filter_rates.npz",
+         qa_store = args.QA_STORE)
 
 tray.Add(PulseChargeFilterHarvester, "charge_harvester",
          PulseSeriesMapKey = "I3SuperDST",
@@ -31,6 +31,19 @@ parser.add_argument("-q", "--qify",
 parser.add_argument("--filter-rates",
                     dest="filter_rates", action='store_true', default=False,
                     help="Calculate and log filter rates.")
+parser.add_argument("--compact-histograms",
+                    dest="compact_histograms", action='store_true', default=False,
+                    help="Write the compact charge histogram format (see charge_histogram_format) instead of "
+                         "the full (87, 61, nbins) float32 histograms. Read it with utils/charge_histograms.py.")
+parser.add_argument("--sparse-histograms",
+                    dest="sparse_histograms", action='store_true', default=False,
+                    help="Only store the non-empty charge bins of each DOM. Requires --compact-histograms.")
+parser.add_argument("--compress-histograms",
+                    dest="compress_histograms", action='store_true', default=False,
+                    help="Compress the charge histogram file.")
+parser.add_argument("--qa-store",
+                    dest="qa_store", default=None,
+                    help="SQLite QA results store to insert the filter counts into. Requires --filter-rates.")
 args = parser.parse_args()
 
 icetray.set_log_level_for_unit('I3Tray', icetray.I3LogLevel.LOG_INFO)
@@ -46,7 +59,10 @@ if args.qify:
 
 tray.Add(PulseChargeFilterHarvester, "charge_harvester",
          PulseSeriesMapKey = "I3SuperDST",
-         OutputFilename = args.OUTPUT_FILENAME + ".fadc_atwd_charge.npz"
+         OutputFilename = args.OUTPUT_FILENAME + ".fadc_atwd_charge.npz",
+         CompactHistograms = args.compact_histograms,
+         SparseHistograms = args.sparse_histograms,
+         CompressHistograms = args.compress_histograms,
          )
 
 if args.filter_rates:
@@ -55,7 +71,9 @@ if args.filter_rates:
     tray.Add(FilterRateMonitorI3Module, "filter_rate_monitor",
             eventheader_key = "I3EventHeader",
             filtermask_key = "OnlineFilterMask",
-            output_file = args.OUTPUT_FILENAME + ".filter_rates.txt"
+            output_file = args.OUTPUT_FILENAME + ".filter_rates.txt",
+            binned_output_file = args.OUTPUT_FILENAME + ".filter_rates.npz",
+            qa_store = args.qa_store
             )
 
 tray.Execute()
@@ -7,6 +7,10 @@ import math
 import json
 import argparse
 
+import numpy as np
+
+from gcd_cache import DEFAULT_CACHE_DIR, get_gcd_tables, omkey_str
+
 icetray.set_log_level_for_unit('I3Tray', icetray.I3LogLevel.LOG_TRACE)
 
 class CheckPass3GCDI3Module(I3ConditionalModule):
@@ -57,6 +61,52 @@ class CheckPass3GCDI3Module(I3ConditionalModule):
                     raise ValueError(f"FADC gain correction incorrect applied. OLD FADC gain value without {old_fadc_gains[key]} and with  {error_number} correction and CORRECTED FADC gain value {item.fadc_gain}. Delta between values {corr_applied}" )
         self.PushFrame(frame)
 
+def check_pass3_gcd_tables(tables, fadc_corrs, fadc_gain_key="Original_FADC_Gain"):
+    """Same checks as CheckPass3GCDI3Module, on a cached GCD (see gcd_cache.py).
+
+    All DOMs are checked at once; the error is raised for the first failing
+    DOM in OMKey order, with the same message as the module."""
+    if fadc_gain_key not in tables.maps:
+        raise Exception(f"Old FADC gain key {fadc_gain_key} not found in frame")
+    cal = tables.cal
+    rows = np.flatnonzero(tables.in_ice(cal.omkey))
+    omkeys = cal.omkey[rows]
+    atwd_corr = cal["mean_atwd_charge_correction"][rows]
+    fadc_corr = cal["mean_fadc_charge_correction"][rows]
+    dom_eff = cal["relative_dom_eff"][rows]
+    fadc_gain = cal["fadc_gain"][rows]
+
+    old_gains = tables.maps[fadc_gain_key]
+    gain_rows = old_gains.lookup(omkeys)
+    has_old_gain = gain_rows >= 0
+    expected_gain = np.full(len(rows), np.nan)
+    for i in np.flatnonzero(has_old_gain):
+        string, om = int(omkeys[i] >> 32), int((omkeys[i] >> 16) & 0xFFFF)
+        expected_gain[i] = old_gains["value"][gain_rows[i]] / fadc_corrs[f"{string},{om}"]
+    corr_applied = fadc_gain - expected_gain
+
+    with np.errstate(invalid="ignore"):
+        failures = [
+            (atwd_corr != 1.0) & ~np.isnan(atwd_corr),
+            (fadc_corr != 1.0) & ~np.isnan(fadc_corr),
+            np.isnan(dom_eff),
+            has_old_gain & (corr_applied != 0) & ~np.isnan(corr_applied),
+        ]
+    failed = np.flatnonzero(np.any(failures, axis=0))
+    if len(failed) == 0:
+        return
+    i = failed[0]
+    key = omkey_str(omkeys[i])
+    if failures[0][i]:
+        raise ValueError(f"mean ATWD charge is not for DOM {key}. Set to {atwd_corr[i]}")
+    if failures[1][i]:
+        raise ValueError(f"mean FADC charge is not 1 for DOM {key}. set to {fadc_corr[i]}")
+    if failures[2][i]:
+        raise ValueError(f"relative DOM efficiency is nan for DOM {key}")
+    old_gain = old_gains["value"][gain_rows[i]]
+    raise ValueError(f"FADC gain correction incorrect applied. OLD FADC gain value without {old_gain} and with  {expected_gain[i]} correction and CORRECTED FADC gain value {fadc_gain[i]}. Delta between values {corr_applied[i]}" )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-g","--gcd",
@@ -67,16 +117,25 @@ if __name__ == "__main__":
                         dest="corr",
                         required=True,
                         help="FADC gain correction JSON")
+    parser.add_argument("--cache-dir",
+                        default=None,
+                        help=("Check the columnar GCD tables in this cache directory (see gcd_cache.py) "
+                              "instead of running CheckPass3GCDI3Module in a tray. The GCD is extracted "
+                              f"into it if it is not cached yet, e.g. {DEFAULT_CACHE_DIR}"))
     args = parser.parse_args()
 
-    tray = I3Tray()
-
-    # icetray.set_log_level_for_unit('I3Tray', icetray.I3LogLevel.LOG_TRACE)
+    if args.cache_dir is not None:
+        with open(args.corr, "r") as f:
+            corrs = json.load(f)["FADC_gain_correction"]
+        check_pass3_gcd_tables(get_gcd_tables(args.GCD, args.cache_dir), corrs,
+                               fadc_gain_key="Original_FADC_Gain")
+    else:
+        tray = I3Tray()
 
-    tray.Add(dataio.I3Reader, "reader", FilenameList=[args.GCD])
+        tray.Add(dataio.I3Reader, "reader", FilenameList=[args.GCD])
 
-    tray.Add(CheckPass3GCDI3Module, "gcd_checker",
-             fadc_gain_correction_json=args.corr,
-             old_fadc_gain_key="Original_FADC_Gain")
+        tray.Add(CheckPass3GCDI3Module, "gcd_checker",
+                 fadc_gain_correction_json=args.corr,
+                 old_fadc_gain_key="Original_FADC_Gain")
 
-    tray.Execute()
+        tray.Execute()
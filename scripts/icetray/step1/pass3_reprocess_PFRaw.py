@@ -15,6 +15,7 @@ Options:
     --qify                     Apply QConverter if input file contains only P frames
     -n, --num                  Number of frames to process (default: -1 = all frames)
     -s, --sim                  Input data is simulation
+    --index-output             Write an event index of the output file (npz)
 
 Example:  python pass3_process_PFRaw --qify -g PFGCD_Run00137496_Subrun00000000_pass3.i3.gz -i \
     ./PFRaw_PhysicsFiltering_Run00137496_Subrun00000000_00000000.tar.gz -o test.i3
@@ -53,6 +54,8 @@ parser.add_argument("-s", "--sim", action="store_true", default=False,
                     dest="SIM", help="Input data is simulation.")
 parser.add_argument("-n", "--nframes", action="store", default=-1, type=int, dest="NFRAMES",
                     help="Number of frames to process. Use a small number for testing")
+parser.add_argument("--index-output", action="store", default=None, dest="INDEX_OUTPUT",
+                    help="Write an event index of the output file to this npz file")
 args = parser.parse_args()
 
 # prep the logging
@@ -258,12 +261,22 @@ def check_q_frame_keys(frame, keylist):
 #               end_date=leap_tmax)
 
 
+output_streams = [icetray.I3Frame.DAQ,
+                  icetray.I3Frame.TrayInfo,
+                  icetray.I3Frame.Simulation,
+                  icetray.I3Frame.Stream("M")]
+
+# Index the frames as they are written, after all cleaning and frame dropping
+if args.INDEX_OUTPUT:
+    from monitoring_extractors.pass3_event_indexer import EventIndexerI3Module
+    tray.Add(EventIndexerI3Module, "event_indexer",
+             output_file=args.INDEX_OUTPUT,
+             i3_filename=args.OUTPUT,
+             written_streams=output_streams)
+
 # Write the physics and DAQ frames
 tray.AddModule("I3Writer", "EventWriter", filename=args.OUTPUT,
-                   Streams=[icetray.I3Frame.DAQ,
-                            icetray.I3Frame.TrayInfo,
-                            icetray.I3Frame.Simulation,
-                            icetray.I3Frame.Stream("M")])
+                   Streams=output_streams)
 
 if args.NFRAMES > 0:
     tray.Execute(args.NFRAMES)
@@ -8,12 +8,20 @@
 -- set domcal.mean_fadc_charge_correction = 1.0
 * Run audit for pass3 on output GCD file, written to file <outgcd_audit>
 
+With --batch, many GCDs are corrected in a process pool in one invocation, with a
+one line summary per GCD instead of the per-DOM messages. The corrections are
+loaded once into an array indexed by [string, om], and the written GCDs are
+checked for the expected number of frames.
+
 """
 
+import concurrent.futures
 import math
 import sys
 import argparse
 import json
+
+import numpy as np
 from icecube import icetray, dataclasses, dataio #NOQA: F401
 from icecube.offline_filterscripts.gcd_generation import get_nan_doms, run_gcd_audit_pass3
 
@@ -30,12 +38,39 @@ icetray.logging.set_level("INFO")
 # icetray.logging.log_info(f"len(fadc) {len(fadc)} fadc {fadc}")
 
 
+def fadc_correction_table(fadc_corrections: dict) -> np.ndarray:
+    """FADC gain corrections as an array indexed by [string, om], NaN where there is none.
+
+    fadc_corrections is the correction JSON, {"FADC_gain_correction": {"string,om": factor}}."""
+    corrections = fadc_corrections["FADC_gain_correction"]
+    keys = [tuple(int(v) for v in key.split(",")) for key in corrections]
+    table = np.full((max(k[0] for k in keys) + 1, max(k[1] for k in keys) + 1), np.nan)
+    for (string, om), factor in zip(keys, corrections.values()):
+        table[string, om] = factor
+    return table
+
+
+def lookup_fadc_correction(table: np.ndarray, key) -> float:
+    if 0 <= key.string < table.shape[0] and 0 <= key.om < table.shape[1] and not math.isnan(table[key.string, key.om]):
+        return table[key.string, key.om]
+    raise KeyError(f"{key.string},{key.om}")
+
+
 def correct_gcd_file(infile: str,
                      outfile: str,
-                     fadc_corrections: dict,
+                     fadc_corrections,
                      fadc_db: dict = {},
                      mean_atwd_charge = 1.,
-                     mean_fadc_charge = 1.):
+                     mean_fadc_charge = 1.,
+                     verbose: bool = True) -> dict:
+    """Correct one GCD file, see the module docstring.
+
+    fadc_corrections is the correction JSON or its fadc_correction_table.
+    Per-DOM messages are only printed with verbose. Returns a summary with
+    the number of corrected DOMs and written frames."""
+
+    if isinstance(fadc_corrections, dict):
+        fadc_corrections = fadc_correction_table(fadc_corrections)
 
     gcdfile_in = dataio.I3File(infile, "r")
 
@@ -43,6 +78,16 @@ def correct_gcd_file(infile: str,
 
     old_atdw_cal = []
     old_fadc_cal = []
+    summary = {
+        "infile": infile,
+        "outfile": outfile,
+        "in_ice_doms": 0,
+        "atwd_corrected": 0,
+        "fadc_corrected": 0,
+        "dom_eff_corrected": 0,
+        "fadc_gain_corrected": 0,
+        "frames": 0,
+    }
 
     while gcdfile_in.more():
         frame = gcdfile_in.pop_frame()
@@ -51,47 +96,59 @@ def correct_gcd_file(infile: str,
             cal_o = calitem.dom_cal  # type: ignore[attr-defined]
             geo = frame["I3Geometry"]
             geo_o = geo.omgeo
+            original_gains = dict(frame["Original_FADC_Gain"]) if "Original_FADC_Gain" in frame else {}
+            new_gains = {}
             for key, item in cal_o.items():
                 # Consider only InIce DOMs
-                if key in geo.omgeo and geo.omgeo[key].omtype == dataclasses.I3OMGeo.IceCube:
+                if key in geo_o and geo_o[key].omtype == dataclasses.I3OMGeo.IceCube:
+                    summary["in_ice_doms"] += 1
                     old_atdw_cal.append(item.mean_atwd_charge_correction)
                     # Change nan value for dom with audit error
                     if not math.isnan(item.mean_atwd_charge_correction) and item.mean_atwd_charge_correction != mean_atwd_charge:
-                        print(f"correct ATWD charge correction for DOM {key}")
+                        if verbose: print(f"correct ATWD charge correction for DOM {key}")
                         item.mean_atwd_charge_correction = mean_atwd_charge 
+                        summary["atwd_corrected"] += 1
                     old_fadc_cal.append(item.mean_fadc_charge_correction)
                     # Change nan value for dom with audit error
                     if not math.isnan(item.mean_fadc_charge_correction) and item.mean_fadc_charge_correction != mean_fadc_charge:
-                        print(f"correct FADC charge correction for DOM {key}")
+                        if verbose: print(f"correct FADC charge correction for DOM {key}")
                         item.mean_fadc_charge_correction = mean_fadc_charge 
+                        summary["fadc_corrected"] += 1
                     if math.isnan(item.relative_dom_eff):
-                        print(f"correct relative DOM efficiency for DOM {key}")
+                        if verbose: print(f"correct relative DOM efficiency for DOM {key}")
                         item.relative_dom_eff = 1.0
-                    if ("Original_FADC_Gain" not in frame) or (key not in frame["Original_FADC_Gain"].keys()):
-                        key_str = f"{key.string},{key.om}"
-                        print(f"FADC gain file  {item.fadc_gain} for DOM {key}")
-                        if fadc_db: print(f"FADC gain server {fadc_db[key_str]} for DOM {key}")
-                        if fadc_db: print(f"{(item.fadc_gain/fadc_db[key_str] - 1.)*100. }")
-                        if "Original_FADC_Gain" not in frame:
-                            frame["Original_FADC_Gain"] = dataclasses.I3MapKeyDouble({key: item.fadc_gain})
-                        else:
-                            frame["Original_FADC_Gain"].update({key: item.fadc_gain})
-                        item.fadc_gain = item.fadc_gain/(fadc_corrections['FADC_gain_correction'][f"{key.string},{key.om}"])
-                        print(f"AFTER CORRECTION FADC gain {item.fadc_gain} for DOM {key}")
+                        summary["dom_eff_corrected"] += 1
+                    if key not in original_gains:
+                        if verbose:
+                            key_str = f"{key.string},{key.om}"
+                            print(f"FADC gain file  {item.fadc_gain} for DOM {key}")
+                            if fadc_db: print(f"FADC gain server {fadc_db[key_str]} for DOM {key}")
+                            if fadc_db: print(f"{(item.fadc_gain/fadc_db[key_str] - 1.)*100. }")
+                        new_gains[key] = item.fadc_gain
+                        item.fadc_gain = item.fadc_gain/lookup_fadc_correction(fadc_corrections, key)
+                        summary["fadc_gain_corrected"] += 1
+                        if verbose: print(f"AFTER CORRECTION FADC gain {item.fadc_gain} for DOM {key}")
                     cal_o[key] = item
             calitem.dom_cal = cal_o  # type: ignore[attr-defined]
             frame.Delete("I3Calibration")
             frame["I3Calibration"] = calitem
+            if new_gains:
+                original_gains.update(new_gains)
+                if "Original_FADC_Gain" in frame:
+                    frame.Delete("Original_FADC_Gain")
+                frame["Original_FADC_Gain"] = dataclasses.I3MapKeyDouble(original_gains)
 
         elif frame.Stop == icetray.I3Frame.DetectorStatus:    
             bdl = "BadDomsList"
-            if bdl in frame:
+            if bdl in frame and verbose:
                 icetray.logging.log_info(f"len({bdl}) {len(frame[bdl])} {bdl} {frame[bdl]}")
 
         gcdfile_out.push(frame)
+        summary["frames"] += 1
 
     gcdfile_in.close()
     gcdfile_out.close()
+    return summary
 
 # Output GCD file audit, also look for DOMs with charge correction not = 1
 # icetray.logging.rotating_files(outfile_audit)
@@ -111,33 +168,110 @@ def parse_json(file: str) -> dict:
         data = json.load(f)
     return data
 
+
+def count_frames(filename: str) -> int:
+    """Number of frames in a written GCD file, like dataio's scan.py -c."""
+    count = 0
+    with dataio.I3File(filename, "r") as f:
+        while f.more():
+            f.pop_frame()
+            count += 1
+    return count
+
+
+def load_batch(filename: str) -> list:
+    """GCDs of a batch, one "infile outfile [inaudit outaudit]" line per GCD."""
+    entries = []
+    with open(filename, "r") as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) not in (2, 4):
+                raise ValueError(f"Expected infile outfile [inaudit outaudit] in {filename}, got: {line.strip()}")
+            entries.append(fields)
+    return entries
+
+
+def process_batch_gcd(fields: list, corrections: np.ndarray, fadc_db: dict, expected_frames: int) -> dict:
+    """Audit, correct and check one GCD of a batch. Failures are returned in the summary."""
+    infile, outfile = fields[:2]
+    inaudit, outaudit = fields[2:] if len(fields) == 4 else (None, None)
+    try:
+        if inaudit:
+            icetray.logging.rotating_files(inaudit)
+            run_gcd_audit_pass3(infile, nan_error = True, not1_error = False)
+        summary = correct_gcd_file(infile, outfile, corrections, fadc_db, verbose=False)
+        if outaudit:
+            icetray.logging.rotating_files(outaudit)
+            summary["outaudit_rc"] = run_gcd_audit_pass3(outfile, nan_error = True, not1_error = True)
+        summary["frames_read"] = count_frames(outfile)
+        if summary["frames_read"] != expected_frames:
+            summary["error"] = f"{summary['frames_read']} frames in output, expected {expected_frames}"
+    except Exception as exc:
+        return {"infile": infile, "outfile": outfile, "error": f"{type(exc).__name__}: {exc}"}
+    return summary
+
+
+def run_batch(batch_file: str, fadc_corr: dict, fadc_db: dict, num_workers: int, expected_frames: int) -> int:
+    """Correct all GCDs of a batch file in a process pool. Returns the number of failed GCDs."""
+    entries = load_batch(batch_file)
+    corrections = fadc_correction_table(fadc_corr)
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(process_batch_gcd, fields, corrections, fadc_db, expected_frames)
+                   for fields in entries]
+        for future in concurrent.futures.as_completed(futures):
+            summary = future.result()
+            if "error" in summary:
+                failed += 1
+                print(f"FAILED {summary['infile']}: {summary['error']}")
+                continue
+            print(f"{summary['infile']} -> {summary['outfile']}: {summary['in_ice_doms']} in-ice DOMs, "
+                  f"corrected ATWD {summary['atwd_corrected']}, FADC {summary['fadc_corrected']}, "
+                  f"DOM eff {summary['dom_eff_corrected']}, FADC gain {summary['fadc_gain_corrected']}, "
+                  f"{summary['frames_read']} frames")
+    print(f"Corrected {len(entries) - failed} GCDs, {failed} failed")
+    return failed
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='pass3_update_gcd_chargecorr')
-    parser.add_argument("-i", "--infile", dest="infile", type=str, required=True)
-    parser.add_argument("-o", "--outfile", dest="outfile", type=str, required=True)
-    parser.add_argument("--inaudit", dest="inaudit", type=str, required=True)
-    parser.add_argument("--outaudit", dest="outaudit", type=str, required=True)
+    parser.add_argument("-i", "--infile", dest="infile", type=str)
+    parser.add_argument("-o", "--outfile", dest="outfile", type=str)
+    parser.add_argument("--inaudit", dest="inaudit", type=str)
+    parser.add_argument("--outaudit", dest="outaudit", type=str)
     parser.add_argument("--fadc-correction", dest="fadc_corr", type=str, required=True)
     parser.add_argument("--fadc-gcddb", dest="fadc_gcddb", type=str, required=False)
+    parser.add_argument("--batch", dest="batch", type=str, default=None,
+                        help="Correct all GCDs of this file, one 'infile outfile [inaudit outaudit]' line per GCD")
+    parser.add_argument("-j", "--num-workers", dest="num_workers", type=int, default=1,
+                        help="Number of processes for --batch")
+    parser.add_argument("--expected-frames", dest="expected_frames", type=int, default=4,
+                        help="Number of frames every corrected GCD must have in --batch mode")
     args = parser.parse_args()
 
+    fadc_corr = parse_json(args.fadc_corr)
+    fadc_gcddb = parse_json(args.fadc_gcddb) if args.fadc_gcddb else {}
+
+    if args.batch:
+        icetray.logging.log_warn(f"Fixing GCD input files for Pass3 from: {args.batch}")
+        icetray.logging.log_warn(f"Using Correction file: {args.fadc_corr}")
+        sys.exit(1 if run_batch(args.batch, fadc_corr, fadc_gcddb, args.num_workers, args.expected_frames) else 0)
+
+    if not (args.infile and args.outfile and args.inaudit and args.outaudit):
+        parser.error("-i, -o, --inaudit and --outaudit are required without --batch")
 
     icetray.logging.log_warn(f"Fixing GCD input file for Pass3: {args.infile}")
     icetray.logging.log_warn(f"Writing GCD: {args.outfile}")
     icetray.logging.log_warn(f"Using Correction file: {args.fadc_corr}")
     icetray.logging.log_warn(f"Using database file: {args.fadc_gcddb}")
 
-    fadc_corr = parse_json(args.fadc_corr)
-
     icetray.logging.rotating_files(args.inaudit)
     # Input GCD file audit, look for DOMs with nan error
     rc = run_gcd_audit_pass3(args.infile, nan_error = True, not1_error = False)
 
-    if args.fadc_gcddb:
-        fadc_gcddb = parse_json(args.fadc_gcddb)
-        correct_gcd_file(args.infile, args.outfile, fadc_corr, fadc_gcddb)
-    else:
-        correct_gcd_file(args.infile, args.outfile, fadc_corr)
+    correct_gcd_file(args.infile, args.outfile, fadc_corr, fadc_gcddb)
 
     icetray.logging.rotating_files(args.outaudit)
     rc = run_gcd_audit_pass3(args.outfile, nan_error = True, not1_error = True)
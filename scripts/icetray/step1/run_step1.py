@@ -11,6 +11,7 @@ import time
 import zipfile
 import re
 import concurrent.futures
+import functools
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Union, Optional, Set
@@ -323,7 +324,7 @@ def check_gcd_file(gcdfile: Path) -> bool:
         raise Exception(f"GCD file {gcdfile} does not have correct values")
     return True
 
-def runner(infiles: RunnerInput) -> dict:
+def runner(infiles: RunnerInput, event_index: bool = False) -> dict:
 
     # Getting file and file paths
     # Tuple of 5 paths/values:
@@ -405,6 +406,8 @@ def runner(infiles: RunnerInput) -> dict:
         local_gcd,
         local_outfile,
         qify = True)
+    if event_index:
+        command += f" --index-output {local_outfile}.index.npz"
     moni_command = generate_command(
         Path("/opt/pass3/scripts/icetray/step1/pass3_check_charge_filter.py"),
         local_outfile,
@@ -460,7 +463,7 @@ def runner(infiles: RunnerInput) -> dict:
         return {"status": "ERROR", "msg": f"Output file {outfile} is not a valid i3 file."}
 
     print("Copying moni files")
-    for suffix in [".npz", ".fadc_atwd_charge.npz", ".fadc_atwd_charge.npz.comparison", ".txt"]:
+    for suffix in [".npz", ".fadc_atwd_charge.npz", ".fadc_atwd_charge.npz.comparison", ".txt", ".filter_rates.npz", ".index.npz"]:
         src = Path(str(local_outfile) + suffix)
         dst = Path(str(outfile) + suffix)
         try:
@@ -497,6 +500,7 @@ def get_data_into_filecatalog_format(file: Path, checksum: str) -> dict:
 def run_parallel(
     infiles: list[RunnerInput],
     max_num: int = 1,
+    event_index: bool = False,
 ):
     if not infiles:
         raise Exception(f"ERROR: NO INPUTS PROVIDED")
@@ -510,7 +514,7 @@ def run_parallel(
     files_already_existing = []
 
     with concurrent.futures.ProcessPoolExecutor(max_workers=max_num) as executor:
-        results = executor.map(runner, infiles)
+        results = executor.map(functools.partial(runner, event_index=event_index), infiles)
         for res in results:
             print(res)
             if res.get("status") == "SUCCESS":
@@ -555,6 +559,7 @@ if __name__ == "__main__":
     parser.add_argument("--grl", help="good run list", type=Path, required=True)
     parser.add_argument("--badfiles", help="known bad files list", type=Path, required=True)
     parser.add_argument("--transferbundle", help="transfer bundle from tape", action='store_true')
+    parser.add_argument("--event-index", help="write an event index (<output>.index.npz) of every output file", action='store_true')
     parser.add_argument(
         "--duplicate-skip-json",
         help="Path to per-bundle JSON listing duplicate members to skip",
@@ -614,7 +619,7 @@ if __name__ == "__main__":
     if not inputs:
         raise Exception(f"ERROR: NO INPUTS FOR BUNDLE {args.bundle}")
 
-    run_parallel(inputs, numcpus)
+    run_parallel(inputs, numcpus, args.event_index)
 
     # TODO: Delete bundle
     # shutil.rmtree(args.bundle)
@@ -0,0 +1,228 @@
+"""Persistent index of bundle members for cross-bundle duplicate detection.
+
+Every bundle's manifest is read once into an SQLite index of (bundle, member
+basename, manifest sha512). The index spans all years and months that were
+ever indexed. The skip list of a bundle is then one indexed query over its
+members, instead of re-reading the manifests of every selected bundle.
+
+Members with the same basename and the same sha512 (or no sha512 to compare)
+are true duplicates: the bundle with the smallest YYYY/MMDD/<name> key, the
+order of the archive paths, processes the member and all others skip it.
+Members with the same basename but different checksums are name collisions.
+They are reported and not skipped.
+
+Usage:
+    python3 duplicate_index.py <index.sqlite> update <bundle zips or directories> [-j N]
+    python3 duplicate_index.py <index.sqlite> duplicates <bundle zip>
+    python3 duplicate_index.py <index.sqlite> collisions
+"""
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+STEP1_SCRIPT_DIR = Path(__file__).resolve().parents[2] / "icetray" / "step1"
+MANIFEST_UTILS_PATH = STEP1_SCRIPT_DIR / "manifest_utils.py"
+MANIFEST_UTILS_SPEC = importlib.util.spec_from_file_location("step1_manifest_utils", MANIFEST_UTILS_PATH)
+if MANIFEST_UTILS_SPEC is None or MANIFEST_UTILS_SPEC.loader is None:
+    raise ImportError(f"Could not load manifest utilities from {MANIFEST_UTILS_PATH}")
+
+manifest_utils = importlib.util.module_from_spec(MANIFEST_UTILS_SPEC)
+MANIFEST_UTILS_SPEC.loader.exec_module(manifest_utils)
+
+Manifest = manifest_utils.Manifest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bundles (
+    bundle TEXT PRIMARY KEY,
+    sort_key TEXT,
+    archive TEXT,
+    local TEXT,
+    mtime_ns INTEGER,
+    size INTEGER,
+    manifest TEXT,
+    n_members INTEGER,
+    updated REAL
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    bundle TEXT,
+    name TEXT,
+    sha512 TEXT,
+    PRIMARY KEY (bundle, name)
+);
+CREATE INDEX IF NOT EXISTS members_name ON members (name, sha512);
+"""
+
+
+def bundle_sort_key(bundle: Path) -> str:
+    """YYYY/MMDD/<name> of an archive (.../YYYY/unbiased/PFRaw/MMDD/<name>) or
+    local (.../YYYY/MMDD/<name>) bundle path, ordered like the archive paths."""
+    parts = Path(bundle).parts
+    mmdd = parts[-2] if len(parts) >= 2 else ""
+    year = next((part for part in reversed(parts[:-2]) if len(part) == 4 and part.isdigit()), "")
+    return f"{year}/{mmdd}/{Path(bundle).name}"
+
+
+def read_bundle_manifest(local_bundle: str) -> dict:
+    """Members and sha512s of the manifest inside a local bundle zip."""
+    stat = os.stat(local_bundle)
+    result = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "manifest": None, "members": [], "sha512s": []}
+    try:
+        text_member = manifest_utils.read_manifest_from_zip(Path(local_bundle))
+    except Exception as e:
+        print(f"Warning: could not read the manifest of {local_bundle}: {e}")
+        return result
+    if text_member is None:
+        return result
+    text, member = text_member
+    manifest = Manifest.from_text(text)
+    result.update(manifest=f"zip:{member}", members=manifest.members, sha512s=manifest.sha512s)
+    return result
+
+
+class DuplicateIndex:
+    def __init__(self, db_path: Union[str, Path]):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, local_by_archive: dict[Path, Path], num_workers: int = 1) -> dict:
+        """Index the bundles whose local zip is new or changed, reading the manifests in parallel.
+
+        local_by_archive maps the archive path of each bundle to its local zip."""
+        known = {bundle: (mtime_ns, size) for bundle, mtime_ns, size
+                 in self.conn.execute("SELECT bundle, mtime_ns, size FROM bundles")}
+        todo = []
+        renamed = []
+        for archive, local in sorted(local_by_archive.items(), key=lambda kv: str(kv[0])):
+            stat = local.stat()
+            if known.get(archive.name) != (stat.st_mtime_ns, stat.st_size):
+                todo.append((archive, local))
+            elif archive != local:
+                # Indexed from the local tree before, record the archive path
+                renamed.append((str(archive), bundle_sort_key(archive), archive.name))
+        with self.conn:
+            self.conn.executemany("UPDATE bundles SET archive = ?, sort_key = ? WHERE bundle = ?", renamed)
+
+        counts = {"bundles": len(local_by_archive), "indexed": 0, "members": 0, "without_manifest": 0}
+        now = time.time()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(read_bundle_manifest, [str(local) for _, local in todo], chunksize=4)
+            for (archive, local), result in zip(todo, results):
+                members = {}
+                for name, sha512 in zip(result["members"], result["sha512s"]):
+                    name = name.strip()
+                    if name:
+                        members[name] = sha512
+                with self.conn:
+                    self.conn.execute("DELETE FROM members WHERE bundle = ?", (archive.name,))
+                    self.conn.executemany("INSERT INTO members (bundle, name, sha512) VALUES (?, ?, ?)",
+                                          [(archive.name, name, sha512) for name, sha512 in members.items()])
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO bundles (bundle, sort_key, archive, local, mtime_ns, size, manifest, "
+                        "n_members, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (archive.name, bundle_sort_key(archive), str(archive), str(local), result["mtime_ns"],
+                         result["size"], result["manifest"], len(members), now),
+                    )
+                counts["indexed"] += 1
+                counts["members"] += len(members)
+                if result["manifest"] is None:
+                    counts["without_manifest"] += 1
+        return counts
+
+    def manifest_source(self, bundle: Path) -> Optional[str]:
+        row = self.conn.execute("SELECT manifest FROM bundles WHERE bundle = ?", (bundle.name,)).fetchone()
+        return row[0] if row else None
+
+    def duplicates(self, bundle: Path) -> tuple[list[str], dict[str, str], dict[str, list[str]]]:
+        """(skip members, {member: winner archive}, {member: [colliding archives]}) of one bundle,
+        from the members of all indexed bundles with the same basenames."""
+        rows = self.conn.execute(
+            "SELECT m.name, m.sha512, o.sha512, b.sort_key, b.archive FROM members m "
+            "JOIN members o ON o.name = m.name AND o.bundle != m.bundle "
+            "JOIN bundles b ON b.bundle = o.bundle "
+            "WHERE m.bundle = ?", (bundle.name,))
+        own_key = bundle_sort_key(bundle)
+        winners: dict[str, tuple[str, str]] = {}
+        collisions: dict[str, list[str]] = defaultdict(list)
+        for name, sha512, other_sha512, other_key, other_archive in rows:
+            if sha512 and other_sha512 and sha512 != other_sha512:
+                collisions[name].append(other_archive)
+            elif other_key < own_key and (name not in winners or other_key < winners[name][0]):
+                winners[name] = (other_key, other_archive)
+        return (
+            sorted(winners),
+            {name: archive for name, (_, archive) in sorted(winners.items())},
+            {name: sorted(archives) for name, archives in sorted(collisions.items())},
+        )
+
+    def collisions(self) -> list[tuple]:
+        """(member, number of distinct checksums, bundles) of all name collisions."""
+        cursor = self.conn.execute(
+            "SELECT name, COUNT(DISTINCT sha512), GROUP_CONCAT(bundle) FROM members WHERE sha512 IS NOT NULL "
+            "GROUP BY name HAVING COUNT(DISTINCT sha512) > 1 ORDER BY name")
+        return [(name, n, sorted(bundles.split(","))) for name, n, bundles in cursor]
+
+
+def find_bundles(locations: Iterable[Path]) -> list[Path]:
+    bundles = []
+    for location in locations:
+        if location.is_dir():
+            for root, _, filenames in os.walk(location):
+                bundles.extend(Path(root) / name for name in filenames if name.endswith(".zip"))
+        elif location.is_file():
+            bundles.append(location)
+    return sorted(bundles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the cross-bundle duplicate index")
+    parser.add_argument("index", type=Path, help="SQLite file of the duplicate index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    update_parser = subparsers.add_parser("update", help="Index new and changed local bundles")
+    update_parser.add_argument("locations", type=Path, nargs="+", help="Bundle zips or directories (YYYY/MMDD/<zip>)")
+    update_parser.add_argument("-j", "--num-workers", type=int, default=os.cpu_count() or 1)
+
+    duplicates_parser = subparsers.add_parser("duplicates", help="Skip list and collisions of one bundle")
+    duplicates_parser.add_argument("bundle", type=Path)
+
+    subparsers.add_parser("collisions", help="Members with the same name and different checksums")
+
+    args = parser.parse_args()
+
+    with DuplicateIndex(args.index) as index:
+        if args.command == "update":
+            bundles = find_bundles(args.locations)
+            counts = index.update({bundle: bundle for bundle in bundles}, args.num_workers)
+            print(f"Indexed {counts['indexed']} of {counts['bundles']} bundles ({counts['members']} members, "
+                  f"{counts['without_manifest']} without manifest)")
+        elif args.command == "duplicates":
+            skip, winners, collisions = index.duplicates(args.bundle)
+            for name in skip:
+                print(f"skip {name} (processed in {winners[name]})")
+            for name, archives in collisions.items():
+                print(f"collision {name} with {' '.join(archives)}")
+        elif args.command == "collisions":
+            for name, n, bundles in index.collisions():
+                print(f"{name} {n} checksums in {' '.join(bundles)}")
+
+
+if __name__ == "__main__":
+    main()
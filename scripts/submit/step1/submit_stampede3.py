@@ -9,6 +9,8 @@ from pathlib import Path
 from collections import defaultdict
 from itertools import islice
 
+from duplicate_index import DuplicateIndex
+
 
 STEP1_SCRIPT_DIR = Path(__file__).resolve().parents[2] / "icetray" / "step1"
 MANIFEST_UTILS_PATH = STEP1_SCRIPT_DIR / "manifest_utils.py"
@@ -23,6 +25,16 @@ extract_manifest_members_from_text = manifest_utils.extract_manifest_members_fro
 find_manifest_members_in_zip = manifest_utils.find_manifest_members_in_zip
 read_manifest_from_zip = manifest_utils.read_manifest_from_zip
 
+CHECKSUM_CATALOG_PATH = STEP1_SCRIPT_DIR / "checksum_catalog.py"
+CHECKSUM_CATALOG_SPEC = importlib.util.spec_from_file_location("step1_checksum_catalog", CHECKSUM_CATALOG_PATH)
+if CHECKSUM_CATALOG_SPEC is None or CHECKSUM_CATALOG_SPEC.loader is None:
+    raise ImportError(f"Could not load the checksum catalog from {CHECKSUM_CATALOG_PATH}")
+
+checksum_catalog = importlib.util.module_from_spec(CHECKSUM_CATALOG_SPEC)
+CHECKSUM_CATALOG_SPEC.loader.exec_module(checksum_catalog)
+
+ChecksumCatalog = checksum_catalog.ChecksumCatalog
+
 
 def normalize_member_path(path: str) -> str:
     path = str(path).strip()
@@ -154,6 +166,41 @@ def compute_duplicate_skip_lists(
         }
     return result
 
+def compute_duplicate_skip_lists_indexed(
+    index: DuplicateIndex,
+    bundles: list[Path],
+    local_bundle_by_archive: Optional[Dict[Path, Path]] = None,
+    num_workers: int = 1,
+) -> dict[Path, dict[str, object]]:
+    """Like compute_duplicate_skip_lists, from the persistent duplicate index.
+
+    The index is first updated with the selected bundles. Duplicates are then
+    decided across all indexed bundles (all years and months), by member name
+    and manifest sha512. Members with the same name but a different sha512 are
+    listed as collisions and not skipped.
+    """
+    local_bundle_by_archive = local_bundle_by_archive or {b: b for b in bundles}
+    counts = index.update({b: local_bundle_by_archive.get(b, b) for b in bundles}, num_workers)
+    print(f"Duplicate index: {counts['indexed']} of {counts['bundles']} bundles (re)indexed")
+
+    result: dict[Path, dict[str, object]] = {}
+    now = datetime.now(timezone.utc).isoformat()
+    for bundle in bundles:
+        skip_members, winners, collisions = index.duplicates(bundle)
+        for member, others in collisions.items():
+            print(f"Warning: {member} in {bundle} has a different checksum in {', '.join(others)}")
+        result[bundle] = {
+            "bundle": str(bundle),
+            "local_bundle": str(local_bundle_by_archive.get(bundle, bundle)),
+            "created": now,
+            "manifest": index.manifest_source(bundle),
+            "skip_members": skip_members,
+            "winners": winners,
+            "collisions": collisions,
+            "duplicate_index": str(index.db_path),
+        }
+    return result
+
 def chunks(data, SIZE=10000):
     # taken from stackoverflow to chunk dict for < python 3.12
     it = iter(data.items())
@@ -253,36 +300,6 @@ def write_srun_multiprog(file: Path,
                 f.write(f"{i}  echo  \"extra tasks to make srun happy\"\n")
 
 
-def month_in_path(file_path: str,
-                  month: int) -> bool:
-    """Example path on Ranch:
-    old ranch: /stornext/ranch_01/ranch/projects/TG-PHY150040/data/exp/IceCube/2020/unbiased/PFRaw/0420/7202275ab7a111eb8013bedaff42a7c6.zip
-    new ranch: /scoutfs/projects/TG-PHY150040/data/exp/IceCube/2020/unbiased/PFRaw/0420/7202275ab7a111eb8013bedaff42a7c6.zip"""
-    if month ==  int(get_date_filepath(file_path)[0:2]):
-        return True
-    return False
-
-def year_in_path(file_path: str,
-                 year: int) -> bool:
-    if str(year) == get_year_filepath(file_path):
-        return True
-    return False
-
-def get_file_checksums(file_path: Path) -> dict[Path, str]:
-    """Reading in the checksum file"""
-    tmp_checksums: dict[Path, str] = {}
-    with Path.open(file_path, "r") as f:
-        while line := f.readline():
-            line = line.rstrip()
-            # Assuming each line is formatted (<sha512sum> <absolute_file_path>) and space separated
-            checksum, archive_path = line.split()
-            tmp_checksums[Path(archive_path)] = checksum
-    return tmp_checksums
-
-
-def _sorted_dict_by_key(d: dict[Path, str]) -> dict[Path, str]:
-    return dict(sorted(d.items(), key=lambda kv: str(kv[0])))
-
 def get_checksum_year_month(file_path: Path,
                             year: int,
                             month: int,
@@ -292,12 +309,7 @@ def get_checksum_year_month(file_path: Path,
     """
     if numnodes <= 0:
         raise Exception(f"Number of nodes {numnodes} has to be >= 1")
-    tmp_checksums = get_file_checksums(file_path)
-    filtered_checksum = { key: value for key, value in tmp_checksums.items() 
-                         if year_in_path(key, year) and (month != 0 and month_in_path(key, month))}
-    filtered_checksum = _sorted_dict_by_key(filtered_checksum)
-    # tmp_checksums[Path(archive_path)] = checksum
-    # tmp_checksums = OrderedDict(sorted(tmp_checksums.items()))
+    filtered_checksum = ChecksumCatalog.from_file(file_path).month(year, month)
     if numnodes == 1:
         return [filtered_checksum]
     else:
@@ -310,11 +322,7 @@ def get_checksums_bundles(file_path: Path,
                           numnodes: int) -> list:
     if numnodes <= 0:
         raise Exception(f"Number of nodes {numnodes} has to be >= 1")
-    bundle_names = [b.name for b in bundles]
-    tmp_checksums = get_file_checksums(file_path)
-    filtered_checksum = { key: value for key, value in tmp_checksums.items() 
-                         if key.name in bundle_names}
-    filtered_checksum = _sorted_dict_by_key(filtered_checksum)
+    filtered_checksum = ChecksumCatalog.from_file(file_path).bundles(bundles)
     if numnodes == 1:
         return [filtered_checksum]
     else:
@@ -420,6 +428,21 @@ if __name__ == "__main__":
         type=Path,
         required=False,
     )
+    parser.add_argument(
+        "--duplicate-index",
+        help=(
+            "Persistent SQLite duplicate index (see duplicate_index.py). If given, duplicates are "
+            "decided by member name and sha512 across all indexed bundles instead of by name among "
+            "the selected bundles only."
+        ),
+        type=Path,
+        required=False,
+    )
+    parser.add_argument("--index-workers",
+                        help="number of processes reading bundle manifests into the duplicate index",
+                        type=int,
+                        default=8,
+                        required=False)
     parser.add_argument("--bundles",
                         help="a list of bundles to process",
                         nargs='+',
@@ -447,7 +470,12 @@ if __name__ == "__main__":
     for b in all_bundles:
         local_bundle_by_archive[b] = resolve_local_bundle_path(b, args.bundledir)
 
-    duplicate_skip_payload = compute_duplicate_skip_lists(all_bundles, local_bundle_by_archive=local_bundle_by_archive)
+    if args.duplicate_index is not None:
+        with DuplicateIndex(args.duplicate_index) as duplicate_index:
+            duplicate_skip_payload = compute_duplicate_skip_lists_indexed(
+                duplicate_index, all_bundles, local_bundle_by_archive, args.index_workers)
+    else:
+        duplicate_skip_payload = compute_duplicate_skip_lists(all_bundles, local_bundle_by_archive=local_bundle_by_archive)
 
     duplicate_skip_json_by_bundle: dict[Path, Path] = {}
     for bundle, payload in duplicate_skip_payload.items():